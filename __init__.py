@@ -4,16 +4,24 @@ __doc__ = """
 Helpful scripts and libraries for working with databases, dataframes, and cloud providers
 """
 
+import importlib
 import logging
 import sys
 logging.getLogger(__name__).addHandler(logging.NullHandler())
 
-from . import aws
-from . import db
-from . import df
-from . import io
-from . import util
-from . import viz
+# submodules are imported on first access (``lucid.db``), so that
+# ``import lucid`` does not pull in boto3, bokeh, jinja2, etc.
+__all__ = ['aws', 'db', 'df', 'gcp', 'io', 'util', 'viz']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
 
 #-----------------------------------------------------------------------------
 # Boilerplate for Notebooks
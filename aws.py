@@ -15,13 +15,28 @@ _l = logging.getLogger(__name__)
 #-----------------------------------------------------------------------------
 
 # External imports
+from bisect import bisect_left
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fnmatch import fnmatchcase
+from io import BytesIO, RawIOBase
+from itertools import islice
+from queue import Queue
+from threading import Event
 import base64
 import boto3
+import hashlib
 import json
+import mimetypes
 import os
 import pandas as pd
+import random
+import re
+import time
 
 # Lucid imports
+from .io import STREAM_ROWS, _atomic_write, object_cache, read_stream
 from .util import me
 
 
@@ -30,6 +45,39 @@ from .util import me
 # Globals & Constants
 #-----------------------------------------------------------------------------
 
+S3_TRANSFER = dict(  # boto3 TransferConfig of S3 uploads/downloads
+    multipart_threshold=2**26,
+    multipart_chunksize=2**26,
+    max_concurrency=16,
+)
+S3_LS_DEPTH = 2  # subfolder levels split into concurrent listings
+S3_LS_WORKERS = 16  # threads listing S3 prefixes
+AWS_RETRIES = 5  # retries of throttled AWS requests, with exponential backoff
+THROTTLING_CODES = {
+    'SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded',
+    'TooManyRequestsException', 'ServiceUnavailable', 'InternalError',
+    'RequestTimeout',
+}
+S3_RANGE_BLOCK = 2**20  # smallest ranged GET when reading Parquet from S3
+S3_FORMATS = {
+    'csv': 'csv', 'tsv': 'csv', 'txt': 'csv',
+    'parquet': 'parquet', 'pq': 'parquet',
+    'json': 'json', 'jsonl': 'jsonl', 'ndjson': 'jsonl',
+}
+S3_COMPRESSION = {'gz': 'gzip', 'zst': 'zstd', 'bz2': 'bz2', 'xz': 'xz'}
+S3_SELECT_COMPRESSION = {None: 'NONE', 'gzip': 'GZIP', 'bz2': 'BZIP2'}
+LAMBDA_CACHE = os.path.expanduser('~/.cache/lucid/lambdas/')  # function lists
+LAMBDA_TTL = 3600  # seconds before Lambdas lists functions again
+SESSION_PARAMS = {  # aws_params of boto3.Session; the rest go to the client
+    'aws_access_key_id', 'aws_secret_access_key', 'aws_session_token',
+    'region_name', 'botocore_session', 'profile_name', 'aws_account_id',
+}
+CONTENT_ENCODINGS = {'gz': 'gzip', 'br': 'br'}  # of precompressed web assets
+WEB_TYPES = {
+    'text/html', 'text/css', 'text/javascript', 'application/javascript',
+    'application/json', 'image/svg+xml',
+}
+
 
 #-----------------------------------------------------------------------------
 # AWS Services
@@ -46,41 +94,655 @@ class S3:
     )
     """
     
-    def __init__(self, **aws_params):
+    def __init__(self, transfer=None, cache=None, **aws_params):
         self.client = boto3.client('s3', **aws_params)
         self.resource = boto3.resource('s3', **aws_params)
-    
+        self.transfer = TransferConfig(**{**S3_TRANSFER, **(transfer or {})})
+        # ObjectCache (True for the shared one) used by cat and iter_lines
+        self.cache = object_cache() if cache is True else cache
+
     def cat(self, s3url, encoding='utf-8'):
-        """Prints (like Bash ``cat``) an S3 file."""
-        s3url_parts = s3url.split('/', maxsplit=3)
-        _bucket = s3url_parts[2]
-        _key = s3url_parts[3]   
-
-        o = self.client.get_object(Bucket=_bucket, Key=_key)
-        # open the file object and read it into the variable filedata. 
-        filedata = o['Body'].read()
-
-        # file data will be a binary stream.  We have to decode it 
-        contents = filedata.decode(encoding)
-        print(contents)
+        """Prints (like Bash ``cat``) an S3 file, line by line."""
+        for line in self.iter_lines(s3url, encoding=encoding):
+            print(line)
         return None
 
-    def ls(self, bucket, subfolder):
-        """List files inside a subfolder."""
-        o = self.resource.Bucket(bucket).objects
-        return [f.key for f in o.filter(Prefix=subfolder).all()]
+    def iter_lines(self, s3url, encoding='utf-8', chunk_size=S3_RANGE_BLOCK):
+        """Yields lines of an S3 text file as they are downloaded."""
+        if self.cache:
+            with open(self.fetch(s3url, self.cache), 'rb') as f:
+                for line in f:
+                    yield line.rstrip(b'\r\n').decode(encoding)
+            return
+        _bucket, _key = _split_s3url(s3url)
+        body = self.client.get_object(Bucket=_bucket, Key=_key)['Body']
+        for line in body.iter_lines(chunk_size=chunk_size):
+            yield line.decode(encoding)
+
+    def fetch(self, s3url, cache=None) -> str:
+        """Local path of an S3 object, downloaded only if it changed.
+
+        Objects are kept in an ObjectCache (the shared one by default)
+        by URL and ETag.  A cached object is revalidated with a
+        conditional GET (``IfNoneMatch``), which sends no data if the
+        object is unchanged.
+        """
+
+        cache = cache or self.cache or object_cache()
+        _bucket, _key = _split_s3url(s3url)
+        etag = cache.ref(s3url)
+        request = {'Bucket': _bucket, 'Key': _key}
+        if etag and cache.get(s3url, etag):
+            request['IfNoneMatch'] = f'"{etag}"'
+        try:
+            o = _retry(self.client.get_object, **request)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+                _l.debug(f'{me()} {s3url} not modified')
+                return cache.get(s3url, etag)
+            raise
+        etag = o['ETag'].strip('"')
+        path = cache.put((s3url, etag), o['Body'].iter_chunks(S3_RANGE_BLOCK))
+        cache.set_ref(s3url, etag)
+        _l.debug(f'{me()} cached {s3url} at {path}')
+        return path
 
-    def rm(self, bucket, subfolder, flags='rf'):
-        """Recursively delete objects from a subfolder."""
-        o = self.resource.Bucket(bucket).objects
-        if flags == 'rf':
-            o.filter(Prefix=subfolder).delete()
+    def get(self, s3url, file):
+        """Downloads an S3 file, in concurrent parts if it is big."""
+        _bucket, _key = _split_s3url(s3url)
+        self.client.download_file(_bucket, _key, file, Config=self.transfer)
         return None
 
+    def put(self, file, s3url, **extra_args):
+        """Uploads a file to S3, in concurrent parts if it is big.
+
+        ``extra_args`` (*e.g.* ``ContentType``) go to ``upload_file``.
+        """
+        _bucket, _key = _split_s3url(s3url)
+        self.client.upload_file(file, _bucket, _key, Config=self.transfer,
+                                ExtraArgs=extra_args or None)
+        return None
+
+    def read_df(self, s3url, fmt=None, columns=None, row_groups=None,
+                chunksize=None, **kwargs):
+        """Reads a CSV, Parquet or JSON file from S3 into a DataFrame.
+
+        Parquet is read with ranged GETs: the footer, then only the
+        selected columns and row groups.  Text formats are downloaded in
+        concurrent parts, or streamed in batches with ``chunksize``.
+
+        :Args:
+            :s3url: ``s3://bucket/key``
+            :fmt: ``'csv'``, ``'parquet'``, ``'json'`` or ``'jsonl'``
+                (defaults to the file extension)
+            :columns: columns to read
+            :row_groups: Parquet row groups to read
+            :chunksize: yield DataFrames of this many rows; Parquet and
+                JSON documents are buffered in memory first
+            :kwargs: keyword arguments for the pandas/pyarrow reader
+
+        :Returns:
+            pd.DataFrame (a generator of them with ``chunksize``)
+        """
+
+        _bucket, _key = _split_s3url(s3url)
+        fmt, compression = _s3_format(_key, fmt)
+        if fmt == 'csv' and re.search(r'\.tsv(\.\w+)?$', _key):
+            kwargs.setdefault('sep', '\t')
+        if columns is not None and fmt == 'csv':
+            kwargs['usecols'] = columns
+        try:
+            if chunksize:
+                body = self.client.get_object(Bucket=_bucket, Key=_key)['Body']
+                return read_stream(body.iter_chunks(S3_RANGE_BLOCK),
+                                   fmt=fmt, chunksize=chunksize,
+                                   decompress=compression or 'auto', **kwargs)
+            if fmt == 'parquet':
+                import pyarrow.parquet as pq
+                pf = pq.ParquetFile(_S3RangeFile(self.client, _bucket, _key))
+                if row_groups is None:
+                    table = pf.read(columns=columns, **kwargs)
+                else:
+                    table = pf.read_row_groups(
+                        row_groups, columns=columns, **kwargs)
+                df = table.to_pandas()
+            else:
+                buf = BytesIO()
+                self.client.download_fileobj(
+                    _bucket, _key, buf, Config=self.transfer)
+                buf.seek(0)
+                if fmt == 'csv':
+                    df = pd.read_csv(buf, compression=compression, **kwargs)
+                else:
+                    df = pd.read_json(buf, lines=(fmt == 'jsonl'),
+                                      compression=compression, **kwargs)
+                    if columns is not None:
+                        df = df[columns]
+            _l.info(f'{me()} read {df.shape} from {s3url}')
+            return df
+        except Exception as e:
+            _l.error(f'{me()} {s3url}: {e}')
+            return None
+
+    def write_df(self, df, s3url, fmt=None, **kwargs):
+        """Writes a DataFrame to S3 as CSV, Parquet or JSON.
+
+        The file is serialized in memory and uploaded in concurrent parts.
+        Compression follows the extension, *e.g.* ``.csv.gz``.
+
+        :Args:
+            :df: DataFrame
+            :s3url: ``s3://bucket/key``
+            :fmt: ``'csv'``, ``'parquet'``, ``'json'`` or ``'jsonl'``
+                (defaults to the file extension)
+            :kwargs: keyword arguments for the pandas writer
+        """
+
+        _bucket, _key = _split_s3url(s3url)
+        fmt, compression = _s3_format(_key, fmt)
+        buf = BytesIO()
+        if fmt == 'parquet':
+            df.to_parquet(buf, **kwargs)
+        elif fmt == 'csv':
+            kwargs.setdefault('index', False)
+            if re.search(r'\.tsv(\.\w+)?$', _key):
+                kwargs.setdefault('sep', '\t')
+            df.to_csv(buf, compression=compression, **kwargs)
+        else:
+            kwargs.setdefault('orient', 'records')
+            df.to_json(buf, lines=(fmt == 'jsonl'), compression=compression,
+                       **kwargs)
+        size = buf.tell()
+        buf.seek(0)
+        self.client.upload_fileobj(buf, _bucket, _key, Config=self.transfer)
+        _l.info(f'{me()} wrote {df.shape} ({size} bytes) to {s3url}')
+        return None
+
+    def ls(self, bucket, subfolder, detail=False, pattern=None, regex=None,
+           n_workers=S3_LS_WORKERS):
+        """List files inside a subfolder.
+
+        :Args:
+            :bucket: bucket name
+            :subfolder: key prefix
+            :detail: return a DataFrame of key, size, last_modified, etag
+                and storage_class instead of a list of keys
+            :pattern: glob pattern keys must match, *e.g.* ``'*.csv'``
+            :regex: regular expression keys must contain
+            :n_workers: threads listing subfolders concurrently
+
+        :Returns:
+            sorted list of keys, or pd.DataFrame
+        """
+
+        objects = self.iter_ls(bucket, subfolder, pattern, regex, n_workers)
+        if not detail:
+            return sorted(o['Key'] for o in objects)
+        return _ls_frame(objects)
+
+    def iter_ls(self, bucket, prefix, pattern=None, regex=None,
+                n_workers=S3_LS_WORKERS, delimiter='/'):
+        """Yields objects under a prefix as their listing pages arrive.
+
+        The prefix is split on ``delimiter`` into subfolders, up to
+        ``S3_LS_DEPTH`` levels down or until there are ``n_workers`` of
+        them, and the subfolders are listed concurrently with
+        ``list_objects_v2``.  Objects come unordered, as dicts with
+        ``Key``, ``Size``, ``LastModified``, ``ETag`` and ``StorageClass``.
+        """
+
+        match = _key_filter(pattern, regex)
+        shards = [prefix]
+        stop = Event()
+        pages = Queue()
+
+        def list_shard(shard, delimiter=None):
+            try:
+                for page in self._list_pages(bucket, shard, delimiter):
+                    if stop.is_set():
+                        break
+                    pages.put(page)
+            except Exception as e:
+                pages.put(e)
+            finally:
+                pages.put(None)
+
+        def drain(shards, delimiter=None):
+            for shard in shards:
+                pool.submit(list_shard, shard, delimiter)
+            running = len(shards)
+            while running:
+                page = pages.get()
+                if page is None:
+                    running -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            try:
+                for _ in range(S3_LS_DEPTH):
+                    subfolders = []
+                    for page in drain(shards, delimiter):
+                        yield from filter(match, page.get('Contents', []))
+                        subfolders += [p['Prefix']
+                                       for p in page.get('CommonPrefixes', [])]
+                    shards = subfolders
+                    if not shards or len(shards) >= n_workers:
+                        break
+                _l.debug(f'{me()} listing {len(shards)} prefixes of {prefix}')
+
+                for page in drain(shards):
+                    yield from filter(match, page.get('Contents', []))
+            finally:
+                stop.set()
+
+    def _list_pages(self, bucket, prefix, delimiter=None):
+        """Yields ``list_objects_v2`` pages of a prefix."""
+        paginator = self.client.get_paginator('list_objects_v2')
+        kwargs = {'Delimiter': delimiter} if delimiter else {}
+        yield from paginator.paginate(Bucket=bucket, Prefix=prefix, **kwargs)
+
+    def query(self, s3url, columns=None, where=None, fmt=None,
+              chunksize=STREAM_ROWS, select=True, **kwargs):
+        """Yields DataFrame chunks of selected columns/rows of an S3 file.
+
+        The projection and filters are sent to S3 Select, which streams
+        back only the matching records.  If Select is not available (or
+        ``select=False``), the file is filtered locally: Parquet is read
+        with ranged GETs, skipping row groups by their statistics, and
+        CSV/JSON are streamed and filtered chunk by chunk (a JSON document
+        is buffered in memory first).
+
+        :Args:
+            :s3url: ``s3://bucket/key``
+            :columns: columns to return (all by default)
+            :where: filters, all of which must hold, as
+                ``[(column, op, value), ...]`` with ``op`` one of
+                ``= != < <= > >= in``, *e.g.* ``[('year', '>=', 2020)]``
+            :fmt: ``'csv'``, ``'parquet'``, ``'json'`` or ``'jsonl'``
+                (defaults to the file extension)
+            :chunksize: rows per DataFrame
+            :select: try S3 Select first
+            :kwargs: keyword arguments for the local CSV reader
+
+        :Usage:
+            ::
+
+                df = pd.concat(s3.query(
+                    's3://bucket/events.csv.gz',
+                    columns=['id', 'value'],
+                    where=[('country', 'in', ['US', 'CA']), ('value', '>', 0)],
+                ))
+        """
+
+        _bucket, _key = _split_s3url(s3url)
+        fmt, compression = _s3_format(_key, fmt)
+        if fmt not in set(S3_FORMATS.values()):
+            raise ValueError(f'cannot query {fmt} files')
+        where = where or []
+        if select and compression not in S3_SELECT_COMPRESSION:
+            _l.info(f'{me()} S3 Select cannot read {compression}, '
+                    'filtering locally')
+        elif select:
+            started = False
+            try:
+                for df in self._select(_bucket, _key, fmt, compression,
+                                       columns, where, chunksize):
+                    started = True
+                    yield df
+                return
+            except ClientError as e:
+                if started:  # falling back would repeat rows
+                    raise
+                _l.warning(f'{me()} S3 Select failed, filtering locally: {e}')
+
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            table = pq.read_table(
+                _S3RangeFile(self.client, _bucket, _key),
+                columns=columns,
+                filters=[_arrow_filter(w) for w in where] or None,
+            )
+            for batch in table.to_batches(max_chunksize=chunksize):
+                yield batch.to_pandas()
+            return
+
+        body = self.client.get_object(Bucket=_bucket, Key=_key)['Body']
+        if re.search(r'\.tsv(\.\w+)?$', _key):
+            kwargs.setdefault('sep', '\t')
+        for df in read_stream(body.iter_chunks(S3_RANGE_BLOCK), fmt=fmt,
+                              chunksize=chunksize,
+                              decompress=compression or 'auto', **kwargs):
+            if where:
+                df = df[_where_mask(df, where)]
+            yield df if columns is None else df[columns]
+
+    def _select(self, bucket, key, fmt, compression, columns, where,
+                chunksize):
+        """Runs ``select_object_content``; yields DataFrames of records."""
+
+        codec = S3_SELECT_COMPRESSION.get(compression, 'NONE')
+        if fmt == 'parquet':
+            serialization = {'Parquet': {}}
+        elif fmt == 'csv':
+            serialization = {
+                'CSV': {
+                    'FileHeaderInfo': 'USE',
+                    'FieldDelimiter': '\t' if re.search(
+                        r'\.tsv(\.\w+)?$', key) else ',',
+                },
+                'CompressionType': codec,
+            }
+        else:
+            serialization = {
+                'JSON': {'Type': 'LINES' if fmt == 'jsonl' else 'DOCUMENT'},
+                'CompressionType': codec,
+            }
+        response = _retry(
+            self.client.select_object_content,
+            Bucket=bucket,
+            Key=key,
+            Expression=_select_sql(columns, where, cast=(fmt == 'csv')),
+            ExpressionType='SQL',
+            InputSerialization=serialization,
+            OutputSerialization={'JSON': {'RecordDelimiter': '\n'}},
+        )
+
+        def frame(lines):
+            df = pd.DataFrame.from_records([json.loads(l) for l in lines])
+            if columns is not None:
+                df = df.reindex(columns=columns)
+            return df.apply(_numeric) if fmt == 'csv' else df
+
+        tail, lines = b'', []
+        for event in response['Payload']:
+            if 'Records' not in event:
+                continue
+            *complete, tail = (tail + event['Records']['Payload']).split(b'\n')
+            lines += [l for l in complete if l]
+            while len(lines) >= chunksize:
+                yield frame(lines[:chunksize])
+                lines = lines[chunksize:]
+        lines += [tail] if tail.strip() else []
+        if lines:
+            yield frame(lines)
+
+
+    def rm(self, bucket, subfolder, flags='rf', dry_run=False, versions=False,
+           pattern=None, regex=None, n_workers=S3_LS_WORKERS):
+        """Recursively delete objects from a subfolder.
+
+        Keys are deleted while they are listed, in batches of 1,000 sent
+        concurrently; throttled requests are retried with backoff.
+
+        :Args:
+            :bucket: bucket name
+            :subfolder: key prefix
+            :flags: only ``'rf'`` deletes anything
+            :dry_run: return what would be deleted, delete nothing
+            :versions: delete all versions and delete markers
+                (in versioned buckets)
+            :pattern: glob pattern keys must match
+            :regex: regular expression keys must contain
+            :n_workers: threads sending delete requests
+
+        :Returns:
+            * list of keys (``(key, version)`` with ``versions``) if dry run
+            * number of objects deleted otherwise
+        """
+
+        if flags != 'rf':
+            return None
+        if versions:
+            match = _key_filter(pattern, regex)
+            objects = (o for o in self._list_versions(bucket, subfolder)
+                       if match(o))
+        else:
+            objects = self.iter_ls(bucket, subfolder, pattern, regex, n_workers)
+        objects = (
+            {'Key': o['Key'], **({'VersionId': o['VersionId']}
+                                 if versions else {})}
+            for o in objects
+        )
+        if dry_run:
+            return [(o['Key'], o['VersionId']) if versions else o['Key']
+                    for o in objects]
+
+        deleted, pending = 0, []
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            for batch in _batches(objects, 1000):
+                pending.append(pool.submit(self._delete_batch, bucket, batch))
+                while len(pending) > 2 * n_workers or \
+                        (pending and pending[0].done()):
+                    done = pending.pop(0).result()
+                    if (deleted + done) // 100_000 > deleted // 100_000:
+                        _l.info(f'{me()} deleted {deleted + done} objects ...')
+                    deleted += done
+            for future in pending:
+                deleted += future.result()
+        _l.info(f'{me()} deleted {deleted} objects from s3://{bucket}/{subfolder}')
+        return deleted
+
+    def sync(self, src, dst, delete=False, n_workers=S3_LS_WORKERS):
+        """Syncs a local folder and an S3 prefix, in either direction.
+
+        Files are transferred if they are missing or differ in size.  If
+        only the source is newer, the local MD5 is compared with the
+        ETag (see ``_s3_etag`` for multipart uploads), so unchanged
+        content is skipped.
+        Downloads take the object's LastModified as mtime.
+
+        Precompressed web assets (*e.g.* ``page.html.gz``, ``data.json.br``)
+        are uploaded with ``ContentEncoding`` and the ``ContentType`` of
+        the uncompressed file, so they can be served as they are.
+
+        :Args:
+            :src: local folder or ``s3://bucket/prefix``
+            :dst: S3 prefix or local folder
+            :delete: delete destination files missing from the source
+            :n_workers: concurrent file transfers
+
+        :Returns:
+            dict with counts and bytes transferred, skipped and deleted
+
+        :Usage:
+            ::
+
+                s3.sync(io.WWWFOLDER, 's3://bucket/www/', delete=True)
+        """
+
+        upload = not src.startswith('s3://')
+        local, s3url = (src, dst) if upload else (dst, src)
+        _bucket, prefix = _split_s3url(s3url)
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        t0 = time.perf_counter()
+
+        local_files = _local_files(local)
+        remote = {
+            o['Key'][len(prefix):]: o
+            for o in self.iter_ls(_bucket, prefix, n_workers=n_workers)
+            if not o['Key'].endswith('/')
+        }
+        source, target = (local_files, remote) if upload else \
+            (remote, local_files)
+
+        extraneous = sorted(set(target) - set(source)) if delete else []
+
+        def needed(item):
+            rel, info = item
+            return self._sync_needed(rel, info, target.get(rel), local, upload)
+
+        def transfer(rel):
+            path = os.path.join(local, *rel.split('/'))
+            if upload:
+                self.client.upload_file(
+                    path, _bucket, prefix + rel, Config=self.transfer,
+                    ExtraArgs=_upload_args(rel))
+            else:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                self.client.download_file(
+                    _bucket, prefix + rel, path, Config=self.transfer)
+                mtime = source[rel]['LastModified'].timestamp()
+                os.utime(path, (mtime, mtime))
+            return _sync_size(source[rel])
+
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            # local MD5s (of files newer than their copy) are hashed in parallel
+            flags = pool.map(needed, source.items())
+            changed = [rel for rel, flag in zip(source, flags) if flag]
+            skipped = sum(_sync_size(source[rel])
+                          for rel in set(source) - set(changed))
+            report = {'transferred': 0, 'bytes': 0,
+                      'skipped': len(source) - len(changed),
+                      'skipped_bytes': skipped, 'deleted': 0, 'errors': 0}
+            futures = {pool.submit(transfer, rel): rel for rel in changed}
+            for future in as_completed(futures):
+                try:
+                    report['bytes'] += future.result()
+                    report['transferred'] += 1
+                except Exception as e:
+                    report['errors'] += 1
+                    _l.error(f'{me()} {futures[future]}: {e}')
+
+            if extraneous and upload:
+                batches = _batches(({'Key': prefix + rel} for rel in extraneous),
+                                   1000)
+                report['deleted'] = sum(pool.map(
+                    lambda b: self._delete_batch(_bucket, b), batches))
+        if extraneous and not upload:
+            for rel in extraneous:
+                os.remove(os.path.join(local, *rel.split('/')))
+            report['deleted'] = len(extraneous)
+
+        report['seconds'] = time.perf_counter() - t0
+        _l.info(f'{me()} {src} -> {dst}: {report["transferred"]} files '
+                f'({report["bytes"]} bytes) transferred, {report["skipped"]} '
+                f'skipped, {report["deleted"]} deleted')
+        return report
+
+    def _sync_needed(self, rel, info, other, local, upload) -> bool:
+        """Whether a sync source file differs from its destination."""
+        if other is None:
+            return True
+        if _sync_size(info) != _sync_size(other):
+            return True
+        local_info, remote = (info, other) if upload else (other, info)
+        local_mtime = local_info['mtime']
+        remote_mtime = remote['LastModified'].timestamp()
+        newer = local_mtime > remote_mtime if upload else \
+            remote_mtime > local_mtime
+        if not newer:
+            return False
+        path = os.path.join(local, *rel.split('/'))
+        etag = remote['ETag'].strip('"')
+        return _s3_etag(path, etag, self.transfer.multipart_chunksize) != etag
+
+    def _delete_batch(self, bucket, batch, retries=AWS_RETRIES) -> int:
+        """Deletes up to 1,000 objects, retrying throttled keys."""
+        deleted, failed = 0, []
+        for attempt in range(retries + 1):
+            response = _retry(self.client.delete_objects, Bucket=bucket,
+                              Delete={'Objects': batch, 'Quiet': True})
+            errors = response.get('Errors', [])
+            deleted += len(batch) - len(errors)
+            throttled = {(e['Key'], e.get('VersionId')) for e in errors
+                         if e.get('Code') in THROTTLING_CODES}
+            if attempt < retries:  # throttled keys are retried
+                failed += [e for e in errors
+                           if (e['Key'], e.get('VersionId')) not in throttled]
+            else:
+                failed += errors
+            if not throttled or attempt == retries:
+                break
+            batch = [o for o in batch
+                     if (o['Key'], o.get('VersionId')) in throttled]
+            time.sleep(0.1 * 2**attempt)
+        for e in failed:
+            _l.error(f'{me()} {e["Key"]}: {e.get("Message")}')
+        return deleted
+
+    def _list_versions(self, bucket, prefix):
+        """Yields object versions and delete markers under a prefix."""
+        paginator = self.client.get_paginator('list_object_versions')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            yield from page.get('Versions', [])
+            yield from page.get('DeleteMarkers', [])
+
+
+class _S3RangeFile(RawIOBase):
+    """Seekable read-only file over an S3 object, read with ranged GETs.
+
+    Small reads are served from one cached block of ``S3_RANGE_BLOCK``
+    bytes, so Parquet footers take one or two requests.
+    """
+
+    def __init__(self, client, bucket, key, block=S3_RANGE_BLOCK):
+        super().__init__()
+        self.client, self.bucket, self.key = client, bucket, key
+        self.size = client.head_object(Bucket=bucket, Key=key)['ContentLength']
+        self.block = block
+        self._pos = 0
+        self._cache_start, self._cache = 0, b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self.size
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def _get(self, start, end) -> bytes:
+        return self.client.get_object(
+            Bucket=self.bucket, Key=self.key, Range=f'bytes={start}-{end - 1}'
+        )['Body'].read()
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else \
+            min(self._pos + size, self.size)
+        if end <= self._pos:
+            return b''
+        cached_end = self._cache_start + len(self._cache)
+        if not (self._cache_start <= self._pos and end <= cached_end):
+            if end - self._pos >= self.block:
+                data = self._get(self._pos, end)
+                self._pos = end
+                return data
+            start = max(min(self._pos, self.size - self.block), 0)
+            self._cache_start = start
+            self._cache = self._get(start, min(start + self.block, self.size))
+        data = self._cache[self._pos - self._cache_start:
+                           end - self._cache_start]
+        self._pos = end
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
 
 class Lambdas:
     """Class for finding and running Lambda functions.
-    
+
+    The list of functions is cached in ``LAMBDA_CACHE`` for ``ttl``
+    seconds (per region, credentials and endpoint), and refreshed when a
+    search finds nothing.  Session parameters (``SESSION_PARAMS``) go to
+    ``boto3.Session``, the others (*e.g.* ``endpoint_url``, ``config``)
+    to the Lambda client.
+
     aws_params = dict(
         aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
         aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
@@ -88,43 +750,118 @@ class Lambdas:
         region_name='us-east-1',
     )
     """
-    
-    def __init__(self, **aws_params):
-        self.client = boto3.client('lambda', **aws_params)
-        
+
+    def __init__(self, ttl=LAMBDA_TTL, **aws_params):
+        session = boto3.Session(**{
+            k: v for k, v in aws_params.items() if k in SESSION_PARAMS})
+        self.client = session.client('lambda', **{
+            k: v for k, v in aws_params.items() if k not in SESSION_PARAMS})
+        credentials = session.get_credentials()
+        account = hashlib.blake2b(
+            f'{session.region_name}:{credentials and credentials.access_key}:'
+            f'{self.client.meta.endpoint_url}'.encode(),
+            digest_size=8).hexdigest()
+        self.catalog_file = os.path.join(LAMBDA_CACHE, f'{account}.json')
+        self.results = []
+
+        try:
+            age = time.time() - os.path.getmtime(self.catalog_file)
+            with open(self.catalog_file) as f:
+                catalog = json.load(f)
+        except (OSError, ValueError):
+            age, catalog = None, None
+        if catalog is None or age > ttl:
+            self.refresh()
+        else:
+            self._index(catalog['functions'], catalog.get('tags', {}))
+            _l.debug(f'{me()} {len(self.fnlist)} functions from cache')
+
+    def refresh(self):
+        """Lists all functions again and caches the list."""
+
         # Paginator to retrieve all functions (otherwise 50 max)
         paginator = self.client.get_paginator('list_functions')
         page_iterator = paginator.paginate()
 
         # Retrieve all Lambda functions
-        self.fnlist = []
+        fnlist = []
         for page in page_iterator:
-            self.fnlist.extend(page['Functions'])
-    
-    def find(self, s):
-        self.results = []
-        for fn in self.fnlist:
-            if s in fn['FunctionName']:
-                self.results.append(fn)
-        print('  Result 1 out of {}:\n{}'.format(
-            len(self.results), self.results[0])
-        )
-            
+            fnlist.extend(page['Functions'])
+        self._index(fnlist, {})
+        self._save()
+        _l.info(f'{me()} listed {len(self.fnlist)} functions')
+
+    def _index(self, fnlist, tags):
+        """Sorts functions by name for prefix search (bisect)."""
+        self.fnlist = sorted(fnlist, key=lambda fn: fn['FunctionName'])
+        self.names = [fn['FunctionName'] for fn in self.fnlist]
+        self.tags = tags  # by FunctionArn, fetched when first searched
+
+    def _save(self):
+        os.makedirs(LAMBDA_CACHE, exist_ok=True)
+        _atomic_write(self.catalog_file, json.dumps(
+            {'functions': self.fnlist, 'tags': self.tags}, default=str))
+
+    def find(self, s=None, prefix=None, tags=None, refresh=True):
+        """Finds functions by name substring, name prefix and/or tags.
+
+        Results are kept in ``self.results`` for ``prep_invocation``.
+        If nothing is found and ``refresh``, the function list is
+        refreshed and searched again.
+
+        :Args:
+            :s: substring of the function name
+            :prefix: beginning of the function name
+            :tags: dict of tags the function must have, *e.g.*
+                ``{'team': 'data'}``; a value of None matches any value
+
+        :Returns:
+            pd.DataFrame of matching functions
+        """
+
+        if prefix:
+            lo = bisect_left(self.names, prefix)
+            hi = bisect_left(self.names, prefix + '\uffff')
+            found = self.fnlist[lo:hi]
+        else:
+            found = self.fnlist
+        if s:
+            found = [fn for fn in found if s in fn['FunctionName']]
+        if tags:
+            self._fetch_tags(found)
+            found = [fn for fn in found if all(
+                k in self.tags[fn['FunctionArn']]
+                and v in (None, self.tags[fn['FunctionArn']][k])
+                for k, v in tags.items()
+            )]
+        if not found and refresh:
+            self.refresh()
+            return self.find(s, prefix, tags, refresh=False)
+
+        self.results = found
+        _l.info(f'{me()} found {len(found)} functions')
+        columns = ['FunctionName', 'Runtime', 'LastModified', 'MemorySize',
+                   'Timeout', 'Description', 'FunctionArn']
+        return pd.DataFrame(
+            [{c: fn.get(c) for c in columns} for fn in found], columns=columns)
+
+    def _fetch_tags(self, fnlist):
+        """Fetches (concurrently) and caches tags of functions."""
+        arns = [fn['FunctionArn'] for fn in fnlist
+                if fn['FunctionArn'] not in self.tags]
+        if not arns:
+            return
+        with ThreadPoolExecutor(max_workers=S3_LS_WORKERS) as pool:
+            for arn, response in zip(arns, pool.map(
+                    lambda arn: _retry(self.client.list_tags, Resource=arn),
+                    arns)):
+                self.tags[arn] = response.get('Tags', {})
+        self._save()
+
     def prep_invocation(self, i=0, **additional_params):
-        _name = self.results[i]['FunctionName']
-        _env = self.results[i]['Environment']['Variables']
-        _payload = {
-            'stateMachineArn': _env['DEFAULT_SFN_ARN'],
-            'jobConfigUrl': _env['DEFAULT_CONFIG_FILE']
-        }
-        _payload.update(**additional_params)
-        self.invocation = {
-            'FunctionName': _name,
-            'Payload': json.dumps(_payload).encode('utf-8'),
-            'LogType': 'Tail',
-        }
+        self.invocation = _invocation(self.results[i], **additional_params)
         return self.invocation
-    
+
     def invoke(self, invocation_type='DryRun'):
         response = self.client.invoke(
             InvocationType = invocation_type,
@@ -132,3 +869,288 @@ class Lambdas:
         )
         print('Response:',response['ResponseMetadata']['HTTPStatusCode'])
         return response
+
+    def invoke_many(self, overrides, i=0, invocation_type='DryRun',
+                    max_concurrency=10, retries=AWS_RETRIES) -> pd.DataFrame:
+        """Invokes a function concurrently, once per payload override.
+
+        Each override is a dict of ``prep_invocation`` parameters.
+        Throttled invocations are retried with exponential backoff.
+
+        :Args:
+            :overrides: list of dicts of payload parameters
+            :i: index of the function in ``self.results``
+            :invocation_type: ``'DryRun'``, ``'Event'`` or
+                ``'RequestResponse'`` (which returns tail logs)
+            :max_concurrency: invocations in flight
+            :retries: retries of throttled invocations
+
+        :Returns:
+            pd.DataFrame with the parameters, status, function error,
+            duration, request ID, response payload, tail log and error
+            of each invocation
+
+        :Usage:
+            ::
+
+                lambdas.find(prefix='etl-')
+                runs = lambdas.invoke_many(
+                    [{'partition': p} for p in partitions],
+                    invocation_type='Event',
+                )
+        """
+
+        fn = self.results[i]
+
+        def run(params):
+            row = {'params': params}
+            t0 = time.perf_counter()
+            try:
+                response = _retry(
+                    self.client.invoke,
+                    InvocationType=invocation_type,
+                    retries=retries,
+                    **_invocation(fn, **params),
+                )
+                row['status'] = response['StatusCode']
+                row['function_error'] = response.get('FunctionError')
+                row['request_id'] = response['ResponseMetadata'].get('RequestId')
+                if 'Payload' in response:
+                    row['payload'] = response['Payload'].read().decode('utf-8')
+                if 'LogResult' in response:
+                    row['log'] = base64.b64decode(
+                        response['LogResult']).decode('utf-8', 'replace')
+            except Exception as e:
+                row['error'] = f'{type(e).__name__}: {e}'
+            row['duration'] = time.perf_counter() - t0
+            return row
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            rows = list(pool.map(run, overrides))
+        df = pd.DataFrame(rows, columns=[
+            'params', 'status', 'function_error', 'duration', 'request_id',
+            'payload', 'log', 'error'])
+        _l.info(f'{me()} {fn["FunctionName"]}: {len(df)} invocations, '
+                f'{df.error.notna().sum()} errors, '
+                f'{df.function_error.notna().sum()} function errors')
+        return df
+
+
+def _invocation(fn, **additional_params) -> dict:
+    """Invocation of a listed function, with its default payload.
+
+    The default payload starts the function's state machine
+    (``DEFAULT_SFN_ARN``) with its job config (``DEFAULT_CONFIG_FILE``).
+    """
+
+    _env = fn['Environment']['Variables']
+    _payload = {
+        'stateMachineArn': _env['DEFAULT_SFN_ARN'],
+        'jobConfigUrl': _env['DEFAULT_CONFIG_FILE']
+    }
+    _payload.update(**additional_params)
+    return {
+        'FunctionName': fn['FunctionName'],
+        'Payload': json.dumps(_payload).encode('utf-8'),
+        'LogType': 'Tail',
+    }
+
+
+#-----------------------------------------------------------------------------
+# Utility Functions
+#-----------------------------------------------------------------------------
+
+def _split_s3url(s3url) -> tuple:
+    """Splits ``s3://bucket/key`` into (bucket, key)."""
+    s3url_parts = s3url.split('/', maxsplit=3)
+    return s3url_parts[2], (s3url_parts[3] if len(s3url_parts) > 3 else '')
+
+
+def _s3_format(key, fmt=None) -> tuple:
+    """(format, compression) of an S3 file, from its extension."""
+    parts = key.lower().split('.')
+    compression = S3_COMPRESSION.get(parts[-1])
+    if compression:
+        parts = parts[:-1]
+    return fmt or S3_FORMATS.get(parts[-1], 'csv'), compression
+
+
+def _key_filter(pattern=None, regex=None):
+    """Predicate on listed objects: key matches glob ``pattern`` and ``regex``."""
+    rx = re.compile(regex) if regex else None
+
+    def match(o):
+        return ((pattern is None or fnmatchcase(o['Key'], pattern))
+                and (rx is None or rx.search(o['Key']) is not None))
+    return match
+
+
+def _ls_frame(objects) -> pd.DataFrame:
+    """Compact DataFrame of listed objects."""
+    cols = {'key': [], 'size': [], 'last_modified': [], 'etag': [],
+            'storage_class': []}
+    for o in objects:
+        cols['key'].append(o['Key'])
+        cols['size'].append(o['Size'])
+        cols['last_modified'].append(o['LastModified'])
+        cols['etag'].append(o.get('ETag', '').strip('"'))
+        cols['storage_class'].append(o.get('StorageClass'))
+    df = pd.DataFrame({
+        'key': pd.Series(cols['key'], dtype=str),
+        'size': pd.Series(cols['size'], dtype='int64'),
+        'last_modified': pd.to_datetime(cols['last_modified'], utc=True),
+        'etag': pd.Series(cols['etag'], dtype=str),
+        'storage_class': pd.Series(cols['storage_class'], dtype='category'),
+    })
+    return df.sort_values('key', ignore_index=True)
+
+
+def _batches(items, size):
+    """Yields lists of up to ``size`` items."""
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+def _retry(fn, *args, retries=AWS_RETRIES, backoff=0.1, **kwargs):
+    """Calls ``fn``, retrying throttling errors with exponential backoff."""
+    for attempt in range(retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code not in THROTTLING_CODES or attempt == retries:
+                raise
+            delay = backoff * 2**attempt * (1 + random.random())
+            _l.debug(f'{me()} {code}, retrying in {delay:.1f}s')
+            time.sleep(delay)
+
+
+def _select_sql(columns, where, cast=False) -> str:
+    """S3 Select SQL of a projection and ``(column, op, value)`` filters.
+
+    CSV fields are strings to S3 Select, so with ``cast`` numbers are
+    compared as ``CAST(... AS FLOAT)``.
+    """
+
+    def name(c):
+        return 's."%s"' % c.replace('"', '""')
+
+    def literal(v):
+        if isinstance(v, str):
+            return "'%s'" % v.replace("'", "''")
+        return repr(float(v)) if cast else repr(v)
+
+    conditions = []
+    for col, op, value in where:
+        op = '=' if op == '==' else op.upper()
+        values = value if op == 'IN' else [value]
+        numeric = cast and not any(isinstance(v, str) for v in values)
+        field = f'CAST({name(col)} AS FLOAT)' if numeric else name(col)
+        if op == 'IN':
+            conditions.append(
+                f'{field} IN ({", ".join(literal(v) for v in values)})')
+        else:
+            conditions.append(f'{field} {op} {literal(value)}')
+    projection = ', '.join(name(c) for c in columns) if columns else '*'
+    sql = f'SELECT {projection} FROM S3Object s'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    return sql
+
+
+def _where_mask(df, where):
+    """Boolean mask of the rows of ``df`` passing all filters."""
+    ops = {
+        '=': lambda s, v: s == v, '==': lambda s, v: s == v,
+        '!=': lambda s, v: s != v,
+        '<': lambda s, v: s < v, '<=': lambda s, v: s <= v,
+        '>': lambda s, v: s > v, '>=': lambda s, v: s >= v,
+        'in': lambda s, v: s.isin(v),
+    }
+    mask = pd.Series(True, index=df.index)
+    for col, op, value in where:
+        mask &= ops[op.lower()](df[col], value)
+    return mask
+
+
+def _arrow_filter(w) -> tuple:
+    """``(column, op, value)`` filter in pyarrow's notation."""
+    col, op, value = w
+    return col, {'=': '==', 'IN': 'in'}.get(op, op), value
+
+
+def _numeric(s):
+    """Numeric version of a Series of strings, if all values are numbers."""
+    try:
+        return pd.to_numeric(s)
+    except (ValueError, TypeError):
+        return s
+
+
+def _local_files(folder) -> dict:
+    """Files under a folder by relative path (with ``/``): size and mtime."""
+    files = {}
+    for root, _, names in os.walk(folder):
+        for name in names:
+            if name.startswith('.lucid-'):  # unfinished atomic writes
+                continue
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            rel = os.path.relpath(path, folder).replace(os.sep, '/')
+            files[rel] = {'size': st.st_size, 'mtime': st.st_mtime}
+    return files
+
+
+def _sync_size(info) -> int:
+    """Size of a local file or S3 object listed for sync."""
+    return info['size'] if 'size' in info else info['Size']
+
+
+def _s3_etag(path, etag, part_size) -> str:
+    """ETag S3 would give a local file, multipart if ``etag`` is.
+
+    Multipart ETags are the MD5 of the parts' MD5s, with the number of
+    parts.  The part size is not stored, so sizes that make that many
+    parts are tried in turn: ``part_size``, the 8 MiB default of boto3
+    and the AWS CLI, the 5 MiB minimum, and equal parts rounded up to a
+    whole MiB.  Returns the first ETag equal to ``etag``, else the last.
+    """
+
+    if '-' not in etag:
+        h = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    n = int(etag.rsplit('-', 1)[1])
+    size = os.path.getsize(path)
+    equal = -(-size // n)
+    candidates = [part_size, 8 * 2**20, 5 * 2**20, -(-equal // 2**20) * 2**20]
+    local = None
+    for part_size in dict.fromkeys(candidates):
+        if -(-size // part_size) != n:
+            continue
+        parts = []
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(part_size), b''):
+                parts.append(hashlib.md5(chunk).digest())
+        local = f'{hashlib.md5(b"".join(parts)).hexdigest()}-{len(parts)}'
+        if local == etag:
+            break
+    return local
+
+
+def _upload_args(name) -> dict:
+    """ContentType (and ContentEncoding of precompressed web assets)."""
+    base, ext = os.path.splitext(name)
+    encoding = CONTENT_ENCODINGS.get(ext[1:].lower())
+    if encoding:
+        content_type = mimetypes.guess_type(base)[0]
+        if content_type in WEB_TYPES:
+            return {'ContentType': content_type, 'ContentEncoding': encoding}
+        return {'ContentType': 'application/gzip' if encoding == 'gzip'
+                else 'application/octet-stream'}
+    content_type = mimetypes.guess_type(name)[0]
+    return {'ContentType': content_type} if content_type else {}
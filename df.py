@@ -16,30 +16,367 @@ _l = logging.getLogger(__name__)
 #-----------------------------------------------------------------------------
 
 # External imports
-from functools import reduce
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, reduce
+from io import BytesIO
+from pandas.api.types import infer_dtype
+from pandas.tseries.frequencies import to_offset
+from pandas.tseries.offsets import Tick
+import gzip
+import hashlib
+import mmap
 import numpy as np
+import os
 import pandas as pd
 import re
+import struct
+import warnings
+import zlib
 
 # Lucid imports
+from .db import runquery, sq
 from .util import me
 
 
 #-----------------------------------------------------------------------------
 # Globals & Constants
 #-----------------------------------------------------------------------------
+CHUNK_BYTES = 2**27  # size of byte ranges parsed by each worker (128 MB)
+GZIP_MAGIC = b'\x1f\x8b'
+GZI_CACHE = os.path.expanduser('~/.cache/lucid/gzi/')  # read-only folders
+# infer_dtype labels of columns that may hold more than one Python type;
+# 'date' also covers dates mixed with datetimes
+MIXED_TYPES = ('mixed', 'mixed-integer', 'mixed-integer-float', 'date')
+# strings optimize() may parse as dates: digits around a separator, or a month
+DATE_LIKE = (r'\d[-/:]\d|'
+             r'(?i:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)')
+
+# built-in aggregations recognized by gresample
+AGG_ALIASES = {
+    'nunique': 'nunique',
+    'distinct': 'nunique',
+    'count': 'count',
+    'size': 'size',
+    'sum': 'sum',
+    'mean': 'mean',
+    'min': 'min',
+    'max': 'max',
+    'median': 'median',
+    'std': 'std',
+    'var': 'var',
+    'first': 'first',
+    'last': 'last',
+    len: 'size',
+    sum: 'sum',
+    min: 'min',
+    max: 'max',
+    np.sum: 'sum',
+    np.mean: 'mean',
+    np.min: 'min',
+    np.max: 'max',
+    np.median: 'median',
+    np.nansum: 'sum',
+    np.nanmean: 'mean',
+    np.nanmin: 'min',
+    np.nanmax: 'max',
+    np.nanmedian: 'median',
+}
+
+# gresample_sql: DATE_TRUNC units for pandas frequencies; other fixed
+# frequencies ('7D', '15min') are bucketed from the first day of the data
+SQL_PERIODS = {
+    'h': 'hour',
+    'D': 'day',
+    'W': 'week',
+    'MS': 'month',
+    'ME': 'month',
+    'QS': 'quarter',
+    'QE': 'quarter',
+    'YS': 'year',
+    'YE': 'year',
+}
+# frequencies that pandas labels by the end of the period
+SQL_PERIODS_END = {'W': 'W', 'ME': 'M', 'QE': 'Q', 'YE': 'Y'}
+SQL_AGGS = {
+    'nunique': 'COUNT(DISTINCT {col})',
+    'count': 'COUNT({col})',
+    'size': 'COUNT(*)',
+    'sum': 'SUM({col})',
+    'mean': 'AVG({col})',
+    'min': 'MIN({col})',
+    'max': 'MAX({col})',
+    'median': 'PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY {col})',
+    'std': 'STDDEV_SAMP({col})',
+    'var': 'VAR_SAMP({col})',
+    'quantile': 'PERCENTILE_CONT({q}) WITHIN GROUP (ORDER BY {col})',
+}
 
 
 #-----------------------------------------------------------------------------
 # Data Ingest
 #-----------------------------------------------------------------------------
-def read_selected_columns(file, exclude, **kwargs) -> pd.DataFrame():
-    """Reads a CSV file with the exclusion of specified columns."""
-    columns = pd.read_csv(file, nrows=0)
+def read_selected_columns(file, exclude, n_workers=None, **kwargs) -> pd.DataFrame():
+    """Reads a CSV file with the exclusion of specified columns.
+
+    With ``n_workers``, the file is parsed by ``read_csv_parallel``.
+    """
+    columns = pd.read_csv(file, nrows=0, sep=kwargs.get('sep', ','))
     usecols = [col for col in columns if col not in exclude]
+    if n_workers:
+        return read_csv_parallel(
+            file, usecols=usecols, n_workers=n_workers, **kwargs
+        )
     return pd.read_csv(file, usecols=usecols, **kwargs)
 
 
+def read_csv_parallel(file, sep=',', callback=None, n_workers=None,
+                      chunk_bytes=CHUNK_BYTES, use_mmap=False, header=0,
+                      **kwargs):
+    """Reads a big delimited file as byte ranges parsed in parallel.
+
+    The file is split into newline-aligned byte ranges, and each range
+    is parsed by ``pd.read_csv`` in a worker process.  Gzip files must be
+    multi-member or BGZF (``bgzip``) to be split; their seek index is
+    built on first use and saved (see ``gzip_index``).
+    Quoted fields with embedded newlines are not supported.
+
+    :Args:
+        :file: uncompressed, BGZF or multi-member gzip file
+        :sep: delimiter
+        :callback: function applied to every chunk inside the worker;
+            must be picklable (defined at module level)
+        :n_workers: number of worker processes (defaults to CPU count)
+        :chunk_bytes: approximate size of a byte range
+        :use_mmap: read uncompressed byte ranges through a memory map
+        :header: row number with column names, or None
+        :kwargs: keyword arguments for ``pd.read_csv()``
+
+    :Returns:
+        * concatenated DataFrame if there is no ``callback``
+        * list of ``callback`` results in file order otherwise
+
+    :Usage:
+        map step of COUNT ... GROUP BY over a 30 GB TSV::
+
+            counts = read_csv_parallel(
+                'big.tsv',
+                sep='\\t',
+                callback=Counts._map_chunk,
+                n_workers=16,
+            )
+    """
+
+    with open(file, 'rb') as f:
+        is_gzip = f.read(2) == GZIP_MAGIC
+
+    # column names are parsed once and passed to every worker
+    names = kwargs.pop('names', None)
+    n_header = 0 if header is None else header + 1
+    start = 0
+    if n_header:
+        with (gzip.open if is_gzip else open)(file, 'rb') as f:
+            lines = [f.readline() for _ in range(n_header)]
+            start = f.tell()
+        if names is None:
+            names = pd.read_csv(BytesIO(lines[-1]), sep=sep, nrows=0).columns
+
+    if is_gzip:
+        offsets = gzip_index(file)[:, 0]
+        ranges = _member_ranges(offsets, os.path.getsize(file), chunk_bytes)
+    else:
+        ranges = _newline_ranges(file, start, chunk_bytes)
+    _l.info(f'{me()} parsing {file} as {len(ranges)} byte ranges')
+
+    read_kwargs = dict(sep=sep, header=None, names=names, **kwargs)
+    job = partial(
+        _read_range, file,
+        is_gzip=is_gzip,
+        n_header=n_header,
+        use_mmap=use_mmap,
+        read_kwargs=read_kwargs,
+        callback=callback,
+    )
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        results = list(pool.map(job, *zip(*ranges)))
+
+    if callback:
+        return results
+    # empty ranges would upcast every column to object
+    df = pd.concat([r for r in results if len(r)] or results,
+                   ignore_index=True)
+    _l.info(f'{me()} read {df.shape[0]} x {df.shape[1]} columns')
+    return df
+
+
+def gzip_index(file, rebuild=False) -> np.ndarray:
+    """Builds or loads the seek index of a multi-member or BGZF gzip file.
+
+    The index is an array of (compressed, uncompressed) offsets of every
+    gzip member.  It is saved next to the file as ``<file>.gzi``, in the
+    format written by ``bgzip -i``, or in ``GZI_CACHE`` if the folder of
+    the file is read-only.  Single-member gzips cannot be split, so
+    their index is not saved.
+    """
+
+    paths = _gzi_paths(file)
+    for gzi in paths:
+        if not rebuild and os.path.isfile(gzi) \
+                and os.path.getmtime(gzi) >= os.path.getmtime(file):
+            with open(gzi, 'rb') as f:
+                n = struct.unpack('<Q', f.read(8))[0]
+                index = np.frombuffer(f.read(16 * n), dtype='<u8')
+            return np.vstack([[0, 0], index.reshape(-1, 2)]).astype(np.int64)
+
+    with open(file, 'rb') as f:
+        header = f.read(18)
+        if header[3] & 4 and header[12:14] == b'BC':
+            index = _bgzf_members(f)
+        else:
+            index = _gzip_members(f)
+    _l.info(f'{me()} indexed {len(index)} gzip members in {file}')
+    if len(index) < 2:
+        return index
+
+    data = struct.pack('<Q', len(index) - 1) \
+        + np.asarray(index[1:], dtype='<u8').tobytes()
+    for gzi in paths:
+        try:
+            os.makedirs(os.path.dirname(gzi), exist_ok=True)
+            with open(gzi, 'wb') as f:
+                f.write(data)
+            return index
+        except OSError as e:
+            _l.debug(f'{me()} cannot save {gzi}: {e}')
+    _l.warning(f'{me()} cannot save the index of {file}, keeping it in memory')
+    return index
+
+
+def _gzi_paths(file) -> list:
+    """Index locations of a gzip file: next to it, then in ``GZI_CACHE``."""
+    path = os.path.abspath(file)
+    digest = hashlib.sha1(path.encode()).hexdigest()
+    return [path + '.gzi', os.path.join(GZI_CACHE, digest + '.gzi')]
+
+
+def _bgzf_members(f) -> np.ndarray:
+    """Walks BGZF block headers (no decompression needed)."""
+    index, c, u = [], 0, 0
+    size = os.fstat(f.fileno()).st_size
+    while c < size:
+        f.seek(c)
+        header = f.read(18)
+        bsize = struct.unpack('<H', header[16:18])[0] + 1
+        f.seek(c + bsize - 4)
+        isize = struct.unpack('<I', f.read(4))[0]
+        index.append((c, u))
+        c += bsize
+        u += isize
+    return np.array(index, dtype=np.int64).reshape(-1, 2)
+
+
+def _gzip_members(f, size=2**20) -> np.ndarray:
+    """Finds member boundaries of a multi-member gzip in one pass."""
+    total = os.fstat(f.fileno()).st_size
+    f.seek(0)
+    index, c, u = [(0, 0)], 0, 0
+    d = zlib.decompressobj(32 + zlib.MAX_WBITS)
+    while True:
+        raw = f.read(size)
+        if not raw:
+            break
+        while raw:
+            u += len(d.decompress(raw))
+            if d.eof:
+                c += len(raw) - len(d.unused_data)
+                raw = d.unused_data
+                d = zlib.decompressobj(32 + zlib.MAX_WBITS)
+                index.append((c, u))
+            else:
+                c += len(raw)
+                raw = b''
+    if index[-1][0] >= total:  # end of file, not a member
+        index.pop()
+    return np.array(index, dtype=np.int64).reshape(-1, 2)
+
+
+def _gunzip_iter(f, size=2**16):
+    """Yields decompressed data of consecutive gzip members."""
+    d = zlib.decompressobj(32 + zlib.MAX_WBITS)
+    while True:
+        raw = f.read(size)
+        if not raw:
+            break
+        while raw:
+            yield d.decompress(raw)
+            if d.eof:
+                raw = d.unused_data
+                d = zlib.decompressobj(32 + zlib.MAX_WBITS)
+            else:
+                raw = b''
+
+
+def _newline_ranges(file, start, chunk_bytes) -> list:
+    """Splits a file into byte ranges that end on a newline."""
+    size = os.path.getsize(file)
+    ranges = []
+    with open(file, 'rb') as f:
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def _member_ranges(offsets, size, chunk_bytes) -> list:
+    """Groups gzip members into byte ranges of about ``chunk_bytes``."""
+    bounds = [0]
+    for c in offsets[1:]:
+        if c - bounds[-1] >= chunk_bytes:
+            bounds.append(int(c))
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _read_range(file, start, end, is_gzip, n_header, use_mmap,
+                read_kwargs, callback):
+    """Parses one byte range; runs in a worker process."""
+
+    with open(file, 'rb') as f:
+        if not is_gzip:
+            if use_mmap:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    data = mm[start:end]
+            else:
+                f.seek(start)
+                data = f.read(end - start)
+        else:
+            # a line belongs to the range where it starts: the range
+            # completes its last line from the following members and
+            # skips its first (partial) line, unless it is the first range
+            f.seek(start)
+            data = b''.join(_gunzip_iter(BytesIO(f.read(end - start))))
+            f.seek(end)
+            for piece in _gunzip_iter(f):
+                i = piece.find(b'\n')
+                if i >= 0:
+                    data += piece[:i+1]
+                    break
+                data += piece
+            for _ in range(n_header if start == 0 else 1):
+                i = data.find(b'\n')
+                data = data[i+1:] if i >= 0 else b''
+
+    if data:
+        chunk = pd.read_csv(BytesIO(data), **read_kwargs)
+    else:
+        chunk = pd.DataFrame(columns=read_kwargs['names'])
+    if callback:
+        return callback(chunk)
+    return chunk
+
+
 #-----------------------------------------------------------------------------
 # Data Overview Functions
 #-----------------------------------------------------------------------------
@@ -48,25 +385,143 @@ def mem(df, verbose=False):
     return df.info(verbose=verbose, memory_usage='deep')
 
 
+def optimize(df, category_max=0.5, sparse_min=0.9, parse_dates=True,
+             arrow_strings=True) -> tuple:
+    """Shrinks RAM footprint of a dataframe, converting columns where safe.
+
+    * integers are downcast to the smallest (unsigned) integer type
+    * floats are downcast to float32 if no value changes
+    * numeric columns dominated by one value become sparse
+    * string columns are parsed as datetimes if every value looks like
+      a date (has a ``-``, ``/`` or ``:`` between digits, or a month name)
+      and parses, else become ``category`` if cardinality is low,
+      else become Arrow-backed strings (requires ``pyarrow``) unless
+      they already are
+
+    :Args:
+        :df: DataFrame
+        :category_max: max ratio of unique to non-null values for category
+        :sparse_min: min share of the most common value for sparse dtype
+        :parse_dates: try parsing string columns as datetimes
+        :arrow_strings: convert other string columns to ``string[pyarrow]``
+
+    :Returns:
+        (optimized DataFrame, report with dtypes and bytes per column)
+    """
+
+    if arrow_strings:
+        try:
+            import pyarrow
+        except ImportError:
+            _l.warning(f'{me()} pyarrow not found, keeping object strings')
+            arrow_strings = False
+
+    columns, report = [], []
+    for i, col in enumerate(df.columns):
+        s = df.iloc[:, i]
+        kind = s.dtype.kind if isinstance(s.dtype, np.dtype) else None
+        if kind in ('i', 'u', 'f'):
+            opt = _optimize_numeric(s, sparse_min)
+        elif s.dtype == object or isinstance(s.dtype, pd.StringDtype):
+            opt = _optimize_strings(s, category_max, parse_dates, arrow_strings)
+        else:
+            opt = s
+        columns.append(opt)
+        report.append([
+            col, s.dtype, opt.dtype,
+            s.memory_usage(deep=True, index=False),
+            opt.memory_usage(deep=True, index=False),
+        ])
+
+    if not columns:
+        return df.copy(), pd.DataFrame(columns=[
+            'dtype_before', 'dtype_after', 'bytes_before', 'bytes_after',
+            'ratio']).rename_axis('column')
+    optimized = pd.concat(columns, axis=1)
+    optimized.columns = df.columns
+    report = pd.DataFrame(report, columns=[
+        'column', 'dtype_before', 'dtype_after', 'bytes_before', 'bytes_after'
+    ]).set_index('column')
+    report['ratio'] = (report.bytes_before / report.bytes_after).round(1)
+    before, after = report.bytes_before.sum(), report.bytes_after.sum()
+    _l.info(f'{me()} {before/1e6:.1f} MB -> {after/1e6:.1f} MB '
+            f'({before/max(after, 1):.1f}x smaller)')
+    return optimized, report
+
+
+def _optimize_numeric(s, sparse_min):
+    """Downcasts a numeric series, and makes it sparse if mostly one value."""
+
+    if s.dtype.kind == 'f':
+        f32 = s.astype(np.float32)
+        if np.array_equal(f32.to_numpy(np.float64), s.to_numpy(), equal_nan=True):
+            s = f32
+    elif len(s):
+        downcast = 'unsigned' if s.min() >= 0 else 'integer'
+        s = pd.to_numeric(s, downcast=downcast)
+
+    top = s.value_counts(dropna=False)
+    if len(s) and top.iloc[0] >= sparse_min * len(s):
+        s = s.astype(pd.SparseDtype(s.dtype, top.index[0]))
+    return s
+
+
+def _optimize_strings(s, category_max, parse_dates, arrow_strings):
+    """Converts a string series to datetime, category or Arrow strings."""
+
+    notna = s.dropna()
+    if not len(notna) or infer_dtype(notna, skipna=False) != 'string':
+        return s  # empty or mixed types
+
+    if parse_dates:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            # cheap check on a few values before parsing the whole column;
+            # years ('2019') and other bare numbers are not dates
+            head = notna.iloc[:100]
+            if (head.str.contains(DATE_LIKE).all()
+                    and pd.to_datetime(head, errors='coerce').notna().all()
+                    and notna.str.contains(DATE_LIKE).all()):
+                dt = pd.to_datetime(s, errors='coerce')
+                if dt.notna().sum() == len(notna):
+                    return dt
+
+    if notna.nunique() <= category_max * len(notna):
+        return s.astype('category')
+    if arrow_strings and getattr(s.dtype, 'storage', None) != 'pyarrow':
+        return s.astype(pd.StringDtype('pyarrow'))
+    return s
+
+
 def vc(df, col, dropna=False):
-    """Shortcut to Series.value_counts(dropna=False)."""
+    """Shortcut to Series.value_counts(dropna=False).
+
+    Polars and Arrow frames are counted natively (see ``BACKENDS``).
+    """
+    backend = _backend(df)
+    if backend:
+        return backend.value_counts(df, [col], dropna)[0]
     return df[col].value_counts(dropna=dropna)
 
 
 def topseries(series, n=7):
-    """Shows top `n` values in Pandas series."""
-    series_sorted = series.sort_values(ascending=False)
-    topn = series_sorted.iloc[:n]
-    topn = topn.append(
-        pd.Series(series_sorted.iloc[n:].sum(), index=[' other'])
-    )
-    return topn
+    """Shows top `n` values in Pandas (or Polars/Arrow) series."""
+    backend = _backend(series)
+    if backend:
+        topn, other = backend.top_values(series, n)
+    else:
+        series_sorted = series.sort_values(ascending=False)
+        topn, other = series_sorted.iloc[:n], series_sorted.iloc[n:].sum()
+    return pd.concat([topn, pd.Series(other, index=[' other'])])
 
 
 def top_items(df, col, n=1) -> list:
     """Returns cardinality and top `n` items from `col` in a `df`."""
-    rel = 100 / len(df)
-    counts = df[col].value_counts(dropna=False)
+    return _top_items(vc(df, col), _nrows(df), n)
+
+
+def _top_items(counts, nrows, n) -> list:
+    rel = 100 / nrows
     c = len(counts)
     keys = counts.index[:n]
     vals = counts.values[:n]
@@ -76,13 +531,24 @@ def top_items(df, col, n=1) -> list:
 
 def ntop(df, n=3) -> pd.DataFrame:
     """Overview of top `n` items in all columns of a `df`."""
-    df = df.loc[:, ~df.columns.duplicated()]
+    backend = _backend(df)
+    if backend:
+        columns = backend.columns(df)
+        # one multi-threaded pass over all columns
+        counts = dict(zip(columns, backend.value_counts(df, columns)))
+        nrows = backend.nrows(df)
+    else:
+        df = df.loc[:, ~df.columns.duplicated()]
+        columns = df.columns
     dftop = pd.DataFrame(
-        index=df.columns,
+        index=columns,
         columns=['cardinality','top_items','coverage'],
     )
-    for col in df.columns:
-        top = top_items(df, col, n=n)
+    for col in columns:
+        if backend:
+            top = _top_items(counts[col], nrows, n)
+        else:
+            top = top_items(df, col, n=n)
         dftop.loc[col, 'cardinality'] = top[0]
         dftop.loc[col, 'coverage'] = sum([i[2] for i in top[1]])
         dftop.loc[col, 'top_items'] = top[1]
@@ -97,7 +563,7 @@ class Counts:
         self.file = file
         self.columns = self._get_columns_from_ddl(ddl_file)
         self.conv = {
-            'message__timestamp': ts_to_dt,
+            'message__timestamp': pd.to_datetime,
         }
         if n_cols:
             self.n = min(len(self.columns), n_cols)
@@ -131,29 +597,51 @@ class Counts:
         vc = s.fillna(fillna).value_counts(dropna=False).head(n)
         return vc
 
-    def count_chunks(self, sep='\t', chunksize=10000):
-        self.chunks = pd.read_csv(
-            self.file,
-            sep=sep,
-            chunksize=chunksize,
-            header=None,
-            low_memory=False,
-            nrows=5e6,
-            usecols=[i for i in range(self.n)],
-        )
+    @staticmethod
+    def _map_chunk(chunk: pd.DataFrame) -> list:
+        """Map step: value counts of every column in a chunk."""
+        return [Counts._series_ntop(chunk[c], None) for c in chunk.columns]
+
+    def count_chunks(self, sep='\t', chunksize=10000, n_workers=None):
+        """Counts values in chunks of the file.
+
+        With ``n_workers``, the whole file is mapped in parallel byte ranges
+        (see ``read_csv_parallel``) instead of the first 5M rows.
+        """
 
         # MAP
-        counts = []
-        for chunk in self.chunks:
-            counts.append([self._series_ntop(chunk[c], None) for c in chunk.columns])
-            _l.info('mapping chunk number {:>4}'.format(len(counts)))
-        counts = np.array(counts)
+        if n_workers:
+            counts = read_csv_parallel(
+                self.file,
+                sep=sep,
+                callback=self._map_chunk,
+                n_workers=n_workers,
+                header=None,
+                low_memory=False,
+                usecols=[i for i in range(self.n)],
+            )
+        else:
+            self.chunks = pd.read_csv(
+                self.file,
+                sep=sep,
+                chunksize=chunksize,
+                header=None,
+                low_memory=False,
+                nrows=5e6,
+                usecols=[i for i in range(self.n)],
+            )
+            counts = []
+            for chunk in self.chunks:
+                counts.append(self._map_chunk(chunk))
+                _l.info('mapping chunk number {:>4}'.format(len(counts)))
 
-        # REDUCE
+        # REDUCE (byte ranges without rows map to no counts)
+        counts = [c for c in counts if len(c)]
         for i in range(self.n):
             print('reducing: {}'.format(self.columns[i]) + ' '*40, end='\r')
             self.result[self.columns[i]] = reduce(
-                _series_add, counts[:,i]
+                self._series_add, [c[i] for c in counts],
+                pd.Series(dtype='int64'),
             ).astype(int)
 
         # SORT by column names
@@ -199,33 +687,147 @@ class Counts:
 # Data Quality Functions
 #-----------------------------------------------------------------------------
 def drop_empty_columns(df: pd.DataFrame, sort=True) -> pd.DataFrame:
-    """Drops 100% NA columns."""
-    empty = df.isna().all()
-    _l.info(f'{me()} {sum(empty)} 100% NULL columns found')
+    """Drops 100% NA columns.
+
+    Polars and Arrow frames are returned as frames of the same type.
+    """
+    empty = find_empty_columns(df)
+    keep = list(empty.index[~empty.to_numpy()])
     if sort:
-        return df[sorted(df.columns[~empty])]
-    else:
-        return df[df.columns[~empty]]
+        keep = sorted(keep)
+    backend = _backend(df)
+    if backend:
+        return backend.select(df, keep)
+    return df[keep]
 
 def find_empty_columns(df: pd.DataFrame, sort=True) -> pd.DataFrame:
     """Finds 100% NA columns."""
-    empty = df.isna().all()
+    backend = _backend(df)
+    if backend:
+        empty = backend.null_counts(df) == backend.nrows(df)
+    else:
+        empty = df.isna().all()
     _l.info(f'{me()} {sum(empty)} 100% NULL columns found')
     return empty
 
 
+def scan_empty_columns(file, sep=',', chunk_bytes=CHUNK_BYTES,
+                       **kwargs) -> list:
+    """Finds 100% NA columns in a CSV or Parquet file too big to load.
+
+    CSV files (plain or gzip) are read in chunks of about ``chunk_bytes``;
+    columns are dropped from later chunk reads as soon as they show a
+    non-null value.  Parquet files are checked from row group statistics,
+    reading only the columns whose statistics are missing.
+
+    :Args:
+        :file: CSV or Parquet file
+        :sep: CSV delimiter
+        :chunk_bytes: approximate size of a CSV chunk
+        :kwargs: keyword arguments for ``pd.read_csv()``, *e.g.* ``na_values``
+
+    :Returns:
+        list of empty columns
+
+    :Usage:
+        load a wide file without its empty columns::
+
+            empty = scan_empty_columns('wide.csv')
+            df = read_selected_columns('wide.csv', exclude=empty)
+    """
+
+    with open(file, 'rb') as f:
+        magic = f.read(4)
+    if magic == b'PAR1':
+        columns, seen = _scan_parquet_nulls(file)
+    else:
+        with (gzip.open if magic[:2] == GZIP_MAGIC else open)(file, 'rb') as f:
+            columns = pd.read_csv(BytesIO(f.readline()), sep=sep, nrows=0).columns
+            seen = np.zeros(len(columns), dtype=bool)
+            while not seen.all():
+                lines = f.readlines(chunk_bytes)
+                if not lines:
+                    break
+                candidates = np.flatnonzero(~seen)
+                chunk = pd.read_csv(
+                    BytesIO(b''.join(lines)),
+                    sep=sep,
+                    header=None,
+                    names=range(len(columns)),
+                    usecols=candidates,
+                    dtype=str,
+                    **kwargs
+                )
+                seen[candidates] = chunk.notna().any()[candidates].to_numpy()
+
+    empty = list(columns[~seen])
+    _l.info(f'{me()} {len(empty)} 100% NULL columns found in {file}')
+    return empty
+
+
+def _scan_parquet_nulls(file):
+    """Column names and whether each column has a non-null value."""
+
+    import pyarrow.parquet as pq
+
+    pf = pq.ParquetFile(file)
+    columns = pd.Index(pf.schema_arrow.names)
+    seen = np.zeros(len(columns), dtype=bool)
+    for rg in range(pf.metadata.num_row_groups):
+        group = pf.metadata.row_group(rg)
+        unknown = set(np.flatnonzero(~seen))
+        for i in range(group.num_columns):
+            meta = group.column(i)
+            if meta.path_in_schema not in columns:
+                continue  # nested fields are checked by reading
+            pos = columns.get_loc(meta.path_in_schema)
+            stats = meta.statistics
+            if stats is None or not stats.has_null_count:
+                continue
+            if stats.null_count == group.num_rows:
+                unknown.discard(pos)  # all null in this row group
+            # floats without min/max may be all NaN, so they are read
+            elif stats.has_min_max or meta.physical_type not in (
+                    'FLOAT', 'DOUBLE'):
+                seen[pos] = True
+                unknown.discard(pos)
+        unknown = sorted(i for i in unknown if not seen[i])
+        if unknown:
+            table = pf.read_row_group(rg, columns=list(columns[unknown]))
+            for i, col in zip(unknown, table.columns):
+                seen[i] = col.null_count < len(col) \
+                    and col.to_pandas().notna().any()
+        if seen.all():
+            break
+    return columns, seen
+
+
 #-----------------------------------------------------------------------------
 # Pivots
 #-----------------------------------------------------------------------------
-def gresample(df, gb: list, dt: str, period: str, ag: dict):
+def gresample(df, gb: list, dt: str, period: str, ag: dict,
+              presorted=False, n_workers=None):
     """Groupby, resample, and aggregate.
-    
+
+    Common aggregations are routed to vectorized groupby kernels:
+    ``'nunique'`` (alias ``'distinct'``), ``'count'``, ``'size'``, ``'sum'``,
+    ``'mean'``, ``'min'``, ``'max'``, ``'median'``, ``'std'``, ``'var'``,
+    ``'first'``, ``'last'``, quantiles as ``'q90'`` or ``('quantile', 0.9)``,
+    and their numpy/builtin equivalents (``np.sum``, ``len``, ...).
+    Any other function falls back to ``DataFrameGroupBy.agg``, which calls
+    it once per group.  Polars and Arrow frames are aggregated natively for
+    the built-in aggregations and common frequencies.
+
     :Args:
         :df: DataFrame
         :gb: list of GROUP BY columns
         :dt: datetime column
-        :period: frequency ("7D","M","Q")
-        :ag: dictionary of aggregation functions
+        :period: frequency ("7D","ME","QE")
+        :ag: dictionary of aggregation functions: ``{column: func}``,
+            ``{column: [funcs]}``, or named ``{output: (column, func)}``
+        :presorted: ``df`` is already sorted by ``gb``; skips sorting groups
+        :n_workers: split groups across this many worker processes
+            (built-in aggregations only)
 
     :Usage:
         safely combine groupby and resample::
@@ -235,22 +837,548 @@ def gresample(df, gb: list, dt: str, period: str, ag: dict):
                 gb = ['State','City'],
                 dt = 'Day',
                 period = '7D',
-                ag = {'EventID': lambda x: len(np.unique(x))}
+                ag = {'EventID': 'nunique'}  # not lambda x: len(np.unique(x))
             )
     """
-    
-    gresampled = df.groupby(gb + [pd.Grouper(freq=period, key=dt)]).agg(ag)
+
+    plan = _agg_plan(ag)
+    backend = _backend(df)
+    if backend:
+        gresampled = None
+        if plan is not None:
+            gresampled = backend.gresample(df, gb, dt, period, plan)
+        if gresampled is not None:
+            return gresampled
+        _l.debug(f'{me()} not supported natively, converting to pandas')
+        df = backend.to_pandas(df)
+
+    if plan is None:
+        _l.debug(f'{me()} custom aggregations, running groupby.agg')
+        g = df.groupby(
+            gb + [pd.Grouper(freq=period, key=dt)], sort=not presorted
+        )
+        return g.agg(**ag) if _agg_named(ag) else g.agg(ag)
+
+    if not n_workers or n_workers < 2:
+        g = df.groupby(
+            gb + [pd.Grouper(freq=period, key=dt)], sort=not presorted
+        )
+        return _agg_kernels(g, plan)
+
+    # bins are assigned once, so that every partition shares them; the
+    # labels go in a temporary key, so aggregations on dt see the dates
+    columns = list(dict.fromkeys(gb + [col for _, col, _ in plan]))
+    key = f'__{dt}_bin__'
+    binned = df[columns].assign(**{
+        key: df.groupby(pd.Grouper(freq=period, key=dt))[dt].transform(
+            lambda s: s.name
+        )
+    })
+    part = pd.util.hash_pandas_object(binned[gb], index=False).to_numpy()
+    parts = [binned[part % n_workers == i] for i in range(n_workers)]
+    job = partial(_gresample_part, keys=gb + [key], plan=plan)
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        gresampled = pd.concat(pool.map(job, parts)).sort_index()
+    gresampled.index = gresampled.index.rename(dt, level=key)
+    _l.info(f'{me()} aggregated {len(gresampled)} groups '
+            f'in {n_workers} partitions')
+    return gresampled
+
+
+def gresample_sql(conn, table, gb: list, dt: str, period: str, ag: dict,
+                  **kwargs) -> pd.DataFrame:
+    """Groupby, resample, and aggregate inside the database (SQL pushdown).
+
+    Same arguments and result shape as ``gresample``, but only aggregated
+    rows cross the wire.  Time buckets come from ``DATE_TRUNC`` and are
+    relabeled like pandas (e.g. month end for ``'ME'``); fixed frequencies
+    such as ``'7D'`` count whole periods from the first day of the data,
+    like pandas.
+
+    :Args:
+        :conn: a Connection object
+        :table: table name (or subquery in parentheses with an alias)
+        :gb: list of GROUP BY columns
+        :dt: datetime column
+        :period: frequency (see ``SQL_PERIODS``)
+        :ag: built-in aggregations, as in ``gresample``
+            (no ``'first'``/``'last'``)
+
+    :Kwargs:
+        :where: WHERE clause
+        :print: print the SQL query
+        :run: run the SQL query
+
+    :Returns:
+        pd.DataFrame indexed by ``gb + [dt]``
+    """
+
+    sql_params = {
+        'log': True,
+        'table': table,
+        'print': False,
+        'run': True,
+        'where': '1=1',
+    }
+    sql_params.update(**kwargs)
+
+    plan = _agg_plan(ag)
+    unit, step = SQL_PERIODS.get(period), None
+    if unit is None:
+        try:
+            offset = to_offset(period)
+        except ValueError:
+            offset = None
+        if isinstance(offset, (pd.offsets.Day, Tick)):
+            step = (pd.Timestamp(0) + offset - pd.Timestamp(0)).total_seconds()
+    if plan is None or (unit is None and step is None):
+        _l.error(f'{me()} unsupported period {period} or aggregations {ag}')
+        return
+    aggs = []
+    for i, (_, col, kernel) in enumerate(plan):
+        name, q = kernel if isinstance(kernel, tuple) else (kernel, None)
+        if name not in SQL_AGGS:
+            _l.error(f'{me()} no SQL aggregation for {name}')
+            return
+        aggs.append(SQL_AGGS[name].format(col=col, q=q) + f' AS agg_{i}')
+
+    if unit:
+        bucket = f"DATE_TRUNC('{unit}', {dt})"
+    else:  # number of periods since midnight of the first day
+        origin = (f"(SELECT EXTRACT(EPOCH FROM DATE_TRUNC('day', MIN({dt})))"
+                  f" FROM {table} WHERE {sql_params['where']})")
+        bucket = f'FLOOR((EXTRACT(EPOCH FROM {dt}) - {origin}) / {step})'
+        aggs.append(f'MIN({origin}) AS origin')
+    sql_params.update({
+        'gb': ',\n        '.join(gb),
+        'bucket': bucket,
+        'aggs': ',\n        '.join(aggs),
+        'notnull': ' AND '.join(f'{c} IS NOT NULL' for c in gb + [dt]),
+        'groups': ', '.join(gb + [bucket]),
+    })
+    q = """
+    SELECT
+        {gb},
+        {bucket} AS bucket,
+        {aggs}
+    FROM {table}
+    WHERE ({where}) AND {notnull}
+    GROUP BY {groups}
+    ORDER BY {groups}
+    """.format(**sql_params)
+
+    if not runquery(q, **sql_params):
+        return
+    df = sq(q, conn, log=sql_params['log'])
+    if df is None:
+        return
+
+    df.columns = gb + [dt] + [f'agg_{i}' for i in range(len(plan))] \
+        + ([] if unit else ['origin'])
+    if unit:
+        df[dt] = pd.to_datetime(df[dt])
+    else:
+        seconds = df.pop('origin').astype(float) + df[dt].astype(float) * step
+        df[dt] = pd.to_datetime(seconds, unit='s')
+    if period in SQL_PERIODS_END:
+        df[dt] = df[dt].dt.to_period(SQL_PERIODS_END[period]) \
+            .dt.to_timestamp(how='end').dt.normalize()
+    gresampled = df.set_index(gb + [dt])
+    gresampled.columns = pd.Index([out for out, _, _ in plan])
     return gresampled
 
 
+def _agg_kernel(func):
+    """Canonical name of a built-in aggregation, or None."""
+    if isinstance(func, tuple) and len(func) == 2 and func[0] == 'quantile':
+        return ('quantile', float(func[1]))
+    if isinstance(func, str):
+        q = re.fullmatch(r'[pq](\d+(?:\.\d+)?)', func)
+        if q:
+            return ('quantile', float(q.group(1)) / 100)
+    try:
+        return AGG_ALIASES.get(func)
+    except TypeError:  # unhashable
+        return None
+
+
+def _agg_named(ag: dict) -> bool:
+    """Whether ``ag`` is a named aggregation ``{output: (column, func)}``."""
+    return all(
+        isinstance(v, tuple) and len(v) == 2 and v[0] != 'quantile'
+        for v in ag.values()
+    )
+
+
+def _agg_plan(ag: dict):
+    """Translates ``ag`` into (output name, column, kernel) triples.
+
+    Output names follow ``DataFrameGroupBy.agg``.  Returns None if any
+    function is not a built-in aggregation.
+    """
+
+    if _agg_named(ag):
+        items = [(out, col, func) for out, (col, func) in ag.items()]
+    elif any(isinstance(v, list) for v in ag.values()):
+        items = [
+            ((col, f if isinstance(f, str) else getattr(f, '__name__', f)),
+             col, f)
+            for col, funcs in ag.items()
+            for f in (funcs if isinstance(funcs, list) else [funcs])
+        ]
+    else:
+        items = [(col, col, func) for col, func in ag.items()]
+
+    plan = [(out, col, _agg_kernel(func)) for out, col, func in items]
+    if any(kernel is None for _, _, kernel in plan):
+        return None
+    return plan
+
+
+def _agg_kernels(g, plan) -> pd.DataFrame:
+    """Runs vectorized groupby kernels and assembles the result."""
+    results = {}
+    for out, col, kernel in plan:
+        if kernel == 'size':
+            results[out] = g.size()
+        elif isinstance(kernel, tuple):
+            results[out] = g[col].quantile(kernel[1])
+        else:
+            results[out] = getattr(g[col], kernel)()
+    return pd.concat(results, axis=1)
+
+
+def _gresample_part(part, keys, plan) -> pd.DataFrame:
+    """Aggregates one partition of pre-binned groups; runs in a worker."""
+    return _agg_kernels(part.groupby(keys, sort=False), plan)
+
+
 #-----------------------------------------------------------------------------
 # Data Typing
 #-----------------------------------------------------------------------------
-def detect_mixed_types(df):
-    """ detects mixed dtypes that cause problem on loading to SQL """
-    mixed = []
-    for col in df.columns:
-        type_counts = df[col].apply(type).value_counts(dropna=False)
-        if len(type_counts) > 1:
-            mixed.append(type_counts)
+def detect_mixed_types(df, sample=None, n_examples=3, n_workers=None,
+                       random_state=42) -> pd.DataFrame:
+    """Detects mixed dtypes that cause problems on loading to SQL.
+
+    Only object columns can hold mixed types.  Each of them is screened
+    with ``pd.api.types.infer_dtype`` (on a stratified sample of ``sample``
+    rows, if given), and only the columns flagged as mixed are scanned in
+    full to count the Python types of their values.  ``infer_dtype`` holds
+    the GIL, so wide frames are screened in worker processes; the values
+    screened are pickled to them, which pays off with ``sample``.
+
+    :Args:
+        :df: DataFrame
+        :sample: screen a stratified sample of this many rows per column;
+            faster, but may miss rare offending values
+        :n_examples: number of example row labels per minority type
+        :n_workers: screen columns in this many worker processes
+        :random_state: seed for the sample
+
+    :Returns:
+        DataFrame indexed by mixed column name with ``inferred_type``,
+        counts of Python ``types`` and ``examples`` of the minority types;
+        empty if no mixed columns are found
+    """
+
+    columns = [df.iloc[:, i] for i, t in enumerate(df.dtypes) if t == object]
+    values = [_screened_values(s, sample, random_state) for s in columns]
+    if n_workers and n_workers > 1 and len(columns) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            flags = list(pool.map(
+                _is_mixed, values,
+                chunksize=-(-len(values) // (4 * n_workers))
+            ))
+    else:
+        flags = [_is_mixed(v) for v in values]
+    reports = [
+        _mixed_column_report(s, n_examples)
+        for s, flag in zip(columns, flags) if flag
+    ]
+
+    mixed = pd.DataFrame(
+        [r for r in reports if r],
+        columns=['column', 'inferred_type', 'types', 'examples'],
+    ).set_index('column')
+    _l.info(f'{me()} {len(mixed)} of {len(columns)} object columns are mixed')
     return mixed
+
+
+def _screened_values(s, sample, random_state) -> np.ndarray:
+    """Values of a column to screen: all of them, or a stratified sample."""
+    values = s.to_numpy()
+    if sample and len(values) > sample:
+        values = values[_stratified_positions(len(values), sample, random_state)]
+    return values
+
+
+def _is_mixed(values) -> bool:
+    """Screens the values of one column; runs in a worker with n_workers."""
+    return infer_dtype(values, skipna=True) in MIXED_TYPES
+
+
+def _mixed_column_report(s, n_examples):
+    """Counts the Python types of a column flagged as mixed."""
+
+    s = s[s.notna()]
+    types = s.map(type)
+    type_counts = types.value_counts()
+    if len(type_counts) < 2:
+        return None  # e.g. only dates
+    return {
+        'column': s.name,
+        'inferred_type': infer_dtype(s, skipna=True),
+        'types': {t.__name__: n for t, n in type_counts.items()},
+        'examples': {
+            t.__name__: list(s.index[(types == t).to_numpy()][:n_examples])
+            for t in type_counts.index[1:]
+        },
+    }
+
+
+def _stratified_positions(n, size, random_state, strata=10) -> np.ndarray:
+    """Random positions drawn evenly from ``strata`` blocks of ``n`` rows."""
+    rng = np.random.default_rng(random_state)
+    edges = np.linspace(0, n, strata + 1).astype(np.int64)
+    per_stratum = -(-size // strata)
+    return np.concatenate([
+        rng.integers(a, b, per_stratum)
+        for a, b in zip(edges[:-1], edges[1:]) if b > a
+    ])
+
+
+#-----------------------------------------------------------------------------
+# Polars/Arrow Backends
+#-----------------------------------------------------------------------------
+def _backend(df):
+    """Backend for a Polars or Arrow object; None for pandas."""
+    return BACKENDS.get(type(df).__module__.split('.')[0])
+
+
+def _nrows(df) -> int:
+    backend = _backend(df)
+    return backend.nrows(df) if backend else len(df)
+
+
+class PolarsBackend:
+    """Runs ``lucid.df`` functions on Polars DataFrames and LazyFrames.
+
+    Queries are lazy and multi-threaded; results are pandas objects
+    shaped like the pandas versions.
+    """
+
+    # pandas frequency -> (truncate to, offset of the label); other
+    # frequencies are fixed (Day/Tick) or left to pandas, which accepts
+    # or rejects legacy aliases ('M', 'A') depending on its version
+    PERIODS = {
+        'MS': ('1mo', None),
+        'ME': ('1mo', '1mo'),
+        'QS': ('1q', None),
+        'QE': ('1q', '1q'),
+        'YS': ('1y', None),
+        'YE': ('1y', '1y'),
+        'W': ('1w', '1w'),
+    }
+
+    @staticmethod
+    def _lazy(df):
+        return df.lazy()
+
+    @staticmethod
+    def columns(df) -> list:
+        return PolarsBackend._lazy(df).collect_schema().names()
+
+    @staticmethod
+    def nrows(df) -> int:
+        import polars as pl
+        return PolarsBackend._lazy(df).select(pl.len()).collect().item()
+
+    @staticmethod
+    def to_pandas(df) -> pd.DataFrame:
+        return PolarsBackend._lazy(df).collect().to_pandas()
+
+    @staticmethod
+    def select(df, columns):
+        return df.select(columns)
+
+    @staticmethod
+    def _col(schema, col):
+        """Column expression with NaN as null, like pandas."""
+        import polars as pl
+        expr = pl.col(col)
+        return expr.fill_nan(None) if schema[col].is_float() else expr
+
+    @staticmethod
+    def null_counts(df) -> pd.Series:
+        lf = PolarsBackend._lazy(df)
+        schema = lf.collect_schema()
+        nulls = lf.select([
+            PolarsBackend._col(schema, c).null_count() for c in schema
+        ]).collect()
+        return pd.Series(nulls.row(0), index=schema.names())
+
+    @staticmethod
+    def value_counts(df, columns, dropna=False) -> list:
+        import polars as pl
+        lf = PolarsBackend._lazy(df)
+        schema = lf.collect_schema()
+        queries = []
+        for col in columns:
+            q = lf.select(PolarsBackend._col(schema, col))
+            if dropna:
+                q = q.drop_nulls()
+            queries.append(
+                q.group_by(col).len().sort('len', descending=True)
+            )
+        return [
+            pd.Series(
+                counts['len'].to_numpy().astype(np.int64),
+                index=pd.Index(counts[col].to_list(), name=col),
+                name='count',
+            )
+            for col, counts in zip(columns, pl.collect_all(queries))
+        ]
+
+    @staticmethod
+    def top_values(series, n) -> tuple:
+        order = series.arg_sort(descending=True, nulls_last=True)
+        topn = series.gather(order[:n])
+        return (pd.Series(topn.to_list(), index=order[:n].to_list()),
+                series.gather(order[n:]).sum())
+
+    @staticmethod
+    def _bucket(lf, dt, period):
+        """Expression assigning ``dt`` to pandas resample bins, or None."""
+        import polars as pl
+        if period in PolarsBackend.PERIODS:
+            every, label = PolarsBackend.PERIODS[period]
+            bucket = pl.col(dt).dt.truncate(every)
+            if label:  # labeled by the last day of the period
+                bucket = bucket.dt.offset_by(label).dt.offset_by('-1d')
+            return bucket
+        try:
+            offset = to_offset(period)
+        except ValueError:
+            return None
+        if not isinstance(offset, (pd.offsets.Day, Tick)):
+            return None
+        step = (pd.Timestamp(0) + offset - pd.Timestamp(0)).value
+        # fixed bins start on the first day of the data, like pandas
+        origin = lf.select(pl.col(dt).min().dt.truncate('1d')).collect().item()
+        since = (pl.col(dt) - pl.lit(origin)).dt.total_nanoseconds()
+        return pl.lit(origin) + pl.duration(nanoseconds=since // step * step)
+
+    @staticmethod
+    def gresample(df, gb, dt, period, plan):
+        import polars as pl
+        lf = PolarsBackend._lazy(df)
+        bucket = PolarsBackend._bucket(lf, dt, period)
+        if bucket is None:
+            return None
+
+        schema = lf.collect_schema()
+        aggs = []
+        for i, (_, col, kernel) in enumerate(plan):
+            x = PolarsBackend._col(schema, col)
+            if kernel == 'size':
+                expr = pl.len().cast(pl.Int64)
+            elif kernel == 'nunique':
+                expr = x.drop_nulls().n_unique().cast(pl.Int64)
+            elif kernel == 'count':
+                expr = x.count().cast(pl.Int64)
+            elif kernel in ('first', 'last'):
+                expr = getattr(x.drop_nulls(), kernel)()
+            elif isinstance(kernel, tuple):
+                expr = x.quantile(kernel[1], interpolation='linear')
+            else:
+                expr = getattr(x, kernel)()
+            aggs.append(expr.alias(f'agg_{i}'))
+
+        gresampled = (
+            lf.filter(pl.all_horizontal(pl.col(gb + [dt]).is_not_null()))
+            .with_columns(bucket.alias(dt))
+            .group_by(gb + [dt])
+            .agg(aggs)
+            .collect()
+            .to_pandas()
+            .set_index(gb + [dt])
+            .sort_index()
+        )
+        gresampled.columns = pd.Index([out for out, _, _ in plan])
+        return gresampled
+
+
+class ArrowBackend:
+    """Runs ``lucid.df`` functions on pyarrow Tables with ``pyarrow.compute``.
+
+    ``gresample`` goes through Polars (zero-copy) if it is installed.
+    """
+
+    @staticmethod
+    def columns(df) -> list:
+        return df.column_names
+
+    @staticmethod
+    def nrows(df) -> int:
+        return df.num_rows
+
+    @staticmethod
+    def to_pandas(df) -> pd.DataFrame:
+        return df.to_pandas()
+
+    @staticmethod
+    def select(df, columns):
+        return df.select(columns)
+
+    @staticmethod
+    def null_counts(df) -> pd.Series:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        nulls = []
+        for col in df.columns:
+            n = col.null_count
+            if pa.types.is_floating(col.type):
+                n += pc.sum(pc.is_nan(col)).as_py() or 0
+            nulls.append(n)
+        return pd.Series(nulls, index=df.column_names)
+
+    @staticmethod
+    def value_counts(df, columns, dropna=False) -> list:
+        import pyarrow.compute as pc
+        results = []
+        for col in columns:
+            counts = pc.value_counts(df[col])
+            counts = pd.Series(
+                counts.field('counts').to_numpy(),
+                index=pd.Index(counts.field('values').to_pylist(), name=col),
+                name='count',
+            )
+            if dropna:
+                counts = counts[counts.index.notna()]
+            results.append(counts.sort_values(ascending=False, kind='stable'))
+        return results
+
+    @staticmethod
+    def top_values(series, n) -> tuple:
+        import pyarrow.compute as pc
+        order = pc.array_sort_indices(
+            series, order='descending', null_placement='at_end'
+        )
+        topn = series.take(order[:n])
+        return (pd.Series(topn.to_pylist(), index=order[:n].to_pylist()),
+                pc.sum(series.take(order[n:])).as_py())
+
+    @staticmethod
+    def gresample(df, gb, dt, period, plan):
+        try:
+            import polars as pl
+        except ImportError:
+            return None
+        return PolarsBackend.gresample(pl.from_arrow(df), gb, dt, period, plan)
+
+
+# backends by top-level module of the dataframe type; add your own here
+BACKENDS = {
+    'polars': PolarsBackend,
+    'pyarrow': ArrowBackend,
+}
@@ -31,6 +31,7 @@ import pandas as pd
 import requests
 
 # Internal imports
+from .io import object_cache, read_stream
 
 #-----------------------------------------------------------------------------
 # Auth
@@ -214,6 +215,56 @@ def gget(link, gauth: GoogleAuth) -> requests.models.Response:
     return r
 
 
+def gread(link, gauth: GoogleAuth, fmt='csv', **kwargs):
+    """Streams a Drive file into DataFrame batches, without saving it.
+
+    Gzip/zstd files are decompressed on the fly.
+
+    :Kwargs:
+        keyword arguments for ``lucid.io.read_stream()``
+
+    :Usage:
+        ::
+
+            df = pd.concat(gread(link, gauth, sep='\\t'))
+    """
+
+    return read_stream(gget(link, gauth), fmt=fmt, **kwargs)
+
+
+def gfetch(link, gauth: GoogleAuth, cache=None) -> str:
+    """Local path of a Drive file, downloaded only if it changed.
+
+    Files are kept in an ObjectCache (the shared one by default) by file
+    ID and ``md5Checksum`` (``modifiedTime`` for Google Docs, which have
+    no checksum); each call revalidates with a metadata request.
+    """
+
+    cache = cache or object_cache()
+    gauth._check_credentials()
+    credentials = gauth.credentials
+
+    file_url = api_file_url(link)
+    meta = requests.get(
+        file_url.replace('alt=media', 'fields=md5Checksum,modifiedTime'
+                         '&supportsAllDrives=true'),
+        headers={"Authorization": f"Bearer {credentials.token}"},
+    )
+    meta.raise_for_status()
+    meta = meta.json()
+    source = 'gdrive:' + file_url.split('/')[-1].split('?')[0]
+    version = meta.get('md5Checksum') or meta['modifiedTime']
+
+    path = cache.get(source, version)
+    if path is None:
+        r = gget(link, gauth)
+        r.raise_for_status()
+        path = cache.put((source, version), r.iter_content(chunk_size=2**20))
+        cache.set_ref(source, version)
+        _l.debug(f'cached {link} at {path}')
+    return path
+
+
 def ls(link_or_folderid, gauth: GoogleAuth) -> pd.DataFrame:
     """Lists files in a folder."""
 
@@ -16,12 +16,36 @@ _l = logging.getLogger(__name__)
 #-----------------------------------------------------------------------------
 
 # External imports
-from jinja2 import FileSystemLoader, PackageLoader, Environment, Template
-from requests.models import Response
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial, reduce
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from io import BufferedReader, BytesIO, RawIOBase
+from itertools import chain
+from queue import Queue
 from subprocess import check_output
+from threading import Thread
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qs, urlsplit
+import hashlib
+import json
+import mmap
+import numpy as np
 import os
 import pandas as pd
 import re
+import struct
+import tempfile
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: no locks between processes
+    fcntl = None
+
+if TYPE_CHECKING:
+    from requests.models import Response
 
 # Internal imports
 from .util import MattrD, me, tnow
@@ -30,7 +54,6 @@ from .util import MattrD, me, tnow
 #-----------------------------------------------------------------------------
 # Globals & Constants
 #-----------------------------------------------------------------------------
-IP = check_output(['hostname', '-i']).decode('utf-8')[:-1]
 J2_FOLDER = os.path.abspath('j2/')
 J2_DT_BASIC = 'dt_basic.j2.html'  # basic DataTables template
 
@@ -50,11 +73,51 @@ WEBCONF = MattrD({
 
 HOMEDIR=os.path.expanduser('~')
 WEBPORT = 8080
-WEBSERVER = f'{IP}:{WEBPORT}/'
+WEBHOST = '127.0.0.1'  # interface of the local query server ('' for all)
 WEBTABLES_URL_JUPYTER = True  # display URL of published webtables in Jupyter
-WWWFOLDER = f'{HOMEDIR}/www/'  # root folder of the webserver
-if not os.path.exists(WWWFOLDER):
-    os.mkdir(WWWFOLDER)
+WWWFOLDER = f'{HOMEDIR}/www/'  # root folder of the webserver (created on use)
+HTML_BLOCK_ROWS = 10_000  # rows per block written by streaming webtables
+HTML_ROWS_MARK = '<!-- lucid:rows -->'  # where streamed rows go in a page
+SHARD_ROWS = 50_000  # rows per JSON shard of ajax='shards' webtables
+COMPRESS_BLOCK = 2**20  # bytes per block of precompressed outputs
+GZIP_LEVEL = 6  # as gzip/pigz; 9 can be 10x slower on repetitive JSON
+BROTLI_QUALITY = 9  # 10-11 are much slower on 100+ MB files
+XL_MAX_ROWS = 1_048_576  # rows per Excel sheet, including the header
+XL_MAX_WIDTH = 60  # widest column set by xlsave
+XL_WIDTH_SAMPLE = 1_000  # rows sampled to size xlsave columns
+XL_CACHE = f'{HOMEDIR}/.cache/lucid/xlsx/'  # Parquet cache of xlread sheets
+DOWNLOAD_CHUNK = 2**20  # bytes per chunk of streamed downloads
+STREAM_PREFETCH = 16  # chunks read ahead of the parser by ByteStream
+STREAM_ROWS = 100_000  # rows per DataFrame batch of read_stream
+CACHE_DIR = f'{HOMEDIR}/.cache/lucid/objects/'  # local cache of S3/Drive objects
+CACHE_MAX_BYTES = 10 * 2**30  # least recently used objects are evicted beyond
+CACHE_EVICT_TO = 0.9  # share of CACHE_MAX_BYTES left after an eviction
+
+
+@lru_cache()
+def _ip() -> str:
+    """IP address of this host, looked up on first use."""
+    return check_output(['hostname', '-i']).decode('utf-8')[:-1]
+
+
+def _webserver() -> str:
+    """Address of the local query server if it runs, else ``IP:WEBPORT``."""
+    if _SERVER is None:
+        return f'{_ip()}:{WEBPORT}/'
+    host, port = _SERVER.server_address[:2]
+    if host in ('', '0.0.0.0', '::'):
+        host = _ip()
+    return f'{host}:{port}/'
+
+
+def __getattr__(name):
+    """Host-dependent constants (``IP``, ``WEBSERVER``) are resolved lazily."""
+    if name == 'IP':
+        return _ip()
+    if name == 'WEBSERVER':
+        return _webserver()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 #-----------------------------------------------------------------------------
 # Reading/Writing Excel
@@ -66,20 +129,41 @@ def _xlsheet(writer, df, sheet_name, **kwargs):
     Auxiliary function to xlsave.
     """
 
-    df.to_excel(writer, sheet_name, **kwargs)
+    df.to_excel(writer, sheet_name=sheet_name, **kwargs)
     #tweak column width
+    offset = df.index.nlevels if kwargs.get('index', True) else 0
+    for i, width in enumerate(_xlwidths(df)):
+        writer.sheets[sheet_name].set_column(i + offset, i + offset, width)
+
+
+def _xlwidths(df, sample=XL_WIDTH_SAMPLE) -> list:
+    """Column widths from the header and a sample of rows."""
+
+    if len(df) > sample:
+        rows = df.iloc[np.linspace(0, len(df) - 1, sample).astype(int)]
+    else:
+        rows = df
+    widths = []
     for i in range(df.shape[1]):
-        writer.sheets[sheet_name].set_column(i, i+1, len(df.columns[i]) + 4)
+        values = rows.iloc[:, i].dropna().astype(str).str.len()
+        width = max(len(str(df.columns[i])), values.max() if len(values) else 0)
+        widths.append(min(width, XL_MAX_WIDTH) + 2)
+    return widths
 
 
-def xlsave(output_file, frames, sheets, **kwargs):
+def xlsave(output_file, frames, sheets, large=False, **kwargs):
     """Saves one or more DataFrames to specified Excel sheet(s).
 
     :Args:
         :output_file: file name
         :frames: one DataFrames or a list of DataFrames
         :sheets: one sheet name or a list of sheet names
+        :large: stream rows to disk with constant memory and split frames
+            over ``XL_MAX_ROWS`` across sheets ``<name>_1..n``; used
+            automatically for frames that don't fit a sheet
         :kwargs: keyword arguments for ``pd.DataFrame.to_excel()``
+            (only ``index``, ``columns``, ``header`` and ``na_rep`` in
+            large mode; others are ignored with a warning)
 
     :Usage:
         ::
@@ -98,23 +182,244 @@ def xlsave(output_file, frames, sheets, **kwargs):
         ``xlsxwriter``
     """
 
+    #if only one sheet:
+    if isinstance(sheets, str):
+        frames, sheets = [frames], [sheets]
+    if not large and any(len(f) > XL_MAX_ROWS - 1 for f in frames):
+        _l.info(f'{me()} frames too big for a sheet, switching to large mode')
+        large = True
+    if large:
+        return _xlsave_large(output_file, frames, sheets, **kwargs)
+
     with pd.ExcelWriter(
         output_file,
-        options = {
+        engine='xlsxwriter',
+        engine_kwargs={'options': {
             'remove_timezone': True,
-        },
+        }},
     ) as writer:
         _l.info(f'{me()} saving to file {output_file} ...')
-        #if only one sheet:
-        if isinstance(sheets, str):
-            _xlsheet(writer, frames, sheets, **kwargs)
-        #if multiple sheets
-        else:
-            for f, s in zip(frames, sheets):
-                _xlsheet(writer, f, s, **kwargs)
+        for f, s in zip(frames, sheets):
+            _xlsheet(writer, f, s, **kwargs)
         _l.info(f'{me()} done')
 
 
+def _xlsave_large(output_file, frames, sheets, index=True, columns=None,
+                  header=True, na_rep=None, block_rows=10_000, **kwargs):
+    """Writes sheets with xlsxwriter's ``constant_memory`` mode.
+
+    Rows are converted to Python values a block at a time and written
+    in order, so only the current row is held by the writer.  ``index``,
+    ``columns``, ``header`` and ``na_rep`` work as in ``to_excel()``.
+    """
+
+    import xlsxwriter
+    if kwargs:
+        _l.warning(f'{me()} large mode ignores {", ".join(sorted(kwargs))}')
+
+    wb = xlsxwriter.Workbook(output_file, {
+        'constant_memory': True,
+        'remove_timezone': True,
+        'nan_inf_to_errors': True,
+        'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+    })
+    bold = wb.add_format({'bold': True})
+    _l.info(f'{me()} saving to file {output_file} ...')
+    for df, name in zip(frames, sheets):
+        if columns is not None:
+            df = df[columns]
+        if isinstance(header, (list, tuple)):
+            df = df.set_axis(header, axis=1)
+        labels = [str(c) for c in df.columns]
+        if index:  # unnamed index levels get a blank header, as in to_excel
+            labels = ['' if n is None else str(n)
+                      for n in df.index.names] + labels
+            df = df.reset_index(allow_duplicates=True)
+        per_sheet = XL_MAX_ROWS - bool(header)
+        n_sheets = max(-(-len(df) // per_sheet), 1)
+        widths = _xlwidths(df)
+        for i in range(n_sheets):
+            sheet_name = name if n_sheets == 1 else f'{name[:26]}_{i + 1}'
+            ws = wb.add_worksheet(sheet_name)
+            for j, width in enumerate(widths):
+                ws.set_column(j, j, width)
+            r = 0
+            if header:
+                ws.write_row(0, 0, labels, bold)
+                r = 1
+            part = df.iloc[i * per_sheet:(i + 1) * per_sheet]
+            for start in range(0, len(part), block_rows):
+                block = part.iloc[start:start + block_rows].astype(object)
+                for row in block.where(block.notna(), na_rep).to_numpy():
+                    ws.write_row(r, 0, row)
+                    r += 1
+            _l.debug(f'{me()} wrote {len(part)} rows to sheet {sheet_name}')
+    wb.close()
+    _l.info(f'{me()} done')
+
+
+def xlsaves(jobs, n_workers=None) -> pd.DataFrame:
+    """Saves many Excel workbooks in parallel.
+
+    :Args:
+        :jobs: iterable of ``(output_file, frames, sheets, kwargs)``,
+            where ``kwargs`` are ``xlsave`` kwargs
+        :n_workers: number of worker processes (defaults to CPU count);
+            ``1`` saves in this process
+
+    :Returns:
+        pd.DataFrame with file, seconds, bytes, error per workbook
+    """
+
+    jobs = list(jobs)
+    if n_workers == 1:
+        report = [_xlsave_job(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            report = list(pool.map(_xlsave_job, jobs))
+    return pd.DataFrame(report, columns=['file', 'seconds', 'bytes', 'error'])
+
+
+def _xlsave_job(job) -> dict:
+    """Saves one ``xlsaves`` workbook and times it."""
+
+    output_file, frames, sheets, kwargs = job
+    t0 = time.perf_counter()
+    try:
+        xlsave(output_file, frames, sheets, **kwargs)
+        size, error = os.path.getsize(output_file), None
+    except Exception as e:
+        size, error = None, f'{type(e).__name__}: {e}'
+        _l.error(f'{me()} {output_file}: {error}')
+    return {
+        'file': output_file,
+        'seconds': time.perf_counter() - t0,
+        'bytes': size,
+        'error': error,
+    }
+
+
+def xlread(file, sheets=None, n_workers=None, cache=True, **kwargs):
+    """Reads all or selected sheets of an Excel workbook.
+
+    Sheets are parsed with the ``calamine`` engine, in parallel worker
+    processes, and cached as Parquet in ``XL_CACHE``, keyed by the hash
+    of the workbook and the read options.  The hash is only recomputed
+    when the file's mtime or size change, so repeat loads read Parquet.
+
+    :Args:
+        :file: workbook
+        :sheets: one sheet (name or position), a list of sheets, or None
+            for all sheets
+        :n_workers: number of worker processes (defaults to CPU count);
+            ``1`` parses in this process
+        :cache: use the Parquet cache
+        :kwargs: keyword arguments for ``pd.read_excel()``
+
+    :Returns:
+        DataFrame for one sheet, dict of ``{sheet: DataFrame}`` otherwise
+
+    :Requires:
+        ``python-calamine``, ``pyarrow``
+    """
+
+    kwargs.setdefault('engine', 'calamine')
+    folder = _xlcache_folder(file, kwargs) if cache else None
+    names = _xlsheet_names(file, folder, kwargs['engine'])
+    if sheets is None:
+        wanted = names
+    else:
+        single = isinstance(sheets, (str, int))
+        wanted = [
+            names[s] if isinstance(s, int) else s
+            for s in ([sheets] if single else sheets)
+        ]
+
+    frames, missing = {}, []
+    for s in wanted:
+        path = folder and os.path.join(folder, f'{names.index(s)}.parquet')
+        if path and os.path.exists(path):
+            frames[s] = pd.read_parquet(path)
+        else:
+            missing.append(s)
+    if frames:
+        _l.info(f'{me()} {len(frames)} sheets of {file} read from cache')
+
+    if n_workers == 1 or len(missing) < 2:
+        parsed = [_xlread_sheet(file, s, kwargs) for s in missing]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            parsed = list(pool.map(partial(_xlread_sheet, file, kwargs=kwargs),
+                                   missing))
+    for s, df in zip(missing, parsed):
+        frames[s] = df
+        if folder:
+            _xlcache_sheet(df, os.path.join(folder, f'{names.index(s)}.parquet'))
+    if missing:
+        _l.info(f'{me()} parsed {len(missing)} sheets of {file}')
+
+    if sheets is not None and single:
+        return frames[wanted[0]]
+    return {s: frames[s] for s in wanted}
+
+
+def _xlread_sheet(file, sheet, kwargs) -> pd.DataFrame:
+    """Parses one sheet; auxiliary function to xlread."""
+    return pd.read_excel(file, sheet_name=sheet, **kwargs)
+
+
+def _xlsheet_names(file, folder, engine) -> list:
+    """Sheet names of a workbook, from the cache folder if possible."""
+
+    path = folder and os.path.join(folder, 'sheets.json')
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    with pd.ExcelFile(file, engine=engine) as xl:
+        names = list(xl.sheet_names)
+    if path:
+        _atomic_write(path, json.dumps(names))
+    return names
+
+
+def _xlcache_folder(file, kwargs) -> str:
+    """Cache folder of a workbook read with ``kwargs``.
+
+    The workbook hash is stored with its mtime and size, and reused while
+    they are unchanged.
+    """
+
+    st = os.stat(file)
+    meta_file = os.path.join(XL_CACHE, 'files', hashlib.blake2b(
+        os.path.abspath(file).encode(), digest_size=16).hexdigest() + '.json')
+    meta = {}
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+    if meta.get('mtime') != st.st_mtime or meta.get('size') != st.st_size:
+        h = hashlib.blake2b(digest_size=16)
+        with open(file, 'rb') as f:
+            for chunk in iter(partial(f.read, 2**20), b''):
+                h.update(chunk)
+        meta = {'mtime': st.st_mtime, 'size': st.st_size, 'hash': h.hexdigest()}
+        os.makedirs(os.path.dirname(meta_file), exist_ok=True)
+        _atomic_write(meta_file, json.dumps(meta))
+
+    options = hashlib.blake2b(json.dumps(
+        kwargs, sort_keys=True, default=str).encode(), digest_size=8)
+    folder = os.path.join(XL_CACHE, f'{meta["hash"]}-{options.hexdigest()}')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def _xlcache_sheet(df, path) -> None:
+    """Caches a parsed sheet as Parquet; sheets Parquet can't hold are skipped."""
+    try:
+        _atomic_write(path, df.to_parquet())
+    except Exception as e:
+        _l.warning(f'{me()} not caching {path}: {e}')
+
+
 #-----------------------------------------------------------------------------
 # Reading/Writing Web Pages
 #-----------------------------------------------------------------------------
@@ -138,10 +443,27 @@ def webtable(df, file, **kwargs):
         :content: extra content (such as Bokeh chart)
         :sort_col: sort by column; must escape quote characters,
             *e.g.* ``'5, \"desc\"'``
-        :ajax: use server-side rendering with Ajax (for big tables)
+        :ajax: use server-side rendering with Ajax (for big tables);
+            ``'shards'`` writes JSON shards that are fetched page by page;
+            ``'server'`` registers the table with the local query server
+            (see ``serve()``), in which case ``df`` may also be a path to
+            a Parquet file
+        :shard_rows: rows per shard for ``ajax='shards'``
+        :stream: write ``<tr>`` rows in blocks straight to the file,
+            keeping memory flat (for big tables)
+        :compress: also write precompressed siblings of the page and its
+            JSON files: ``'gz'``, ``'br'`` or ``['gz', 'br']``
+            (see ``compress_file()``)
         :showurl: if saving to localhost:WEBPORT, display URL to saved webpage
     """
 
+    _webtable(df, file, **kwargs)
+    return
+
+
+def _webtable(df, file, **kwargs):
+    """Publishes a web table; returns bytes written (None on failure)."""
+
     pd.options.display.max_colwidth = None
     html_params = {
         'j2template': J2_DT_BASIC,
@@ -155,29 +477,69 @@ def webtable(df, file, **kwargs):
         'scripts': '',
         'sort_col': '1, \"asc\"',
         'ajax': False,
+        'shard_rows': SHARD_ROWS,
+        'stream': False,
+        'compress': None,
         'showurl': True,
     }
     html_params.update(**kwargs)
+    if html_params['wwwfolder']:
+        os.makedirs(html_params['wwwfolder'], exist_ok=True)
+
+    # server-side tables stay with the query server; the page gets headers
+    if html_params['ajax'] == 'server':
+        name = re.sub('\\.html$', '', file).strip('/')
+        table = register_table(df, name, wwwfolder=html_params['wwwfolder'])
+        df = pd.DataFrame(columns=table.columns)
 
     table_html_empty = df.head(0).to_html(index=False)
     tbody_thead = ''.join(re.split('</?tbody>\n', table_html_empty))
     thead = '\n'.join(re.split('\n', tbody_thead)[1:-1])
     tfoot = re.sub('thead>','tfoot>', thead)
+    rows = None
+
+    if html_params['ajax'] == 'server':
+        html = '\n'.join([thead, tfoot])
+        jsonfile = f'/dt/{name}'
+
+    # for sharded Ajax tables we write a folder of shards and a manifest
+    elif html_params['ajax'] == 'shards':
+        html = '\n'.join([thead, tfoot])
+        url_prefix = '/' if html_params['wwwfolder'] else ''
+        datadir = url_prefix + re.sub('\\.html$', '', file) + '_data'
+        _write_shards(
+            df,
+            html_params['wwwfolder'] + datadir,
+            html_params['sort_col'],
+            html_params['shard_rows'],
+        )
+        jsonfile = datadir + '/manifest.json'
+        if html_params['compress']:
+            folder = html_params['wwwfolder'] + datadir
+            for name in os.listdir(folder):
+                if name.endswith('.json'):
+                    compress_file(os.path.join(folder, name),
+                                  html_params['compress'])
 
     # for Ajax tables we need just <thead> and <tfoot> elements
-    if html_params['ajax']:
+    elif html_params['ajax']:
         html = '\n'.join([thead, tfoot])
         if not html_params['wwwfolder']:
             url_prefix = ''
         else:
             url_prefix = '/'
         jsonfile = url_prefix + re.sub('html$','json', file)
-        df.to_json(
-            html_params['wwwfolder']+jsonfile,
-            orient='split',
-            index=False,
-        )
-        os.chmod(html_params['wwwfolder']+jsonfile, 0o666)
+        _atomic_write(html_params['wwwfolder']+jsonfile,
+                      df.to_json(orient='split', index=False), mode=0o666)
+        if html_params['compress']:
+            compress_file(html_params['wwwfolder']+jsonfile,
+                          html_params['compress'])
+
+    # streamed tables get their <td>'s while the page is written
+    elif html_params['stream']:
+        html = '\n'.join([thead, HTML_ROWS_MARK, tfoot])
+        jsonfile = None
+        rows = _html_rows(df)
 
     # for regular tables we also need <td>'s
     else:
@@ -190,27 +552,288 @@ def webtable(df, file, **kwargs):
 
     html_params['table_json'] = jsonfile
     html_params['table_html'] = html
-    _make_j2html_basic(html_params, file)
-    return
+    return _make_j2html_basic(html_params, file, rows=rows)
+
+
+def webtables(jobs, n_workers=None) -> pd.DataFrame:
+    """Publishes many web tables in parallel.
+
+    Pages are rendered in worker processes, each compiling the template
+    once, and written atomically.
+
+    :Args:
+        :jobs: iterable of ``(df, file, params)``, where ``params`` are
+            ``webtable`` kwargs
+        :n_workers: number of worker processes (defaults to CPU count);
+            ``1`` publishes in this process
+
+    :Returns:
+        pd.DataFrame with file, rows, seconds, bytes, error per page
+
+    :Usage:
+        ::
+
+            jobs = [(g, f'{k}.html', {'title': k}) for k, g in df.groupby('id')]
+            report = webtables(jobs, n_workers=8)
+    """
+
+    jobs = list(jobs)
+    t0 = time.perf_counter()
+    if n_workers == 1:
+        report = [_publish(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            report = list(pool.map(_publish, jobs))
+    report = pd.DataFrame(
+        report, columns=['file', 'rows', 'seconds', 'bytes', 'error'])
+    _l.info(f'{me()} published {report.error.isna().sum()}/{len(report)} '
+            f'pages in {time.perf_counter() - t0:.1f}s')
+    return report
+
+
+def _publish(job) -> dict:
+    """Publishes one ``webtables`` job and times it."""
+
+    df, file, params = job
+    params = {**params, 'showurl': False}
+    t0 = time.perf_counter()
+    try:
+        size = _webtable(df, file, **params)
+        error = None if size is not None else 'page not written, see log'
+    except Exception as e:
+        size, error = None, f'{type(e).__name__}: {e}'
+        _l.error(f'{me()} {file}: {error}')
+    return {
+        'file': file,
+        'rows': len(df),
+        'seconds': time.perf_counter() - t0,
+        'bytes': size,
+        'error': error,
+    }
+
+
+def _html_rows(df, block_rows=HTML_BLOCK_ROWS, na_rep='NaN'):
+    """Yields ``<tr>`` rows of a DataFrame, built in vectorized blocks.
+
+    Cells read as in ``df.to_html()``: float columns share one format,
+    chosen from the whole column, floats in object and nullable columns
+    are trimmed one by one, and missing values show as ``NaT``, ``None``
+    or ``<NA>`` where pandas shows them so.
+    """
+
+    digits = pd.get_option('display.precision')
+    floats, mixed = {}, []
+    for i, dtype in enumerate(df.dtypes):
+        if isinstance(dtype, np.dtype) and dtype.kind == 'f':
+            floats[i] = _html_float_format(df.iloc[:, i])
+        elif dtype == object or dtype.kind == 'f':
+            mixed.append(i)
+
+    def trimmed(v):
+        text = f'{v:.{digits}f}'.rstrip('0')
+        return text + '0' if text.endswith('.') else text
+
+    def missing_rep(v):
+        if v is None:
+            return 'None'
+        if v is pd.NA:
+            return '<NA>'
+        return 'NaT' if v is pd.NaT else na_rep
+
+    for start in range(0, len(df), block_rows):
+        block = df.iloc[start:start + block_rows]
+        cells = block.astype(str).to_numpy(dtype=object)
+        for i, fmt in floats.items():
+            values = block.iloc[:, i].to_numpy(dtype=float, na_value=np.nan)
+            cells[:, i] = [fmt.format(v) for v in values]
+        for i in mixed:
+            values = block.iloc[:, i].to_numpy(dtype=object)
+            cells[:, i] = [trimmed(v) if isinstance(v, float) else c
+                           for v, c in zip(values, cells[:, i])]
+        missing = block.isna().to_numpy()
+        for i in np.flatnonzero(missing.any(axis=0)):
+            rows = np.flatnonzero(missing[:, i])
+            values = block.iloc[rows, i].to_numpy(dtype=object)
+            cells[rows, i] = [missing_rep(v) for v in values]
+        html = '    <tr>\n      <td>' + cells[:, 0]
+        for i in range(1, cells.shape[1]):
+            html = html + '</td>\n      <td>' + cells[:, i]
+        html = html + '</td>\n    </tr>\n'
+        yield ''.join(html)
+
+
+def _html_float_format(s) -> str:
+    """Format of a float column in ``to_html()``, as pandas chooses it.
+
+    Values get ``display.precision`` decimals, scientific notation if
+    some are too small or too large, and trailing zeros are trimmed
+    equally from all of them, leaving at least one.
+    """
+
+    digits = pd.get_option('display.precision')
+    values = s.to_numpy(dtype=float, na_value=np.nan)
+    values = values[~np.isnan(values)]
+    finite = values[np.isfinite(values)]
+    magnitude = np.abs(finite)
+    small = ((magnitude > 0) & (magnitude < 10**-digits)).any()
+    large = (np.abs(values) > 1e6).any()
+    # widest value printed with `digits` decimals, as pandas measures it
+    width = np.floor(np.log10(np.maximum(magnitude, 1))) + 2 + digits \
+        + (finite < 0)
+    if small or (large and (width > digits + 6).any()):
+        return f'{{:.{digits}e}}'
+
+    scaled = np.round(magnitude * 10**digits)
+    decimals = 1
+    for k in range(digits, 1, -1):
+        if (scaled % 10**(digits - k + 1)).any():
+            decimals = k
+            break
+    return f'{{:.{decimals}f}}'
+
+
+def _write_shards(df, folder, sort_col, shard_rows=SHARD_ROWS) -> None:
+    """Writes a DataFrame as JSON shards plus ``manifest.json``.
+
+    Rows are written in the default sort order, so that default pages are
+    slices of consecutive shards.  Each shard holds its rows (``data``)
+    and their sort order by every column (``order``); the manifest holds
+    per-shard min/max of every column, which lets the page merge shards
+    for other sort orders without fetching all of them.
+    """
 
+    os.makedirs(folder, exist_ok=True)
+    m = re.match(r'\s*(\d+)\s*,\s*[\'"]?(asc|desc)', sort_col)
+    col, direction = (int(m.group(1)), m.group(2)) if m else (0, 'asc')
 
-def _make_j2html_basic(j2, file):
-    """Generates HTML page from a basic.j2 template."""
+    # positional column names; datetimes as ISO strings sort like in JS
+    data = df.reset_index(drop=True)
+    data.columns = range(data.shape[1])
+    for c in data.columns:
+        if pd.api.types.is_datetime64_any_dtype(data[c]):
+            data[c] = data[c].dt.strftime('%Y-%m-%dT%H:%M:%S').astype(object) \
+                .where(data[c].notna(), None)
+    if len(data):
+        data = data.iloc[_sort_positions(data[col], direction == 'asc')] \
+            .reset_index(drop=True)
+
+    shards = []
+    for i, start in enumerate(range(0, len(data), shard_rows)):
+        shard = data.iloc[start:start + shard_rows].reset_index(drop=True)
+        name = f'part-{i:05d}.json'
+        order = [_sort_positions(shard[c]).tolist() for c in shard.columns]
+        _atomic_write(os.path.join(folder, name),
+                      '{"data":' + shard.to_json(orient='values')
+                      + ',"order":' + json.dumps(order) + '}', mode=0o666)
+        bounds = [_shard_bounds(shard[c]) for c in shard.columns]
+        shards.append({
+            'file': name,
+            'rows': len(shard),
+            'min': [b[0] for b in bounds],
+            'max': [b[1] for b in bounds],
+        })
+
+    manifest = {
+        'columns': [str(c) for c in df.columns],
+        'rows': len(data),
+        'shard_rows': shard_rows,
+        'default_order': [col, direction],
+        'shards': shards,
+    }
+    # last, so that a page never reads a manifest of missing shards
+    _atomic_write(os.path.join(folder, 'manifest.json'), json.dumps(manifest),
+                  mode=0o666)
+    _l.info(f'{me()} wrote {len(data)} rows as {len(shards)} shards to {folder}')
+
+
+def _sort_positions(s, ascending=True):
+    """Stable sort order of a series with nulls first (last if descending)."""
+    na_position = 'first' if ascending else 'last'
+    try:
+        s = s.sort_values(
+            ascending=ascending, na_position=na_position, kind='stable')
+    except TypeError:  # mixed types sort as strings
+        s = s.astype(str).where(s.notna()).sort_values(
+            ascending=ascending, na_position=na_position, kind='stable')
+    return s.index.to_numpy()
+
+
+def _shard_bounds(s) -> tuple:
+    """Min/max of a shard column, in the page's sort order.
+
+    Nulls sort first, so a column with nulls has no lower bound (null).
+    """
+    values = s.dropna()
+    if not len(values):
+        return None, None
+    try:
+        lo, hi = values.min(), values.max()
+    except TypeError:  # mixed types sort as strings
+        lo, hi = values.astype(str).min(), values.astype(str).max()
+    return (None if len(values) < len(s) else _json_scalar(lo)), _json_scalar(hi)
+
+
+def _json_scalar(x):
+    """JSON-serializable version of a numpy/pandas scalar."""
+    if x is None or (not isinstance(x, str) and pd.isna(x)):
+        return None
+    return x.item() if hasattr(x, 'item') else x
+
+
+@lru_cache()
+def _j2_env():
+    """Jinja2 environment shared by all pages; compiled templates are cached.
+
+    Templates ship with the package, so they are not checked for changes.
+    """
+    from jinja2 import PackageLoader, Environment
     # t_loader = FileSystemLoader(searchpath=J2_FOLDER)
     t_loader = PackageLoader(__name__.split('.')[0], package_path='j2')
-    t_env = Environment(loader=t_loader)
-    t = t_env.get_template(j2['j2template'])
+    return Environment(loader=t_loader, auto_reload=False)
+
+
+def _make_j2html_basic(j2, file, rows=None):
+    """Generates HTML page from a basic.j2 template.
+
+    If ``rows`` (an iterable of HTML strings) is given, the page is
+    streamed to the file and the rows are written in place of
+    ``HTML_ROWS_MARK``.  The page is written to a temporary file that
+    replaces ``file`` when complete, so readers never see half a page.
+
+    :Returns:
+        bytes written, or None on failure
+    """
+    t = _j2_env().get_template(j2['j2template'])
+    path = j2['wwwfolder'] + file
+    tmp = None
     try:
-        outputText = t.render(j2)
-        with open(j2['wwwfolder']+file, 'w') as f:
-            f.write(outputText)
-        os.chmod(j2['wwwfolder']+file, 0o666)
+        fd, tmp = tempfile.mkstemp(
+            dir=os.path.dirname(path) or '.', prefix='.lucid-', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            if rows is None:
+                f.write(t.render(j2))
+            else:
+                for piece in t.generate(j2):
+                    if HTML_ROWS_MARK in piece:
+                        before, after = piece.split(HTML_ROWS_MARK)
+                        f.write(before)
+                        f.writelines(rows)
+                        piece = after
+                    f.write(piece)
+        size = os.path.getsize(tmp)
+        os.chmod(tmp, 0o666)
+        os.replace(tmp, path)
         _l.info('%s published page %s' % (me(), file))
+        if j2.get('compress'):
+            compress_file(path, j2['compress'])
 
         if j2['showurl']:
             _jupyter_message(j2, file)
+        return size
     except Exception as e:
         _l.error(f'{me()} {e}')
+        if tmp and os.path.exists(tmp):
+            os.remove(tmp)
     return
 
 
@@ -222,43 +845,388 @@ def _jupyter_message(j2, file):
     except ImportError:
         _l.critical('you need IPython/Jupyter for this')
     full_path = j2['wwwfolder'] + file
-    size = os.path.getsize(full_path)
+    size = f'{os.path.getsize(full_path)} B'
+    compressed = [
+        f'{fmt}: {os.path.getsize(full_path + "." + fmt)} B'
+        for fmt in _compress_formats(j2.get('compress'))
+        if os.path.exists(full_path + '.' + fmt)
+    ]
+    if compressed:
+        size += f' ({", ".join(compressed)})'
 
     display(HTML(
-        f"""Saved as <a href="http://{WEBSERVER}{file}", target=_blank>
-            {full_path}</a> \t size: {size} B"""))
+        f"""Saved as <a href="http://{_webserver()}{file}", target=_blank>
+            {full_path}</a> \t size: {size}"""))
     return
 
 
+def compress_file(path, formats=('gz',), n_threads=None,
+                  block_bytes=COMPRESS_BLOCK) -> dict:
+    """Writes precompressed ``.gz`` (and ``.br``) siblings of a file.
+
+    Static servers can send these as-is to clients that accept gzip or
+    brotli, at no CPU cost per request.  Gzip is compressed in blocks on
+    ``n_threads`` threads like ``pigz`` and streamed to disk, so memory
+    stays at a few blocks per thread.  Brotli needs the optional
+    ``brotli`` package and runs on one thread.
+
+    :Args:
+        :path: file to compress
+        :formats: ``'gz'``, ``'br'``, or a list of both
+        :n_threads: gzip threads (defaults to CPU count)
+        :block_bytes: uncompressed bytes per gzip block
+
+    :Returns:
+        dict of ``{format: compressed size}``
+    """
+
+    sizes = {}
+    for fmt in _compress_formats(formats):
+        if fmt == 'gz':
+            writer = partial(_gzip_blocks, n_threads=n_threads,
+                             block_bytes=block_bytes)
+        elif fmt == 'br':
+            writer = _brotli_stream
+        else:
+            _l.error(f'{me()} unknown format {fmt}')
+            continue
+        tmp = None
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                       prefix='.lucid-', suffix='.tmp')
+            with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+                writer(src, dst, mtime=int(os.path.getmtime(path)))
+            os.chmod(tmp, 0o666)
+            os.replace(tmp, f'{path}.{fmt}')
+            sizes[fmt] = os.path.getsize(f'{path}.{fmt}')
+        except Exception as e:
+            _l.error(f'{me()} {path}.{fmt}: {e}')
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+    return sizes
+
+
+def _compress_formats(compress) -> list:
+    """Normalizes the ``compress`` option to a list of formats."""
+    if not compress:
+        return []
+    if compress is True:
+        return ['gz']
+    if isinstance(compress, str):
+        return [compress]
+    return list(compress)
+
+
+def _gzip_blocks(src, dst, mtime=0, n_threads=None,
+                 block_bytes=COMPRESS_BLOCK) -> None:
+    """Gzips ``src`` into ``dst`` with blocks deflated on a thread pool.
+
+    Each block is raw deflate primed with the last 32 KB of the previous
+    block and ends on a byte boundary (``Z_SYNC_FLUSH``), so the blocks
+    concatenate into a single deflate stream; the last one ends it.
+    """
+
+    def deflate(block, zdict, last):
+        z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS,
+                             **({'zdict': zdict} if zdict else {}))
+        return z.compress(block) + z.flush(
+            zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    n_threads = n_threads or os.cpu_count()
+    dst.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', mtime) + b'\x00\xff')
+    crc, size, pending = 0, 0, []
+    block, zdict = src.read(block_bytes), b''
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        while True:
+            following = src.read(block_bytes)
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            pending.append(pool.submit(deflate, block, zdict, not following))
+            if len(pending) > 2 * n_threads:
+                dst.write(pending.pop(0).result())
+            if not following:
+                break
+            block, zdict = following, block[-2**15:]
+        for future in pending:
+            dst.write(future.result())
+    dst.write(struct.pack('<II', crc, size & 0xffffffff))
+
+
+def _brotli_stream(src, dst, mtime=0) -> None:
+    """Brotli-compresses ``src`` into ``dst`` chunk by chunk."""
+    import brotli
+    z = brotli.Compressor(quality=BROTLI_QUALITY)
+    for chunk in iter(partial(src.read, COMPRESS_BLOCK), b''):
+        dst.write(z.process(chunk))
+    dst.write(z.finish())
+
+
+#-----------------------------------------------------------------------------
+# Local Query Server
+#-----------------------------------------------------------------------------
+
+TABLES = {}  # tables served by the local query server, by name
+_SERVER = None  # running query server, see serve()
+
+
+class FrameTable:
+    """In-memory DataFrame answering DataTables server-side requests.
+
+    Sort order by every column is built once at registration, so paging
+    through a sorted table is a slice of a prebuilt index.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df.reset_index(drop=True)
+        self.columns = [str(c) for c in self.df.columns]
+        self.order = [
+            _sort_positions(self.df.iloc[:, i])
+            for i in range(self.df.shape[1])
+        ]
+        self._text = None
+
+    def __len__(self):
+        return len(self.df)
+
+    def text(self) -> pd.DataFrame:
+        """Lowercase string version of the table, built on first search."""
+        if self._text is None:
+            self._text = self.df.astype(str).where(self.df.notna(), '') \
+                .apply(lambda s: s.str.lower())
+        return self._text
+
+    def query(self, dt: dict) -> tuple:
+        """Returns (filtered row count, page as DataFrame)."""
+        col, ascending = dt['order']
+        pos = self.order[col] if ascending else self.order[col][::-1]
+        mask = None
+        if dt['search']:
+            text = self.text()
+            mask = reduce(lambda a, b: a | b, (
+                text[c].str.contains(dt['search'], regex=False)
+                for c in text.columns
+            ))
+        for i, value in dt['columns'].items():
+            found = self.text().iloc[:, i].str.contains(value, regex=False)
+            mask = found if mask is None else mask & found
+        if mask is not None:
+            pos = pos[mask.to_numpy()[pos]]
+        page = self.df.iloc[pos[dt['start']:dt['start'] + dt['length']]]
+        return len(pos), page
+
+
+class ParquetTable:
+    """Parquet file answering DataTables server-side requests with DuckDB.
+
+    Nothing is loaded in memory: every request is a ``LIMIT/OFFSET`` query.
+    """
+
+    def __init__(self, file: str):
+        import duckdb
+        self.con = duckdb.connect()
+        self.source = "read_parquet('%s')" % file.replace("'", "''")
+        self.columns = list(
+            self.con.execute(f'SELECT * FROM {self.source} LIMIT 0')
+            .df().columns
+        )
+        self.rows = self.con.execute(
+            f'SELECT COUNT(*) FROM {self.source}').fetchone()[0]
+
+    def __len__(self):
+        return self.rows
+
+    def query(self, dt: dict) -> tuple:
+        """Returns (filtered row count, page as DataFrame)."""
+        con = self.con.cursor()  # one connection per request thread
+        quoted = ['"%s"' % c.replace('"', '""') for c in self.columns]
+        where, params = ['1=1'], []
+        if dt['search']:
+            where.append('(' + ' OR '.join(
+                f'CAST({q} AS VARCHAR) ILIKE ?' for q in quoted) + ')')
+            params += ['%' + dt['search'] + '%'] * len(quoted)
+        for i, value in dt['columns'].items():
+            where.append(f'CAST({quoted[i]} AS VARCHAR) ILIKE ?')
+            params.append('%' + value + '%')
+        where = ' AND '.join(where)
+        col, ascending = dt['order']
+        direction = 'ASC NULLS FIRST' if ascending else 'DESC NULLS LAST'
+
+        filtered = con.execute(
+            f'SELECT COUNT(*) FROM {self.source} WHERE {where}', params
+        ).fetchone()[0]
+        page = con.execute(f'''
+            SELECT * FROM {self.source} WHERE {where}
+            ORDER BY {quoted[col]} {direction}
+            LIMIT {dt['length']} OFFSET {dt['start']}
+            ''', params).df()
+        return filtered, page
+
+
+def register_table(data, name: str, **kwargs):
+    """Serves a table at ``/dt/<name>`` of the local query server.
+
+    :Args:
+        :data: DataFrame (kept in memory) or path to a Parquet file
+            (queried with DuckDB)
+        :name: table name, used in the URL
+
+    :Kwargs:
+        passed to ``serve()``
+
+    :Returns:
+        the registered table
+    """
+
+    if isinstance(data, pd.DataFrame):
+        table = FrameTable(data)
+    else:
+        table = ParquetTable(data)
+    TABLES[name] = table
+    serve(**kwargs)
+    _l.info(f'{me()} serving {len(table)} rows at /dt/{name}')
+    return table
+
+
+def serve(port: int = None, wwwfolder: str = None, host: str = None):
+    """Starts the local query server, unless it is already running.
+
+    The server runs in a background thread.  It serves static files from
+    ``wwwfolder`` (defaults to ``WWWFOLDER``) on ``port`` (defaults to
+    ``WEBPORT``), and registered tables at ``/dt/<name>``, following the
+    DataTables server-side processing protocol.  It listens on ``host``
+    (defaults to ``WEBHOST``, this machine only); pass ``host=''`` to
+    serve other machines too.
+
+    :Returns:
+        ThreadingHTTPServer, or None if the port is taken
+    """
+
+    global _SERVER
+    if _SERVER is not None:
+        return _SERVER
+    port = port or WEBPORT
+    host = WEBHOST if host is None else host
+    wwwfolder = wwwfolder or WWWFOLDER
+    os.makedirs(wwwfolder, exist_ok=True)
+    handler = partial(_QueryHandler, directory=wwwfolder)
+    try:
+        _SERVER = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        _l.error(f'{me()} cannot listen on {host or "*"}:{port} ({e}); '
+                 'is another server running? pass a free port=')
+        return None
+    Thread(target=_SERVER.serve_forever, daemon=True).start()
+    _l.info(f'{me()} serving {wwwfolder} on {host or "*"}:{port}')
+    return _SERVER
+
+
+def shutdown() -> None:
+    """Stops the local query server."""
+
+    global _SERVER
+    if _SERVER is not None:
+        _SERVER.shutdown()
+        _SERVER.server_close()
+        _SERVER = None
+    return
+
+
+def _dt_request(params: dict, n_cols: int) -> dict:
+    """Parses DataTables server-side parameters (``order[0][column]`` etc.)."""
+
+    def get(key, default=''):
+        return params.get(key, [default])[0]
+
+    col = int(get('order[0][column]', 0))
+    columns = {}
+    for i in range(n_cols):
+        value = get(f'columns[{i}][search][value]').lower()
+        if value:
+            columns[i] = value
+    return {
+        'draw': int(get('draw', 0)),
+        'start': max(int(get('start', 0)), 0),
+        'length': int(get('length', 10)),
+        'order': (min(col, n_cols - 1), get('order[0][dir]', 'asc') != 'desc'),
+        'search': get('search[value]').lower(),
+        'columns': columns,
+    }
+
+
+def _dt_response(table, params: dict) -> bytes:
+    """Answers one DataTables server-side request as JSON bytes."""
+
+    dt = _dt_request(params, len(table.columns))
+    if dt['length'] < 0:  # "All"
+        dt['length'] = len(table)
+    filtered, page = table.query(dt)
+    data = page.to_json(orient='values', date_format='iso')
+    return (
+        '{"draw":%d,"recordsTotal":%d,"recordsFiltered":%d,"data":%s}'
+        % (dt['draw'], len(table), filtered, data)
+    ).encode()
+
+
+class _QueryHandler(SimpleHTTPRequestHandler):
+    """Serves static files, and registered tables at ``/dt/<name>``."""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if not url.path.startswith('/dt/'):
+            return super().do_GET()
+        table = TABLES.get(url.path[4:].strip('/'))
+        if table is None:
+            return self.send_error(404, 'no such table')
+        try:
+            body = _dt_response(table, parse_qs(url.query))
+        except Exception as e:
+            _l.error(f'{me()} {e}')
+            return self.send_error(400, str(e))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _l.debug(format % args)
+
+
 #-----------------------------------------------------------------------------
 # Reading/Writing Files from Cloud Storage
 #-----------------------------------------------------------------------------
 
-def save(stream: Response, outfile: str) -> None:
-    """Saves to disk."""
+def save(stream: 'Response', outfile: str, chunk_size=DOWNLOAD_CHUNK) -> None:
+    """Saves to disk, chunk by chunk."""
 
     check_stream(stream)
 
+    t0 = time.perf_counter()
     with open(outfile, 'wb') as f:
-        f.write(stream.content)
-    _l.info(f'saved {len(stream.content)} bytes to {outfile}')
+        for chunk in stream.iter_content(chunk_size=chunk_size):
+            f.write(chunk)
+        size = f.tell()
+    _l.info(f'saved {size} bytes to {outfile} ({_throughput(size, t0)})')
     return None
 
 
-def gunzip_save(stream: Response, outfile: str) -> None:
+def gunzip_save(stream: 'Response', outfile: str,
+                chunk_size=DOWNLOAD_CHUNK) -> None:
     """Unzips and saves to disk."""
 
+    from requests.exceptions import StreamConsumedError
     check_stream(stream)
     check_stream_is_gzip(stream)
 
-    dec = zlib.decompressobj(32 + zlib.MAX_WBITS)  # skipping gzip header
+    t0 = time.perf_counter()
     f = open(outfile, 'wb')
 
     try:
-        for chunk in stream.iter_content(chunk_size=2**18):
-            s = dec.decompress(chunk)
+        chunks = stream.iter_content(chunk_size=chunk_size)
+        for s in _decompress_chunks(chunks, 'gzip'):
             f.write(s)
-        _l.info(f'saved {f.tell()} bytes to {outfile}')
+        _l.info(f'saved {f.tell()} bytes to {outfile} '
+                f'({_throughput(f.tell(), t0)})')
     except StreamConsumedError:
         _l.error('stream consumed, please request again')
     except Exception as e:
@@ -267,11 +1235,520 @@ def gunzip_save(stream: Response, outfile: str) -> None:
     return None
 
 
+def download(url, outfile, decompress=None, resume=True, n_parts=1,
+             checksum=None, chunk_size=DOWNLOAD_CHUNK, session=None,
+             **kwargs) -> dict:
+    """Downloads a URL to disk in fixed-size chunks.
+
+    Data goes to ``<outfile>.part``, which is renamed when complete.  An
+    interrupted download resumes from the size of the ``.part`` file with
+    a ``Range`` request.  With ``n_parts``, byte ranges are fetched
+    concurrently and written in place, if the server accepts ranges.
+    Bytes are saved as sent, so that they line up with byte ranges:
+    ``Accept-Encoding: identity`` is requested, and a ``Content-Encoding``
+    the server applies anyway is not decoded (see ``decompress``).
+
+    :Args:
+        :url: URL
+        :outfile: output file
+        :decompress: ``'gzip'``, ``'zstd'`` or ``'auto'`` (by magic bytes);
+            single-stream downloads are decompressed on the fly, and
+            restart instead of resuming
+        :resume: resume from an existing ``.part`` file
+        :n_parts: number of concurrent ranged requests
+        :checksum: ``'<algorithm>:<hex digest>'`` of the downloaded
+            bytes, *e.g.* ``'sha256:9f86d0...'``
+        :chunk_size: bytes per chunk
+        :session: ``requests.Session`` (a new one by default)
+        :kwargs: keyword arguments for ``session.get()``
+
+    :Returns:
+        dict with bytes received and written, seconds and MB/s;
+        None if the download fails its checksum
+    """
+
+    import requests
+    session = session or requests.Session()
+    headers = {'Accept-Encoding': 'identity', **kwargs.pop('headers', {})}
+    part = outfile + '.part'
+    algo, expected = checksum.split(':', 1) if checksum else (None, None)
+    h = hashlib.new(algo) if algo else None
+    stats = {'bytes': 0}
+    offset, size = 0, None
+    t0 = time.perf_counter()
+
+    if n_parts > 1:
+        head = session.head(url, headers=headers, allow_redirects=True,
+                            **kwargs)
+        if (head.headers.get('Accept-Ranges') == 'bytes'
+                and 'Content-Length' in head.headers):
+            size = int(head.headers['Content-Length'])
+        else:
+            _l.warning(f'{me()} no ranges from server, using one stream')
+            n_parts = 1
+
+    if size is not None:
+        stats['bytes'] = _download_parts(
+            session, url, part, size, n_parts, chunk_size, headers, kwargs)
+        if h:
+            _hash_file(part, h)
+        codec = _sniff_file(part) if decompress == 'auto' else decompress
+        if codec:
+            with open(part, 'rb') as src, open(part + '.raw', 'wb') as dst:
+                chunks = iter(partial(src.read, chunk_size), b'')
+                for out in _decompress_chunks(chunks, codec):
+                    dst.write(out)
+            os.replace(part + '.raw', part)
+
+    else:
+        if resume and not decompress and os.path.exists(part):
+            offset = os.path.getsize(part)
+        if offset:
+            headers = {**headers, 'Range': f'bytes={offset}-'}
+        with session.get(url, stream=True, headers=headers, **kwargs) as r:
+            if offset and r.status_code == 416:  # nothing left to fetch
+                chunks = iter(())
+            else:
+                r.raise_for_status()
+                if offset and r.status_code != 206:
+                    _l.warning(f'{me()} server ignored Range, restarting')
+                    offset = 0
+                chunks = r.raw.stream(chunk_size, decode_content=False)
+            if h and offset:
+                _hash_file(part, h)
+            chunks = _tap(chunks, stats, h)
+            if decompress == 'auto':
+                chunks, codec = _sniff_chunks(chunks)
+            else:
+                codec = decompress
+            with open(part, 'ab' if offset else 'wb') as f:
+                for out in _decompress_chunks(chunks, codec):
+                    f.write(out)
+
+    if h and h.hexdigest() != expected.lower():
+        _l.error(f'{me()} {url}: {algo} {h.hexdigest()} != {expected}')
+        os.remove(part)
+        return None
+    os.replace(part, outfile)
+    seconds = time.perf_counter() - t0
+    report = {
+        'file': outfile,
+        'bytes': stats['bytes'],
+        'written': os.path.getsize(outfile),
+        'resumed_from': offset,
+        'parts': n_parts,
+        'seconds': seconds,
+        'MB/s': stats['bytes'] / seconds / 1e6 if seconds else None,
+    }
+    _l.info(f'{me()} saved {report["written"]} bytes to {outfile} '
+            f'({_throughput(stats["bytes"], t0)})')
+    return report
+
+
+def _download_parts(session, url, path, size, n_parts, chunk_size,
+                    headers, kwargs) -> int:
+    """Fetches byte ranges of ``url`` concurrently into ``path``."""
+
+    bounds = np.linspace(0, size, n_parts + 1).astype(int).tolist()
+    ranges = [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    os.ftruncate(fd, size)
+
+    def fetch(start, end):
+        pos = start
+        rng = {**headers, 'Range': f'bytes={start}-{end - 1}'}
+        with session.get(url, stream=True, headers=rng, **kwargs) as r:
+            r.raise_for_status()
+            if r.status_code != 206:
+                raise IOError(f'server ignored Range {start}-{end - 1}')
+            for chunk in r.raw.stream(chunk_size, decode_content=False):
+                os.pwrite(fd, chunk, pos)
+                pos += len(chunk)
+        if pos != end:
+            raise IOError(f'got bytes {start}-{pos - 1} of {start}-{end - 1}')
+        return pos - start
+
+    try:
+        with ThreadPoolExecutor(max_workers=n_parts) as pool:
+            return sum(pool.map(lambda r: fetch(*r), ranges))
+    finally:
+        os.close(fd)
+
+
+def _decompress_chunks(chunks, codec=None):
+    """Decompresses byte chunks (``'gzip'``, ``'zstd'``, ``'bz2'``, ``'xz'``).
+
+    Concatenated gzip members or zstd frames (bgzip, pigz, ``zstd -T``)
+    and bz2/xz streams are decompressed one after another.  Chunks pass
+    through if no codec.
+    """
+
+    if not codec:
+        yield from chunks
+        return
+    if codec == 'gzip':
+        new = partial(zlib.decompressobj, 32 + zlib.MAX_WBITS)
+    elif codec == 'zstd':
+        import zstandard
+        new = zstandard.ZstdDecompressor().decompressobj
+    elif codec == 'bz2':
+        import bz2
+        new = bz2.BZ2Decompressor
+    elif codec == 'xz':
+        import lzma
+        new = lzma.LZMADecompressor
+    else:
+        raise ValueError(f'unknown codec {codec}')
+
+    dec = new()
+    for chunk in chunks:
+        while chunk:
+            out = dec.decompress(chunk)
+            if out:
+                yield out
+            if not dec.eof:
+                break
+            chunk, dec = dec.unused_data, new()
+    tail = dec.flush() if hasattr(dec, 'flush') else b''
+    if tail:
+        yield tail
+
+
+def _sniff_codec(head: bytes):
+    """Compression of data starting with ``head``, from its magic bytes."""
+    if head[:2] == b'\x1f\x8b':
+        return 'gzip'
+    if head[:4] == b'\x28\xb5\x2f\xfd':
+        return 'zstd'
+    if head[:3] == b'BZh':
+        return 'bz2'
+    if head[:6] == b'\xfd7zXZ\x00':
+        return 'xz'
+    return None
+
+
+def _sniff_chunks(chunks) -> tuple:
+    """Returns (chunks, codec), codec read from the first chunk."""
+    chunks = iter(chunks)
+    first = next(chunks, b'')
+    return chain([first], chunks), _sniff_codec(first)
+
+
+def _sniff_file(path):
+    """Compression of a file, from its magic bytes."""
+    with open(path, 'rb') as f:
+        return _sniff_codec(f.read(6))
+
+
+def _tap(chunks, stats, h=None):
+    """Passes chunks through, counting bytes and updating hash ``h``."""
+    for chunk in chunks:
+        stats['bytes'] += len(chunk)
+        if h:
+            h.update(chunk)
+        yield chunk
+
+
+def _hash_file(path, h, chunk_size=DOWNLOAD_CHUNK):
+    """Updates hash ``h`` with the contents of a file; returns ``h``."""
+    with open(path, 'rb') as f:
+        for chunk in iter(partial(f.read, chunk_size), b''):
+            h.update(chunk)
+    return h
+
+
+def _throughput(n_bytes, t0) -> str:
+    seconds = time.perf_counter() - t0
+    return f'{n_bytes / max(seconds, 1e-9) / 1e6:.1f} MB/s in {seconds:.1f}s'
+
+
+class ByteStream(RawIOBase):
+    """Read-only file-like object over a stream of (compressed) bytes.
+
+    Chunks are fetched and decompressed on a background thread into a
+    queue of up to ``prefetch`` chunks, so download and decompression
+    overlap with the reader (*e.g.* a CSV parser).
+
+    :Args:
+        :source: ``requests`` Response (opened with ``stream=True``) or
+            any iterable of bytes
+        :decompress: ``'gzip'``, ``'zstd'``, ``'bz2'``, ``'xz'``,
+            ``'auto'`` (by magic bytes) or None
+        :chunk_size: bytes per chunk read from a Response
+        :prefetch: chunks buffered ahead of the reader
+    """
+
+    def __init__(self, source, decompress='auto', chunk_size=DOWNLOAD_CHUNK,
+                 prefetch=STREAM_PREFETCH):
+        super().__init__()
+        self._response = None
+        if hasattr(source, 'iter_content'):
+            self._response = source
+            source = source.iter_content(chunk_size=chunk_size)
+        if decompress == 'auto':
+            source, decompress = _sniff_chunks(source)
+        self._queue = Queue(maxsize=prefetch)
+        self._chunk, self._pos = b'', 0
+        self._done, self._stop, self._error = False, False, None
+        Thread(
+            target=self._fill,
+            args=(_decompress_chunks(source, decompress),),
+            daemon=True,
+        ).start()
+
+    def _fill(self, chunks):
+        try:
+            for chunk in chunks:
+                if self._stop:
+                    return
+                self._queue.put(chunk)
+        except Exception as e:
+            self._error = e
+        if not self._stop:
+            self._queue.put(None)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while self._pos >= len(self._chunk):
+            if self._done:
+                return 0
+            chunk = self._queue.get()
+            if chunk is None:
+                self._done = True
+                if self._error:
+                    raise self._error
+                return 0
+            self._chunk, self._pos = memoryview(chunk), 0
+        n = min(len(b), len(self._chunk) - self._pos)
+        b[:n] = self._chunk[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def close(self):
+        self._stop = True
+        while not self._queue.empty():  # unblock the background thread
+            self._queue.get_nowait()
+        if self._response is not None:  # release the connection
+            self._response.close()
+        super().close()
+
+
+def read_stream(source, fmt='csv', chunksize=STREAM_ROWS, decompress='auto',
+                **kwargs):
+    """Yields DataFrame batches from a stream of (compressed) bytes.
+
+    Nothing is written to disk: download, decompression and parsing
+    overlap (see ``ByteStream``).  Parquet keeps its footer at the end,
+    and a JSON document has no row boundaries, so these are buffered in
+    memory before batches are read.
+
+    :Args:
+        :source: ``requests`` Response (opened with ``stream=True``) or
+            any iterable of bytes
+        :fmt: ``'csv'``, ``'jsonl'``, ``'json'`` or ``'parquet'``
+        :chunksize: rows per batch
+        :decompress: ``'gzip'``, ``'zstd'``, ``'bz2'``, ``'xz'``,
+            ``'auto'`` or None
+        :kwargs: keyword arguments for ``pd.read_csv()``,
+            ``pd.read_json()`` or ``ParquetFile.iter_batches()``
+
+    :Usage:
+        ::
+
+            r = requests.get(url, stream=True)
+            for df in read_stream(r, sep='\\t'):
+                ...
+    """
+
+    stream = BufferedReader(ByteStream(source, decompress), DOWNLOAD_CHUNK)
+    try:
+        if fmt == 'csv':
+            with pd.read_csv(stream, chunksize=chunksize, **kwargs) as reader:
+                yield from reader
+        elif fmt == 'jsonl':
+            with pd.read_json(stream, lines=True, chunksize=chunksize,
+                              **kwargs) as reader:
+                yield from reader
+        elif fmt == 'parquet':
+            import pyarrow.parquet as pq
+            pf = pq.ParquetFile(BytesIO(stream.read()))
+            for batch in pf.iter_batches(batch_size=chunksize, **kwargs):
+                yield batch.to_pandas()
+        elif fmt == 'json':
+            df = pd.read_json(stream, **kwargs)
+            for start in range(0, len(df), chunksize):
+                yield df.iloc[start:start + chunksize]
+        else:
+            raise ValueError(f'unknown format {fmt}')
+    finally:
+        stream.close()
+
+
+#-----------------------------------------------------------------------------
+# Local Object Cache
+#-----------------------------------------------------------------------------
+
+class ObjectCache:
+    """Content-addressed local disk cache of remote objects.
+
+    Entries are keyed by source and version, *e.g.*
+    ``('s3://bucket/key', etag)`` or ``('gdrive:<id>', md5)``, so a
+    changed object never hits a stale entry.  The last version seen of
+    each source is kept as a ref, for conditional requests.
+
+    Entries are written atomically; the least recently used ones are
+    evicted once the cache holds more than ``max_bytes``, down to
+    ``CACHE_EVICT_TO`` of it.  The cache folder is scanned only then: in
+    between, a running total of the bytes it holds is kept.  Eviction
+    and refs are guarded by a lock file, so processes can share a cache
+    (each one counts its own writes, and rescans at its limit).
+
+    :Usage:
+        ::
+
+            cache = ObjectCache()
+            path = cache.get('s3://bucket/key', etag) \\
+                or cache.put(('s3://bucket/key', etag), chunks)
+            data = cache.read('s3://bucket/key', etag)  # memory map
+    """
+
+    def __init__(self, folder=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._bytes = None  # running total, counted by the first evict()
+        os.makedirs(os.path.join(folder, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(folder, 'refs'), exist_ok=True)
+
+    def path(self, *key) -> str:
+        """Where the entry of ``key`` is (or would be) stored."""
+        h = _key_hash(*key)
+        return os.path.join(self.folder, 'objects', h[:2], h)
+
+    def get(self, *key):
+        """Path of a cached entry (marked as used), or None."""
+        path = self.path(*key)
+        try:
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, chunks) -> str:
+        """Stores an iterable of bytes as the entry of ``key``."""
+        path = self.path(*key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix='.lucid-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                size = f.tell()
+            try:
+                size -= os.path.getsize(path)  # replaces an entry
+            except FileNotFoundError:
+                pass
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        if self._bytes is None or self._bytes + size > self.max_bytes:
+            self.evict(keep=path)
+        else:
+            self._bytes += size
+        return path
+
+    def read(self, *key):
+        """Contents of a cached entry as a read-only memory map, or None."""
+        path = self.get(*key)
+        if path is None:
+            return None
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def ref(self, source):
+        """Last version stored for ``source``, or None."""
+        try:
+            with open(self._ref_path(source)) as f:
+                return f.read() or None
+        except FileNotFoundError:
+            return None
+
+    def set_ref(self, source, version) -> None:
+        """Records the last version stored for ``source``."""
+        with self._lock():
+            _atomic_write(self._ref_path(source), str(version))
+
+    def evict(self, keep=None) -> int:
+        """Removes least recently used entries if over ``max_bytes``.
+
+        Entries are removed down to ``CACHE_EVICT_TO`` of ``max_bytes``,
+        and the running total is recounted.
+
+        :Returns:
+            bytes removed
+        """
+        with self._lock():
+            entries = []
+            for sub in os.scandir(os.path.join(self.folder, 'objects')):
+                for e in os.scandir(sub.path):
+                    if not e.name.startswith('.'):
+                        st = e.stat()
+                        entries.append((st.st_mtime, st.st_size, e.path))
+            total = sum(e[1] for e in entries)
+            excess = total - self.max_bytes * CACHE_EVICT_TO \
+                if total > self.max_bytes else 0
+            removed = 0
+            for _, size, path in sorted(entries):
+                if removed >= excess:
+                    break
+                if path != keep:
+                    try:
+                        os.remove(path)
+                        removed += size
+                    except FileNotFoundError:
+                        pass
+            self._bytes = total - removed
+        if removed:
+            _l.debug(f'{me()} evicted {removed} bytes from {self.folder}')
+        return removed
+
+    def _ref_path(self, source) -> str:
+        return os.path.join(self.folder, 'refs', _key_hash(source))
+
+    @contextmanager
+    def _lock(self):
+        """Exclusive lock shared by processes (where ``fcntl`` exists)."""
+        with open(os.path.join(self.folder, '.lock'), 'a') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@lru_cache()
+def object_cache() -> ObjectCache:
+    """Shared ObjectCache in ``CACHE_DIR``, created on first use."""
+    return ObjectCache()
+
+
+def _key_hash(*key) -> str:
+    return hashlib.blake2b(
+        '\0'.join(str(k) for k in key).encode(), digest_size=20).hexdigest()
+
+
 #-----------------------------------------------------------------------------
 # Utility Functions
 #-----------------------------------------------------------------------------
 
-def check_stream(stream: Response) -> None:
+def check_stream(stream: 'Response') -> None:
     try:
         assert stream.status_code == 200
     except AssertionError:
@@ -279,9 +1756,27 @@ def check_stream(stream: Response) -> None:
     return None
 
 
-def check_stream_is_gzip(stream: Response) -> None:
+def check_stream_is_gzip(stream: 'Response') -> None:
     try:
         assert stream.headers['Content-Type'] == 'application/x-gzip'
     except AssertionError:
         _l.error('not a gzip')
     return None
+
+
+def _atomic_write(path: str, data, mode: int = None) -> None:
+    """Writes ``data`` (str or bytes) to a temporary file moved to ``path``.
+
+    ``mode`` sets the file's permissions before it is moved.
+    """
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.', prefix='.lucid-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
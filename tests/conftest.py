@@ -0,0 +1,37 @@
+"""Shared fixtures; loads the repository as the ``lucid`` package."""
+
+import importlib.util
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+def load_lucid():
+    """Imports the repository root as ``lucid`` (it is not installed)."""
+
+    spec = importlib.util.spec_from_file_location(
+        'lucid', ROOT / '__init__.py', submodule_search_locations=[str(ROOT)])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['lucid'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+if 'lucid' not in sys.modules:
+    load_lucid()
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """An ``aws.S3`` on a mocked account with an empty bucket ``bkt``."""
+
+    moto = pytest.importorskip('moto')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        from lucid.aws import S3
+        s3 = S3()
+        s3.client.create_bucket(Bucket='bkt')
+        yield s3
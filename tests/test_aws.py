@@ -0,0 +1,419 @@
+import base64
+import bz2
+import json
+import lzma
+import os
+import threading
+import time
+from io import BytesIO
+
+import pandas as pd
+import pytest
+from botocore.exceptions import ClientError
+
+CSV = pd.DataFrame({'id': range(20), 'country': ['US', 'CA', 'FR', 'DE'] * 5})
+
+
+def _put_tree(s3, n=3):
+    keys = [f'data/{a}/{b}/part-{i}.csv'
+            for a in 'xyz' for b in 'uv' for i in range(n)]
+    for key in keys:
+        s3.client.put_object(Bucket='bkt', Key=key, Body=b'a\n1\n')
+    s3.client.put_object(Bucket='bkt', Key='data/README.md', Body=b'#')
+    s3.client.put_object(Bucket='bkt', Key='other/part-0.csv', Body=b'a\n')
+    return keys
+
+
+#-----------------------------------------------------------------------------
+# read_df, write_df, fetch, iter_lines
+#-----------------------------------------------------------------------------
+
+FORMATS = ['f.csv', 'f.tsv.gz', 'f.parquet', 'f.json', 'f.jsonl.bz2']
+
+
+@pytest.mark.parametrize('key', FORMATS)
+def test_write_df_read_df_round_trip(s3, key):
+    s3.write_df(CSV, f's3://bkt/{key}')
+    pd.testing.assert_frame_equal(s3.read_df(f's3://bkt/{key}'), CSV,
+                                  check_dtype=False)
+
+
+@pytest.mark.parametrize('key', FORMATS)
+def test_read_df_chunks(s3, key):
+    s3.write_df(CSV, f's3://bkt/{key}')
+    chunks = list(s3.read_df(f's3://bkt/{key}', chunksize=8))
+    assert [len(df) for df in chunks] == [8, 8, 4]
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), CSV,
+                                  check_dtype=False)
+
+
+def test_read_df_columns(s3):
+    s3.write_df(CSV, 's3://bkt/f.parquet')
+    df = s3.read_df('s3://bkt/f.parquet', columns=['country'])
+    assert df.columns.tolist() == ['country']
+
+
+def test_fetch_revalidates_cached_object(s3, tmp_path, monkeypatch):
+    from lucid.io import ObjectCache
+    cache = ObjectCache(str(tmp_path))
+    s3.client.put_object(Bucket='bkt', Key='a.txt', Body=b'v1')
+    requests = []
+    get_object = s3.client.get_object
+
+    def spy(**kwargs):
+        requests.append(kwargs)
+        return get_object(**kwargs)
+    monkeypatch.setattr(s3.client, 'get_object', spy)
+
+    path = s3.fetch('s3://bkt/a.txt', cache)
+    assert open(path, 'rb').read() == b'v1'
+    assert s3.fetch('s3://bkt/a.txt', cache) == path
+    assert 'IfNoneMatch' not in requests[0] and 'IfNoneMatch' in requests[1]
+
+    s3.client.put_object(Bucket='bkt', Key='a.txt', Body=b'v2')
+    assert open(s3.fetch('s3://bkt/a.txt', cache), 'rb').read() == b'v2'
+
+
+@pytest.mark.parametrize('cached', [False, True])
+def test_iter_lines(s3, tmp_path, cached):
+    from lucid.io import ObjectCache
+    s3.cache = ObjectCache(str(tmp_path)) if cached else None
+    s3.client.put_object(Bucket='bkt', Key='a.txt', Body=b'x\r\ny\nz')
+    assert list(s3.iter_lines('s3://bkt/a.txt', chunk_size=2)) \
+        == ['x', 'y', 'z']
+
+
+#-----------------------------------------------------------------------------
+# ls
+#-----------------------------------------------------------------------------
+
+@pytest.mark.parametrize('n_workers', [1, 2, 16])
+def test_ls_lists_every_key_under_prefix(s3, n_workers):
+    keys = _put_tree(s3)
+    assert s3.ls('bkt', 'data/', n_workers=n_workers) == sorted(
+        keys + ['data/README.md'])
+
+
+def test_ls_pattern_and_detail(s3):
+    keys = _put_tree(s3)
+    df = s3.ls('bkt', 'data/', detail=True, pattern='*.csv')
+    assert sorted(df['key']) == sorted(keys)
+    assert (df['size'] == 4).all()
+
+
+def test_ls_raises_listing_errors(s3, monkeypatch):
+    _put_tree(s3)
+
+    def denied(bucket, prefix, delimiter=None):
+        raise ClientError({'Error': {'Code': 'AccessDenied'}}, 'ListObjectsV2')
+
+    monkeypatch.setattr(s3, '_list_pages', denied)
+    with pytest.raises(ClientError):
+        s3.ls('bkt', 'data/', n_workers=2)
+
+
+#-----------------------------------------------------------------------------
+# rm
+#-----------------------------------------------------------------------------
+
+def test_rm_dry_run_deletes_nothing(s3):
+    keys = _put_tree(s3)
+    assert sorted(s3.rm('bkt', 'data/', dry_run=True, pattern='*.csv')) \
+        == sorted(keys)
+    assert len(s3.ls('bkt', 'data/')) == len(keys) + 1
+
+
+def test_rm_deletes_prefix(s3):
+    keys = _put_tree(s3)
+    assert s3.rm('bkt', 'data/', n_workers=4) == len(keys) + 1
+    assert s3.ls('bkt', 'data/') == []
+    assert s3.ls('bkt', 'other/') == ['other/part-0.csv']
+
+
+def test_delete_batch_retries_only_throttled_keys(s3, monkeypatch, caplog):
+    calls = []
+
+    def delete_objects(Bucket, Delete):
+        keys = [o['Key'] for o in Delete['Objects']]
+        calls.append(keys)
+        errors = []
+        if 'denied' in keys:
+            errors.append({'Key': 'denied', 'Code': 'AccessDenied',
+                           'Message': 'Access Denied'})
+        if 'slow' in keys and len(calls) == 1:
+            errors.append({'Key': 'slow', 'Code': 'SlowDown'})
+        return {'Errors': errors}
+
+    monkeypatch.setattr(s3.client, 'delete_objects', delete_objects)
+    batch = [{'Key': k} for k in ('ok', 'denied', 'slow')]
+    assert s3._delete_batch('bkt', batch) == 2
+    assert calls == [['ok', 'denied', 'slow'], ['slow']]
+    assert 'denied: Access Denied' in caplog.text
+
+
+def test_rm_needs_rf(s3):
+    _put_tree(s3)
+    assert s3.rm('bkt', 'data/', flags='r') is None
+
+
+#-----------------------------------------------------------------------------
+# query
+#-----------------------------------------------------------------------------
+
+@pytest.mark.parametrize('ext, compress', [
+    ('csv', bytes),
+    ('csv.bz2', bz2.compress),
+    ('csv.xz', lzma.compress),
+])
+def test_query_filters_locally(s3, ext, compress):
+    body = CSV.to_csv(index=False).encode()
+    s3.client.put_object(Bucket='bkt', Key=f'q.{ext}', Body=compress(body))
+    df = pd.concat(s3.query(f's3://bkt/q.{ext}', columns=['id'],
+                            where=[('country', 'in', ['US', 'CA'])],
+                            select=False, chunksize=7))
+    assert df['id'].tolist() == [i for i in range(20) if i % 4 < 2]
+
+
+@pytest.mark.parametrize('key', ['q.json', 'q.jsonl.gz'])
+def test_query_filters_json_locally(s3, key):
+    s3.write_df(CSV, f's3://bkt/{key}')
+    df = pd.concat(s3.query(f's3://bkt/{key}', columns=['id'],
+                            where=[('country', '=', 'FR')], select=False))
+    assert df['id'].tolist() == [2, 6, 10, 14, 18]
+
+
+def test_query_rejects_unknown_format(s3, monkeypatch):
+    monkeypatch.setattr(s3, '_select', pytest.fail)
+    with pytest.raises(ValueError, match='xml'):
+        next(s3.query('s3://bkt/q.xml', fmt='xml'))
+
+
+def test_query_skips_select_for_unsupported_codec(s3, monkeypatch):
+    zstandard = pytest.importorskip('zstandard')
+    body = zstandard.ZstdCompressor().compress(CSV.to_csv(index=False).encode())
+    s3.client.put_object(Bucket='bkt', Key='q.csv.zst', Body=body)
+    monkeypatch.setattr(s3, '_select', pytest.fail)
+    df = pd.concat(s3.query('s3://bkt/q.csv.zst', where=[('id', '<', 5)],
+                            select=True))
+    assert df['id'].tolist() == list(range(5))
+
+
+def test_query_falls_back_if_select_fails_first(s3, monkeypatch):
+    s3.client.put_object(Bucket='bkt', Key='q.csv',
+                         Body=CSV.to_csv(index=False).encode())
+
+    def fail(*args):
+        raise ClientError({'Error': {'Code': 'MethodNotAllowed'}}, 'Select')
+        yield
+
+    monkeypatch.setattr(s3, '_select', fail)
+    df = pd.concat(s3.query('s3://bkt/q.csv', where=[('id', '>=', 18)]))
+    assert df['id'].tolist() == [18, 19]
+
+
+def test_query_raises_if_select_fails_midway(s3, monkeypatch):
+    s3.client.put_object(Bucket='bkt', Key='q.csv',
+                         Body=CSV.to_csv(index=False).encode())
+
+    def fail(*args):
+        yield CSV.head(5)
+        raise ClientError({'Error': {'Code': 'InternalError'}}, 'Select')
+
+    monkeypatch.setattr(s3, '_select', fail)
+    frames = []
+    with pytest.raises(ClientError):
+        for df in s3.query('s3://bkt/q.csv'):
+            frames.append(df)
+    assert len(frames) == 1
+
+
+#-----------------------------------------------------------------------------
+# sync
+#-----------------------------------------------------------------------------
+
+def _write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+def test_sync_up_and_down(s3, tmp_path):
+    src, dst = tmp_path / 'src', tmp_path / 'dst'
+    _write(src / 'a.txt', b'a')
+    _write(src / 'sub' / 'b.html.gz', b'b')
+    report = s3.sync(str(src), 's3://bkt/www')
+    assert report['transferred'] == 2 and report['bytes'] == 2
+    head = s3.client.head_object(Bucket='bkt', Key='www/sub/b.html.gz')
+    assert head['ContentEncoding'] == 'gzip'
+    assert head['ContentType'] == 'text/html'
+
+    assert s3.sync('s3://bkt/www', str(dst))['transferred'] == 2
+    assert (dst / 'sub' / 'b.html.gz').read_bytes() == b'b'
+    assert s3.sync('s3://bkt/www', str(dst))['transferred'] == 0
+
+    (src / 'a.txt').unlink()
+    assert s3.sync(str(src), 's3://bkt/www', delete=True)['deleted'] == 1
+    assert s3.ls('bkt', 'www/') == ['www/sub/b.html.gz']
+
+
+@pytest.mark.parametrize('mib', [5, 8, 13])
+def test_sync_skips_multipart_uploads_with_other_part_sizes(s3, tmp_path,
+                                                           mib):
+    from boto3.s3.transfer import TransferConfig
+    path = tmp_path / 'src' / 'big.bin'
+    _write(path, os.urandom(26 * 2**20))
+    part = mib * 2**20
+    s3.client.upload_file(str(path), 'bkt', 'big/big.bin', Config=TransferConfig(
+        multipart_threshold=part, multipart_chunksize=part))
+    etag = s3.client.head_object(Bucket='bkt', Key='big/big.bin')['ETag']
+    assert '-' in etag
+    later = time.time() + 60
+    os.utime(path, (later, later))  # newer than the object: ETags compared
+    report = s3.sync(str(path.parent), 's3://bkt/big')
+    assert report['transferred'] == 0 and report['skipped'] == 1
+
+
+#-----------------------------------------------------------------------------
+# Lambdas
+#-----------------------------------------------------------------------------
+
+@pytest.fixture
+def account(monkeypatch, tmp_path):
+    """Mocked account with Lambda functions; yields a function creator."""
+
+    moto = pytest.importorskip('moto')
+    import boto3
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        from lucid import aws
+        monkeypatch.setattr(aws, 'LAMBDA_CACHE', str(tmp_path / 'lambdas'))
+        role = boto3.client('iam').create_role(
+            RoleName='run', AssumeRolePolicyDocument='{}')['Role']['Arn']
+        client = boto3.client('lambda')
+
+        def create(name, **tags):
+            client.create_function(
+                FunctionName=name, Runtime='python3.12', Role=role,
+                Handler='main.handler', Code={'ZipFile': b'PK'}, Tags=tags,
+                Environment={'Variables': {
+                    'DEFAULT_SFN_ARN': f'arn:sfn:{name}',
+                    'DEFAULT_CONFIG_FILE': f's3://bkt/{name}.json',
+                }},
+            )
+
+        create('etl-orders', team='data')
+        create('etl-users', team='web')
+        create('report-orders', team='data', nightly='yes')
+        yield create
+
+
+def test_lambdas_client_params(account):
+    from botocore.config import Config
+    from lucid.aws import Lambdas
+    lambdas = Lambdas(region_name='us-east-1', config=Config(read_timeout=7),
+                      endpoint_url='https://lambda.us-east-1.amazonaws.com')
+    assert lambdas.client.meta.config.read_timeout == 7
+    assert len(lambdas.names) == 3
+
+
+def test_lambdas_find(account):
+    from lucid.aws import Lambdas
+    lambdas = Lambdas()
+    assert lambdas.find(prefix='etl-').FunctionName.tolist() \
+        == ['etl-orders', 'etl-users']
+    assert lambdas.find('orders').FunctionName.tolist() \
+        == ['etl-orders', 'report-orders']
+    assert lambdas.find('orders', prefix='report').FunctionName.tolist() \
+        == ['report-orders']
+    assert lambdas.find(tags={'team': 'data', 'nightly': None}) \
+        .FunctionName.tolist() == ['report-orders']
+    assert [fn['FunctionName'] for fn in lambdas.results] == ['report-orders']
+    assert lambdas.find('nope', refresh=False).empty
+
+
+def test_lambdas_catalog_cache(account):
+    from lucid.aws import Lambdas
+    lambdas = Lambdas()
+    lambdas.find(tags={'team': 'web'})
+    account('etl-events')
+
+    cached = Lambdas()
+    assert 'etl-events' not in cached.names
+    assert len(cached.tags) == 3  # tags were cached too
+    # a search that finds nothing lists the functions again
+    assert cached.find('events').FunctionName.tolist() == ['etl-events']
+
+    account('etl-items')
+    assert 'etl-items' in Lambdas(ttl=0).names
+
+
+class _FakeInvoke:
+    """Stub of ``client.invoke``: throttles or fails by payload ``n``."""
+
+    def __init__(self, throttle=None, fail=()):
+        self.throttle = throttle or {}  # n -> number of throttled calls
+        self.fail = fail
+        self.calls = []
+        self.active = self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, **kwargs):
+        payload = json.loads(kwargs['Payload'])
+        n = payload['n']
+        with self.lock:
+            self.calls.append(n)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(0.02)
+            if self.calls.count(n) <= self.throttle.get(n, 0):
+                raise ClientError(
+                    {'Error': {'Code': 'TooManyRequestsException'}}, 'Invoke')
+            if n in self.fail:
+                raise ClientError(
+                    {'Error': {'Code': 'ResourceNotFoundException'}}, 'Invoke')
+            return {
+                'StatusCode': 200,
+                'FunctionError': 'Unhandled' if n == 3 else None,
+                'ResponseMetadata': {'RequestId': f'req-{n}'},
+                'Payload': BytesIO(json.dumps(payload).encode()),
+                'LogResult': base64.b64encode(f'log {n}'.encode()).decode(),
+            }
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+def test_invoke_many_results_and_concurrency(account, monkeypatch):
+    from lucid.aws import Lambdas
+    lambdas = Lambdas()
+    lambdas.find(prefix='etl-orders')
+    invoke = _FakeInvoke()
+    monkeypatch.setattr(lambdas.client, 'invoke', invoke)
+    runs = lambdas.invoke_many([{'n': n} for n in range(12)],
+                               invocation_type='RequestResponse',
+                               max_concurrency=4)
+    assert 1 < invoke.peak <= 4
+    assert runs['params'].tolist() == [{'n': n} for n in range(12)]
+    assert runs['request_id'].tolist() == [f'req-{n}' for n in range(12)]
+    assert runs['log'].tolist() == [f'log {n}' for n in range(12)]
+    assert json.loads(runs.loc[5, 'payload']) == {
+        'stateMachineArn': 'arn:sfn:etl-orders',
+        'jobConfigUrl': 's3://bkt/etl-orders.json',
+        'n': 5,
+    }
+    assert runs['function_error'].notna().tolist() == [n == 3 for n in range(12)]
+    assert runs['error'].isna().all() and (runs['duration'] > 0).all()
+
+
+def test_invoke_many_retries_throttled_calls(account, monkeypatch):
+    from lucid.aws import Lambdas
+    lambdas = Lambdas()
+    lambdas.find(prefix='etl-orders')
+    invoke = _FakeInvoke(throttle={0: 2, 1: 5}, fail=(2,))
+    monkeypatch.setattr(lambdas.client, 'invoke', invoke)
+    runs = lambdas.invoke_many([{'n': n} for n in range(4)], retries=2)
+    assert [invoke.calls.count(n) for n in range(4)] == [3, 3, 1, 1]
+    assert runs['status'].tolist()[::3] == [200, 200]
+    assert 'TooManyRequestsException' in runs.loc[1, 'error']
+    assert 'ResourceNotFoundException' in runs.loc[2, 'error']
+    assert runs['status'].isna().tolist() == [False, True, True, False]
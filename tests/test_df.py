@@ -0,0 +1,363 @@
+import os
+
+import pandas as pd
+import pytest
+
+from lucid import df as ldf
+
+
+#-----------------------------------------------------------------------------
+# read_csv_parallel, gzip_index
+#-----------------------------------------------------------------------------
+
+ROWS = pd.DataFrame({'id': range(1000), 'name': [f'n{i}' for i in range(1000)]})
+
+
+def _csv(tmp_path, kind):
+    import gzip
+    text = ROWS.to_csv(index=False).encode()
+    if kind in ('plain', 'mmap'):
+        path = tmp_path / 'rows.csv'
+        path.write_bytes(text)
+    else:
+        path = tmp_path / 'rows.csv.gz'
+        # one member per block of 100 rows, like split then cat *.gz
+        lines = text.splitlines(keepends=True)
+        blocks = [b''.join(lines[i:i + 100]) for i in range(0, len(lines), 100)]
+        if kind == 'single':
+            blocks = [text]
+        path.write_bytes(b''.join(gzip.compress(b) for b in blocks))
+    return str(path)
+
+
+@pytest.mark.parametrize('kind', ['plain', 'mmap', 'multi', 'single'])
+def test_read_csv_parallel(tmp_path, monkeypatch, kind):
+    monkeypatch.setattr(ldf, 'GZI_CACHE', str(tmp_path / 'cache'))
+    file = _csv(tmp_path, kind)
+    df = ldf.read_csv_parallel(file, n_workers=2, chunk_bytes=2000,
+                               use_mmap=kind == 'mmap')
+    pd.testing.assert_frame_equal(df, ROWS, check_dtype=False)
+
+
+def test_gzip_index_multi_member(tmp_path, monkeypatch):
+    monkeypatch.setattr(ldf, 'GZI_CACHE', str(tmp_path / 'cache'))
+    file = _csv(tmp_path, 'multi')
+    index = ldf.gzip_index(file)
+    assert len(index) == 11 and index[0].tolist() == [0, 0]
+    assert index[-1, 1] == len(ROWS.to_csv(index=False)) - len('999,n999\n')
+    assert os.path.exists(file + '.gzi')
+    assert (ldf.gzip_index(file) == index).all()
+
+
+def test_gzip_index_single_member_is_not_saved(tmp_path, monkeypatch):
+    monkeypatch.setattr(ldf, 'GZI_CACHE', str(tmp_path / 'cache'))
+    file = _csv(tmp_path, 'single')
+    assert ldf.gzip_index(file).tolist() == [[0, 0]]
+    assert not os.path.exists(file + '.gzi')
+    assert not os.path.exists(tmp_path / 'cache')
+
+
+def test_gzip_index_falls_back_to_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(ldf, 'GZI_CACHE', str(tmp_path / 'cache'))
+    file = _csv(tmp_path, 'multi')
+    os.mkdir(file + '.gzi')  # not writable as a file, even for root
+    index = ldf.gzip_index(file)
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+    assert (ldf.gzip_index(file) == index).all()
+
+
+def test_gzip_index_kept_in_memory(tmp_path, monkeypatch, caplog):
+    def read_only(*args, **kwargs):
+        raise PermissionError('read-only')
+
+    monkeypatch.setattr(ldf, 'GZI_CACHE', str(tmp_path / 'cache'))
+    monkeypatch.setattr(ldf.os, 'makedirs', read_only)
+    file = _csv(tmp_path, 'multi')
+    assert len(ldf.gzip_index(file)) == 11
+    assert 'keeping it in memory' in caplog.text
+    assert os.listdir(tmp_path) == ['rows.csv.gz']
+
+
+#-----------------------------------------------------------------------------
+# optimize
+#-----------------------------------------------------------------------------
+
+def test_optimize_empty_frame():
+    out, report = ldf.optimize(pd.DataFrame())
+    assert out.empty and report.empty
+
+
+def test_optimize_dates_need_a_separator():
+    df = pd.DataFrame({
+        'year': ['2019', '1999'] * 50,
+        'day': ['2020-01-01', '2021-03-04'] * 50,
+        'month': ['Jan 5, 2020', 'Feb 6, 2021'] * 50,
+    })
+    out, _ = ldf.optimize(df)
+    assert out['year'].dtype == 'category'
+    assert out['year'].tolist() == df['year'].tolist()
+    assert out['day'].dtype.kind == 'M'
+    assert out['month'].dtype.kind == 'M'
+
+
+def test_optimize_keeps_arrow_strings():
+    pytest.importorskip('pyarrow')
+    s = pd.Series([f'id{i}' for i in range(100)] + [None])
+    arrow = s.astype(pd.StringDtype('pyarrow', na_value=float('nan')))
+    out, _ = ldf.optimize(pd.DataFrame({'a': arrow, 'b': s.astype(object)}))
+    assert out['a'].dtype == arrow.dtype
+    assert out['b'].dtype.storage == 'pyarrow'
+
+
+def test_optimize_numbers():
+    df = pd.DataFrame({'i': range(100), 'f': [0.5] * 100})
+    out, _ = ldf.optimize(df, sparse_min=1.1)
+    assert out['i'].dtype == 'uint8'
+    assert out['f'].dtype == 'float32'
+
+
+#-----------------------------------------------------------------------------
+# gresample
+#-----------------------------------------------------------------------------
+
+def _events(n=2000):
+    import numpy as np
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'g': rng.choice(list('abc'), n),
+        't': pd.Timestamp('2020-01-01 13:05')
+        + pd.to_timedelta(rng.integers(0, 100 * 86400, n), unit='s'),
+        'x': rng.integers(0, 50, n).astype(float),
+    })
+
+
+@pytest.mark.parametrize('n_workers', [None, 3])
+@pytest.mark.parametrize('period', ['D', 'W', '7D'])
+def test_gresample_matches_groupby_agg(period, n_workers):
+    df = _events()
+    ag = {'x': ['nunique', 'sum', 'median'], 't': ['max', 'first', 'nunique']}
+    expected = df.groupby(['g', pd.Grouper(freq=period, key='t')]).agg(ag)
+    out = ldf.gresample(df, ['g'], 't', period, ag, n_workers=n_workers)
+    # the partitioned path only yields observed bins
+    expected = expected[expected[('t', 'nunique')] > 0]
+    out = out[out[('t', 'nunique')] > 0]
+    pd.testing.assert_frame_equal(out, expected, check_dtype=False,
+                                  check_column_type=False)
+
+
+def _gresample_or_error(df, period):
+    try:
+        return ldf.gresample(df, ['g'], 't', period, {'x': 'sum'})
+    except ValueError as e:
+        return type(e)
+
+
+@pytest.mark.parametrize('period', ['M', 'Q', 'A', 'AS', 'Y', 'ME', 'YS'])
+def test_gresample_backends_accept_the_same_periods(period):
+    pl = pytest.importorskip('polars')
+    df = _events()
+    expected = _gresample_or_error(df, period)
+    for frame in (pl.from_pandas(df), pl.from_pandas(df).to_arrow()):
+        out = _gresample_or_error(frame, period)
+        if isinstance(expected, type):
+            assert out is expected
+        else:
+            pd.testing.assert_frame_equal(out, expected, check_dtype=False,
+                                          check_index_type=False)
+
+
+#-----------------------------------------------------------------------------
+# gresample_sql
+#-----------------------------------------------------------------------------
+
+@pytest.mark.filterwarnings('ignore:pandas only supports SQLAlchemy')
+@pytest.mark.parametrize('period', ['D', 'W', 'ME', 'QE', '7D', '6h'])
+def test_gresample_sql_matches_pandas(period):
+    duckdb = pytest.importorskip('duckdb')
+    import numpy as np
+    rng = np.random.default_rng(0)
+    n = 2000
+    df = pd.DataFrame({
+        'g': rng.choice(list('ab'), n),
+        't': pd.Timestamp('2020-01-01 13:05')
+        + pd.to_timedelta(rng.integers(0, 200 * 86400, n), unit='s'),
+        'x': rng.integers(0, 50, n).astype(float),
+    })
+    conn = duckdb.connect()
+    conn.execute('CREATE TABLE events AS SELECT * FROM df')
+    ag = {'x': ['nunique', 'sum'], 't': 'size'}
+    pd.testing.assert_frame_equal(
+        ldf.gresample_sql(conn, 'events', ['g'], 't', period, ag, log=False),
+        ldf.gresample(df, ['g'], 't', period, ag),
+        check_dtype=False, check_index_type=False,
+    )
+
+
+def test_gresample_sql_rejects_calendar_aliases():
+    assert ldf.gresample_sql(None, 'events', ['g'], 't', 'M', {'x': 'sum'},
+                             run=False) is None
+
+
+#-----------------------------------------------------------------------------
+# detect_mixed_types
+#-----------------------------------------------------------------------------
+
+@pytest.mark.parametrize('n_workers', [None, 2])
+def test_detect_mixed_types(n_workers):
+    import datetime as dt
+    df = pd.DataFrame({
+        'ints': pd.Series([1, 2, 3], dtype=object),
+        'int_str': pd.Series([1, '2', 3], dtype=object),
+        'dates': [dt.date(2020, 1, d) for d in (1, 2, 3)],
+        'date_datetime': [dt.date(2020, 1, 1), dt.datetime(2020, 1, 2),
+                          dt.date(2020, 1, 3)],
+    })
+    mixed = ldf.detect_mixed_types(df, n_workers=n_workers)
+    assert list(mixed.index) == ['int_str', 'date_datetime']
+    assert mixed.loc['date_datetime', 'types'] == {'date': 2, 'datetime': 1}
+    assert mixed.loc['date_datetime', 'examples'] == {'datetime': [1]}
+
+
+def test_detect_mixed_types_sample():
+    values = [str(i) for i in range(1000)]
+    values[500] = 500
+    df = pd.DataFrame({'s': pd.Series(values, dtype=object)})
+    assert ldf.detect_mixed_types(df, sample=10).empty
+    assert ldf.detect_mixed_types(df, sample=1000).index.tolist() == ['s']
+
+
+#-----------------------------------------------------------------------------
+# scan_empty_columns
+#-----------------------------------------------------------------------------
+
+def _parquet(tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    import numpy as np
+    import pyarrow.parquet as pq
+    table = pa.table({
+        'x': [None, None, 1.0, None],
+        'nan': [np.nan] * 4,
+        'none': pa.nulls(4, pa.float64()),
+        's': [None, None, None, 'a'],
+    })
+    path = str(tmp_path / 'f.parquet')
+    pq.write_table(table, path, row_group_size=2)
+    return path
+
+
+def test_scan_empty_columns_parquet(tmp_path):
+    assert ldf.scan_empty_columns(_parquet(tmp_path)) == ['nan', 'none']
+
+
+def test_scan_empty_columns_parquet_without_float_min_max(tmp_path,
+                                                          monkeypatch):
+    """Some writers keep null counts but no min/max for floats."""
+
+    path = _parquet(tmp_path)
+    import pyarrow.parquet as pq
+
+    class Proxy:
+        """Wraps ``obj``, passing attributes in ``attrs`` through a function."""
+
+        def __init__(self, obj, **attrs):
+            self._obj, self._attrs = obj, attrs
+
+        def __getattr__(self, name):
+            value = getattr(self._obj, name)
+            return self._attrs[name](value) if name in self._attrs else value
+
+    def statistics(stats):
+        return Proxy(stats, has_min_max=lambda _: False)
+
+    def column(get):
+        return lambda i: Proxy(get(i), statistics=statistics)
+
+    def row_group(get):
+        return lambda i: Proxy(get(i), column=column)
+
+    class ParquetFile(pq.ParquetFile):
+        @property
+        def metadata(self):
+            return Proxy(super().metadata, row_group=row_group)
+
+    monkeypatch.setattr(pq, 'ParquetFile', ParquetFile)
+    assert ldf.scan_empty_columns(path) == ['nan', 'none']
+
+
+#-----------------------------------------------------------------------------
+# Polars/Arrow backends
+#-----------------------------------------------------------------------------
+
+def _polars(df):
+    pl = pytest.importorskip('polars')
+    return pl.from_pandas(df)
+
+
+def _polars_lazy(df):
+    return _polars(df).lazy()
+
+
+def _arrow(df):
+    pa = pytest.importorskip('pyarrow')
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+BACKENDS = pytest.mark.parametrize('to_backend', [_polars, _polars_lazy, _arrow])
+
+
+def _frame():
+    return pd.DataFrame({
+        'g': ['a'] * 6 + ['b'] * 3 + ['c'] + [None] * 2,
+        'x': [float(i) for i in range(11)] + [float('nan')],
+        'empty': [None] * 12,
+        'nan': [float('nan')] * 12,
+    })
+
+
+@BACKENDS
+@pytest.mark.parametrize('dropna', [False, True])
+def test_backend_vc(to_backend, dropna):
+    df = _frame()
+    out = ldf.vc(to_backend(df), 'g', dropna=dropna)
+    pd.testing.assert_series_equal(out, ldf.vc(df, 'g', dropna=dropna),
+                                   check_dtype=False, check_index_type=False)
+
+
+@BACKENDS
+def test_backend_ntop(to_backend):
+    df = _frame()[['g', 'x']]
+    pd.testing.assert_frame_equal(ldf.ntop(to_backend(df), n=2),
+                                  ldf.ntop(df, n=2))
+
+
+@pytest.mark.parametrize('to_backend', [_polars, _arrow])
+def test_backend_topseries(to_backend):
+    df = _frame()[['x']].dropna()
+    series = to_backend(df)['x']
+    pd.testing.assert_series_equal(ldf.topseries(series, n=3),
+                                   ldf.topseries(df['x'], n=3),
+                                   check_dtype=False, check_index_type=False)
+
+
+@BACKENDS
+def test_backend_empty_columns(to_backend):
+    df = _frame()
+    frame = to_backend(df)
+    pd.testing.assert_series_equal(ldf.find_empty_columns(frame),
+                                   ldf.find_empty_columns(df))
+    dropped = ldf.drop_empty_columns(frame)
+    assert type(dropped) is type(frame)
+    assert ldf._backend(dropped).columns(dropped) \
+        == ldf.drop_empty_columns(df).columns.tolist()
+
+
+@BACKENDS
+@pytest.mark.parametrize('period', ['D', 'W', 'ME', 'QS', '7D', '6h'])
+def test_backend_gresample(to_backend, period):
+    df = _events()
+    ag = {'x': ['nunique', 'sum', 'mean', 'median', 'max'], 't': 'size'}
+    pd.testing.assert_frame_equal(
+        ldf.gresample(to_backend(df), ['g'], 't', period, ag),
+        ldf.gresample(df, ['g'], 't', period, ag),
+        check_dtype=False, check_index_type=False,
+    )
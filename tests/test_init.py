@@ -0,0 +1,56 @@
+import subprocess
+import sys
+
+from conftest import ROOT
+
+IMPORT_BUDGET = 0.1  # seconds for import lucid, in a fresh interpreter
+HEAVY = ('pandas', 'numpy', 'boto3', 'botocore', 'google', 'bokeh', 'jinja2',
+         'pyarrow', 'polars', 'requests')
+
+
+def _run(code):
+    setup = (
+        'import sys\n'
+        f'sys.path.insert(0, {str(ROOT / "tests")!r})\n'
+        'import conftest\n'
+    )
+    return subprocess.run([sys.executable, '-c', setup + code],
+                          capture_output=True, text=True, check=True).stdout
+
+
+def test_import_loads_no_heavy_dependencies():
+    out = _run(
+        'heavy = %r\n'
+        'print(sorted({m.split(".")[0] for m in sys.modules} & set(heavy)))\n'
+        % (HEAVY,)
+    )
+    assert out.strip() == '[]'
+
+
+def test_submodules_load_on_first_access():
+    out = _run(
+        'import lucid\n'
+        'print("lucid.util" in sys.modules, lucid.util.__name__)\n'
+    )
+    assert out.split() == ['False', 'lucid.util']
+
+
+def test_import_time_within_budget():
+    # loads the package like conftest.load_lucid, without importing pytest
+    code = (
+        'import importlib.util, sys, time\n'
+        't0 = time.perf_counter()\n'
+        f'spec = importlib.util.spec_from_file_location("lucid", '
+        f'{str(ROOT / "__init__.py")!r}, '
+        f'submodule_search_locations=[{str(ROOT)!r}])\n'
+        'module = importlib.util.module_from_spec(spec)\n'
+        'sys.modules["lucid"] = module\n'
+        'spec.loader.exec_module(module)\n'
+        'print(time.perf_counter() - t0)\n'
+    )
+    seconds = min(
+        float(subprocess.run([sys.executable, '-c', code], capture_output=True,
+                             text=True, check=True).stdout)
+        for _ in range(3)
+    )
+    assert seconds < IMPORT_BUDGET
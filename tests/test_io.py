@@ -0,0 +1,456 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import socket
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from lucid import io
+
+DATA = os.urandom(300_000)
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """Serves ``server.files`` by path, honouring single byte ranges."""
+
+    def _send(self, body=True):
+        files = self.server.files
+        if self.path not in files:
+            self.send_error(404)
+            return
+        data, headers = files[self.path]
+        start, end = 0, len(data)
+        m = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        if m and self.server.ranges:
+            start = int(m[1])
+            end = int(m[2]) + 1 if m[2] else len(data)
+            if start >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             f'bytes {start}-{end - 1}/{len(data)}')
+        else:
+            self.send_response(200)
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start))
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.end_headers()
+        if body:
+            self.wfile.write(data[start:end])
+
+    def do_GET(self):
+        self._send()
+
+    def do_HEAD(self):
+        self._send(body=False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http():
+    """A local HTTP server; returns ``(server, base_url)``."""
+
+    pytest.importorskip('requests')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _RangeHandler)
+    server.files, server.ranges = {'/data.bin': (DATA, {})}, True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+#-----------------------------------------------------------------------------
+# xlsave
+#-----------------------------------------------------------------------------
+
+def test_xlsave_switches_to_large_mode_with_to_excel_kwargs(
+        tmp_path, monkeypatch, caplog):
+    pytest.importorskip('xlsxwriter')
+    pytest.importorskip('openpyxl')
+    import pandas as pd
+    monkeypatch.setattr(io, 'XL_MAX_ROWS', 5)
+    df = pd.DataFrame({'a': range(10), 'b': [None, 'x'] * 5, 'c': 0.5})
+    out = str(tmp_path / 'big.xlsx')
+    io.xlsave(out, df, 'data', index=False, columns=['a', 'b'], na_rep='-',
+              freeze_panes=(1, 0))
+    sheets = pd.read_excel(out, sheet_name=None)
+    assert list(sheets) == ['data_1', 'data_2', 'data_3']
+    back = pd.concat(sheets.values(), ignore_index=True)
+    assert back.columns.tolist() == ['a', 'b']
+    assert back['a'].tolist() == list(range(10))
+    assert back['b'].tolist() == ['-', 'x'] * 5
+    assert 'large mode ignores freeze_panes' in caplog.text
+
+
+@pytest.mark.parametrize('index_name', [None, 'id'])
+def test_xlsave_large_index_header_like_to_excel(tmp_path, index_name):
+    pytest.importorskip('xlsxwriter')
+    openpyxl = pytest.importorskip('openpyxl')
+    import pandas as pd
+    df = pd.DataFrame({'index': [1, 2], 'b': ['x', 'y']},
+                      index=pd.Index([5, 6], name=index_name))
+    io.xlsave(str(tmp_path / 'large.xlsx'), df, 'data', large=True)
+    df.to_excel(tmp_path / 'small.xlsx', sheet_name='data')
+
+    def cells(name):
+        ws = openpyxl.load_workbook(tmp_path / name).active
+        return [[c.value for c in row] for row in ws.iter_rows()]
+    assert cells('large.xlsx') == cells('small.xlsx')
+
+
+#-----------------------------------------------------------------------------
+# xlread
+#-----------------------------------------------------------------------------
+
+@pytest.fixture
+def workbook(tmp_path, monkeypatch):
+    pytest.importorskip('python_calamine')
+    pytest.importorskip('pyarrow')
+    pytest.importorskip('openpyxl')
+    import pandas as pd
+    monkeypatch.setattr(io, 'XL_CACHE', str(tmp_path / 'cache'))
+    path = str(tmp_path / 'book.xlsx')
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for i, name in enumerate(['first', 'second', 'third']):
+            pd.DataFrame({
+                'n': range(i, i + 5), 'name': [f'{name}{j}' for j in range(5)],
+                'x': [0.5 * i] * 5,
+            }).to_excel(writer, sheet_name=name, index=False)
+    return path
+
+
+def _assert_sheets_equal(left, right):
+    import pandas as pd
+    assert list(left) == list(right)
+    for name in left:
+        pd.testing.assert_frame_equal(left[name], right[name], check_dtype=False)
+
+
+def test_xlread_sheets_in_workers(workbook):
+    import pandas as pd
+    expected = pd.read_excel(workbook, sheet_name=None, engine='calamine')
+    _assert_sheets_equal(io.xlread(workbook, n_workers=2), expected)
+
+
+def test_xlread_second_call_reads_cache(workbook, monkeypatch):
+    import pandas as pd
+    first = io.xlread(workbook, n_workers=2)
+    monkeypatch.setattr(io, '_xlread_sheet', pytest.fail)
+    monkeypatch.setattr(io.pd, 'ExcelFile', pytest.fail)
+    _assert_sheets_equal(io.xlread(workbook), first)
+    pd.testing.assert_frame_equal(io.xlread(workbook, sheets=1),
+                                  first['second'])
+
+
+def test_xlread_parses_changed_workbook(workbook):
+    import pandas as pd
+    io.xlread(workbook, sheets='first')
+    pd.DataFrame({'n': [7]}).to_excel(workbook, sheet_name='new', index=False)
+    os.utime(workbook, (1, 1))  # in case the mtime did not tick
+    assert io.xlread(workbook)['new']['n'].tolist() == [7]
+
+
+#-----------------------------------------------------------------------------
+# webtable
+#-----------------------------------------------------------------------------
+
+def test_html_rows_match_to_html():
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(0)
+    n = 300
+    df = pd.DataFrame({
+        'third': np.arange(n) / 3,
+        'cents': np.round(rng.random(n) * 100, 2),
+        'big': rng.random(n) * 1e7,
+        'tiny': np.where(np.arange(n) == 7, 1e-9, 1.0),
+        'nullable': pd.array(np.where(np.arange(n) % 9, 1 / 7, None),
+                             dtype='Float64'),
+        'objects': pd.Series([None, 'x', 2 / 3] * (n // 3), dtype=object),
+        'when': pd.to_datetime(np.where(np.arange(n) % 5, '2020-01-02', None)),
+        'ints': pd.array(np.where(np.arange(n) % 4, 1, None), dtype='Int64'),
+        'text': ['a', None, '<b>'] * (n // 3),
+    })
+    streamed = ''.join(io._html_rows(df, block_rows=64))
+    expected = re.split('</?tbody>\n', df.to_html(index=False, escape=False))[1]
+    assert streamed == expected.rstrip(' ')
+
+
+def test_webtable_ajax_json(tmp_path):
+    pytest.importorskip('jinja2')
+    import pandas as pd
+    df = pd.DataFrame({'a': [1, 2], 'b': ['x', None]})
+    io.webtable(df, 't.html', wwwfolder=f'{tmp_path}/', ajax=True,
+                showurl=False)
+    data = json.loads((tmp_path / 't.json').read_text())
+    assert data == {'columns': ['a', 'b'], 'data': [[1, 'x'], [2, None]]}
+    assert sorted(os.listdir(tmp_path)) == ['t.html', 't.json']
+    assert os.stat(tmp_path / 't.json').st_mode & 0o777 == 0o666
+
+
+def test_webtable_shards(tmp_path):
+    pytest.importorskip('jinja2')
+    import pandas as pd
+    df = pd.DataFrame({'a': range(25), 'b': [f'r{i}' for i in range(25)]})
+    io.webtable(df, 't.html', wwwfolder=f'{tmp_path}/', ajax='shards',
+                shard_rows=10, sort_col='0, "desc"', showurl=False)
+    folder = tmp_path / 't_data'
+    assert sorted(os.listdir(folder)) == [
+        'manifest.json', 'part-00000.json', 'part-00001.json',
+        'part-00002.json']
+    manifest = json.loads((folder / 'manifest.json').read_text())
+    assert manifest['rows'] == 25
+    assert [s['rows'] for s in manifest['shards']] == [10, 10, 5]
+    first = json.loads((folder / 'part-00000.json').read_text())
+    assert [row[0] for row in first['data']] == list(range(24, 14, -1))
+
+
+#-----------------------------------------------------------------------------
+# compress_file
+#-----------------------------------------------------------------------------
+
+def _text(n):
+    # compressible, but with back-references across 4 KB blocks
+    words = [b'alpha ', b'beta ', b'gamma\n', bytes(range(256))]
+    data = b''.join(words[i * 7 % 4] for i in range(n // 8 + 1))
+    return data[:n]
+
+
+@pytest.mark.parametrize('n_threads', [1, 3])
+@pytest.mark.parametrize('size', [0, 1, 4096, 5 * 4096 + 17])
+def test_compress_file(tmp_path, size, n_threads):
+    path = tmp_path / 'page.html'
+    data = _text(size)
+    path.write_bytes(data)
+    sizes = io.compress_file(str(path), ['gz'], n_threads=n_threads,
+                             block_bytes=4096)
+    assert sizes == {'gz': os.path.getsize(f'{path}.gz')}
+    with gzip.open(f'{path}.gz', 'rb') as f:
+        assert f.read() == data
+    with open(f'{path}.gz', 'rb') as f:
+        assert int.from_bytes(f.read(8)[4:], 'little') \
+            == int(os.path.getmtime(path))
+    assert sorted(os.listdir(tmp_path)) == ['page.html', 'page.html.gz']
+
+
+def test_gzip_blocks_is_one_member(tmp_path):
+    import io as pyio
+    import zlib
+    data = _text(10 * 1000 + 3)
+    dst = pyio.BytesIO()
+    io._gzip_blocks(pyio.BytesIO(data), dst, n_threads=4, block_bytes=1000)
+    d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert d.decompress(dst.getvalue()) == data
+    assert d.eof and d.unused_data == b''
+
+
+@pytest.mark.parametrize('size', [0, 5 * 4096 + 17])
+def test_brotli_stream(tmp_path, monkeypatch, size):
+    brotli = pytest.importorskip('brotli')
+    monkeypatch.setattr(io, 'COMPRESS_BLOCK', 4096)
+    path = tmp_path / 'page.html'
+    path.write_bytes(_text(size))
+    assert list(io.compress_file(str(path), 'br')) == ['br']
+    assert brotli.decompress((tmp_path / 'page.html.br').read_bytes()) \
+        == _text(size)
+
+
+def test_compress_file_unknown_format(tmp_path, caplog):
+    path = tmp_path / 'page.html'
+    path.write_bytes(b'x')
+    assert io.compress_file(str(path), ['zip']) == {}
+    assert 'unknown format zip' in caplog.text
+    assert os.listdir(tmp_path) == ['page.html']
+
+
+#-----------------------------------------------------------------------------
+# serve
+#-----------------------------------------------------------------------------
+
+@pytest.fixture
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def query_server(free_port):
+    yield free_port
+    io.shutdown()
+    io.TABLES.clear()
+
+
+def test_serve_queries_registered_table(query_server, tmp_path):
+    import pandas as pd
+    df = pd.DataFrame({'name': ['ann', 'bob', 'cy'], 'n': [3, 1, 2]})
+    io.register_table(df, 'people', port=query_server,
+                      wwwfolder=str(tmp_path))
+    assert io.serve().server_address == ('127.0.0.1', query_server)
+    url = (f'http://127.0.0.1:{query_server}/dt/people?draw=2&start=0'
+           '&length=10&order[0][column]=1&order[0][dir]=desc&search[value]=b')
+    with urllib.request.urlopen(url) as r:
+        body = json.load(r)
+    assert body == {'draw': 2, 'recordsTotal': 3, 'recordsFiltered': 1,
+                    'data': [['bob', 1]]}
+
+
+def test_serve_port_taken(query_server, tmp_path, caplog):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', query_server))
+        sock.listen()
+        assert io.serve(port=query_server, wwwfolder=str(tmp_path)) is None
+    assert 'is another server running' in caplog.text
+
+
+def test_page_links_point_at_running_server(query_server, tmp_path):
+    io.serve(port=query_server, wwwfolder=str(tmp_path))
+    assert io._webserver() == f'127.0.0.1:{query_server}/'
+
+
+#-----------------------------------------------------------------------------
+# download
+#-----------------------------------------------------------------------------
+
+@pytest.mark.parametrize('n_parts', [1, 4])
+def test_download(http, tmp_path, n_parts):
+    _, url = http
+    out = str(tmp_path / 'data.bin')
+    report = io.download(f'{url}/data.bin', out, n_parts=n_parts,
+                         chunk_size=4096)
+    assert open(out, 'rb').read() == DATA
+    assert report['bytes'] == report['written'] == len(DATA)
+    assert report['parts'] == n_parts
+    assert not os.path.exists(out + '.part')
+
+
+def test_download_without_ranges_uses_one_stream(http, tmp_path):
+    server, url = http
+    server.ranges = False
+    out = str(tmp_path / 'data.bin')
+    report = io.download(f'{url}/data.bin', out, n_parts=4)
+    assert open(out, 'rb').read() == DATA
+    assert report['parts'] == 1
+
+
+def test_download_resumes_part_file(http, tmp_path):
+    _, url = http
+    out = str(tmp_path / 'data.bin')
+    with open(out + '.part', 'wb') as f:
+        f.write(DATA[:100_000])
+    digest = hashlib.sha256(DATA).hexdigest()
+    report = io.download(f'{url}/data.bin', out, checksum=f'sha256:{digest}')
+    assert open(out, 'rb').read() == DATA
+    assert report['resumed_from'] == 100_000
+    assert report['bytes'] == len(DATA) - 100_000
+
+
+def test_download_bad_checksum(http, tmp_path):
+    _, url = http
+    out = str(tmp_path / 'data.bin')
+    assert io.download(f'{url}/data.bin', out, checksum='md5:00') is None
+    assert not os.path.exists(out)
+    assert not os.path.exists(out + '.part')
+
+
+@pytest.mark.parametrize('n_parts', [1, 3])
+def test_download_decompresses(http, tmp_path, n_parts):
+    server, url = http
+    server.files['/data.bin.gz'] = (gzip.compress(DATA), {})
+    out = str(tmp_path / 'data.bin')
+    io.download(f'{url}/data.bin.gz', out, decompress='auto', n_parts=n_parts)
+    assert open(out, 'rb').read() == DATA
+
+
+@pytest.mark.parametrize('n_parts', [1, 3])
+def test_download_keeps_content_encoding(http, tmp_path, n_parts):
+    server, url = http
+    encoded = gzip.compress(DATA)
+    server.files['/enc.bin'] = (encoded, {'Content-Encoding': 'gzip'})
+    out = str(tmp_path / 'enc.bin')
+    with open(out + '.part', 'wb') as f:
+        f.write(encoded[:1000])
+    report = io.download(f'{url}/enc.bin', out, n_parts=n_parts)
+    assert open(out, 'rb').read() == encoded
+    assert report['bytes'] == len(encoded) - (1000 if n_parts == 1 else 0)
+
+    io.download(f'{url}/enc.bin', out, n_parts=n_parts, decompress='auto')
+    assert open(out, 'rb').read() == DATA
+
+
+#-----------------------------------------------------------------------------
+# read_stream
+#-----------------------------------------------------------------------------
+
+@pytest.mark.parametrize('codec', [None, 'gzip', 'bz2', 'xz'])
+def test_read_stream_codecs(codec):
+    import bz2
+    import lzma
+
+    import pandas as pd
+    compress = {None: bytes, 'gzip': gzip.compress, 'bz2': bz2.compress,
+                'xz': lzma.compress}[codec]
+    df = pd.DataFrame({'a': range(1000), 'b': ['x', 'y'] * 500})
+    data = compress(df.to_csv(index=False).encode())
+    chunks = (data[i:i + 777] for i in range(0, len(data), 777))
+    out = pd.concat(io.read_stream(chunks, chunksize=300))
+    assert out['a'].tolist() == list(range(1000))
+
+
+def test_byte_stream_close_releases_response():
+
+    class Response:
+        closed = False
+
+        def iter_content(self, chunk_size):
+            while not self.closed:
+                yield b'x' * chunk_size
+
+        def close(self):
+            self.closed = True
+
+    response = Response()
+    stream = io.ByteStream(response, decompress=None, chunk_size=10)
+    assert stream.read(10) == b'x' * 10
+    stream.close()
+    assert response.closed
+
+
+#-----------------------------------------------------------------------------
+# ObjectCache
+#-----------------------------------------------------------------------------
+
+def test_object_cache_round_trip(tmp_path):
+    cache = io.ObjectCache(str(tmp_path))
+    assert cache.get('s3://b/k', 'v1') is None
+    path = cache.put(('s3://b/k', 'v1'), [b'ab', b'c'])
+    assert cache.get('s3://b/k', 'v1') == path
+    assert bytes(cache.read('s3://b/k', 'v1')) == b'abc'
+    cache.set_ref('s3://b/k', 'v1')
+    assert cache.ref('s3://b/k') == 'v1'
+
+
+def test_object_cache_scans_only_at_its_limit(tmp_path, monkeypatch):
+    cache = io.ObjectCache(str(tmp_path), max_bytes=10_000)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, 'evict',
+                        lambda keep=None: scans.append(keep) or evict(keep))
+    for i in range(40):
+        cache.put(('k', i), [b'x' * 300])
+        os.utime(cache.path('k', i), (i, i))  # i-th least recently used
+    # first put; 34th (10,200 bytes, down to 9,000); 38th (10,200 again)
+    assert len(scans) == 3
+    assert [i for i in range(40) if cache.get('k', i)] == list(range(8, 40))
+    assert cache._bytes == 9600
@@ -29,8 +29,6 @@ from bokeh.themes import Theme
 
 # External imports
 from math import log10, pi
-from pylab import cm
-from scipy.stats import ks_2samp
 import numpy as np
 import pandas as pd
 
@@ -198,6 +196,7 @@ class CDF:
         return
 
     def ks(self):
+        from scipy.stats import ks_2samp  # heavy, imported on use
         if len(self.series) < 2:
             _l.error('unable to calculate KS statistics: need 2 samples')
             return